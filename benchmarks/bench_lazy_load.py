@@ -0,0 +1,78 @@
+"""
+Benchmark of loading a large conversation tree, fully or only the active path.
+
+The tree has a main branch of `depth` messages, and every message of it has `branches`
+regenerated answers that were continued for `length` messages each.
+
+Usage:
+    python -m benchmarks.bench_lazy_load [depth] [branches] [length]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+from uuid import uuid4
+
+from modules.message_manager import Conversation
+
+
+def message(text: str) -> dict:
+    return {"name": "user", "role": "User", "id": str(uuid4()), "text": text, "time": 1700000000.0, "address": ""}
+
+
+def build_tree(depth: int, branches: int, length: int) -> dict:
+    root = message("main 0")
+    curr = root
+    for level in range(1, depth):
+        curr["children"] = []
+        for branch in range(branches):
+            side = message(f"branch {level}.{branch} " * 20)
+            chain = side
+            for i in range(length - 1):
+                chain["children"] = [message(f"branch {level}.{branch}.{i} " * 20)]
+                chain = chain["children"][0]
+            curr["children"].append(side)
+        main = message(f"main {level}")
+        curr["children"].append(main)
+        curr = main
+
+    return {"id": str(uuid4()), "time": "1700000000.0", "title": "bench", "messages": [root]}
+
+
+def load(data: dict, lazy: bool) -> tuple:
+    conv = Conversation()
+    conv.load_json(data, lazy)
+    return conv, conv.get_active_path()
+
+
+def bench(data: dict, lazy: bool, repeat: int = 5) -> tuple:
+    elapsed = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        load(data, lazy)
+        elapsed = min(elapsed, time.perf_counter() - start)
+
+    # Memory kept by the loaded conversation, measured separately since tracing slows it down
+    gc.collect()
+    tracemalloc.start()
+    conv, path = load(data, lazy)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, memory, len(conv.index), conv.message_count(), len(path)
+
+
+if __name__ == "__main__":
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    branches = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    length = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    data = build_tree(depth, branches, length)
+    full = bench(data, lazy=False)
+    lazy = bench(data, lazy=True)
+    assert full[3] == lazy[3] and full[4] == lazy[4]
+
+    print(f"messages: {full[3]:,}, branches: {(depth - 1) * branches:,}, active path: {full[4]}")
+    print(f"full load: {full[0] * 1000:8.2f} ms, {full[1] / 1024:10,.0f} KiB, {full[2]:,} messages created")
+    print(f"lazy load: {lazy[0] * 1000:8.2f} ms, {lazy[1] / 1024:10,.0f} KiB, {lazy[2]:,} messages created")
+    print(f"speedup:   {full[0] / lazy[0]:.1f}x, memory {full[1] / lazy[1]:.1f}x less")
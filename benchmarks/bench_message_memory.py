@@ -0,0 +1,105 @@
+"""
+Memory benchmark of the Message_Node representation.
+
+Builds the same tree with the old dict based dataclass layout and with the slotted
+Message_Node, and measures what the nodes themselves cost. Ids and texts are created before
+measuring, so only the per-node overhead is compared. The full load of a conversation of the
+same size is measured too.
+
+Usage:
+    python -m benchmarks.bench_message_memory [messages] [branching]
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, List
+from uuid import uuid4
+import gc
+import sys
+import time
+import tracemalloc
+
+from modules.message_manager import Message_Node, Conversation
+
+
+@dataclass
+class LegacyMessageNode:
+    # Message_Node before it was slotted
+    name: str
+    role: str
+    text: str
+    instruct: Optional[str] = None
+    parent: Optional['LegacyMessageNode'] = None
+    children: List['LegacyMessageNode'] = field(default_factory=list)
+    id: str = field(default_factory=lambda: str(uuid4()))
+    time: str = field(default_factory=lambda: datetime.now().timestamp())
+    address: str = field(default="")
+
+
+def build_legacy(ids: list, texts: list, branching: int) -> list:
+    nodes = []
+    for i, (message_id, text) in enumerate(zip(ids, texts)):
+        # Names read from json are separate string objects, not one shared constant
+        parent = nodes[(i - 1) // branching] if i else None
+        node = LegacyMessageNode("".join(["us", "er"]), "".join(["Us", "er"]), text, parent=parent, id=message_id, time=1700000000.0)
+        if parent is not None:
+            parent.children.append(node)
+        nodes.append(node)
+    return nodes
+
+
+def build_slotted(ids: list, texts: list, branching: int) -> list:
+    nodes = []
+    for i, (message_id, text) in enumerate(zip(ids, texts)):
+        parent = nodes[(i - 1) // branching] if i else None
+        node = Message_Node("".join(["us", "er"]), "".join(["Us", "er"]), text, parent=parent, id=message_id, time=1700000000.0)
+        if parent is not None:
+            parent.add_child(node)
+        nodes.append(node)
+    return nodes
+
+
+def measure(func, *args) -> tuple:
+    gc.collect()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, memory
+
+
+def conversation_json(count: int, branching: int) -> dict:
+    messages = [{"name": "user", "role": "User", "id": str(uuid4()), "text": f"message {i}",
+                 "time": 1700000000.0, "address": ""} for i in range(count)]
+    for i in range(1, count):
+        messages[(i - 1) // branching].setdefault("children", []).append(messages[i])
+    return {"id": str(uuid4()), "time": "1700000000.0", "title": "bench", "messages": [messages[0]]}
+
+
+def load(data: dict) -> Conversation:
+    conv = Conversation()
+    conv.load_json(data)
+    return conv
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    branching = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    ids = [str(uuid4()) for _ in range(count)]
+    texts = [f"message {i}" for i in range(count)]
+
+    legacy_time, legacy_memory = measure(build_legacy, ids, texts, branching)
+    slotted_time, slotted_memory = measure(build_slotted, ids, texts, branching)
+    load_time, load_memory = measure(load, conversation_json(count, branching))
+
+    print(f"messages: {count:,}, children per message: {branching}")
+    print(f"dataclass nodes: {legacy_memory / count:6.0f} bytes/message, {legacy_time * 1000:7.1f} ms")
+    print(f"slotted nodes:   {slotted_memory / count:6.0f} bytes/message, {slotted_time * 1000:7.1f} ms")
+    print(f"saved:           {(legacy_memory - slotted_memory) / 2**20:.1f} MiB ({legacy_memory / slotted_memory:.1f}x less)")
+    print(f"Conversation.load_json: {load_memory / count:.0f} bytes/message with index and addresses, {load_time * 1000:.1f} ms")
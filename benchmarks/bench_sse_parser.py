@@ -0,0 +1,113 @@
+"""
+Microbenchmark of the llama-server stream parsing in Model.generate_stream.
+
+Compares the old iter_lines() -> decode -> json.loads loop against SSEParser on a
+synthetic stream split into socket sized chunks.
+
+Usage:
+    python -m benchmarks.bench_sse_parser [tokens] [chunk_size]
+"""
+import json
+import sys
+import time
+
+from modules.sse_parser import iter_sse_events, DeltaEvent, FinishEvent
+
+
+def build_stream(tokens: int) -> bytes:
+    # Compact separators, same as the json llama-server writes
+    frames = []
+    for i in range(tokens):
+        chunk = {"choices": [{"finish_reason": None, "index": 0, "delta": {"content": f" tok{i}"}}],
+                 "created": 1700000000, "id": "chatcmpl-bench", "model": "bench",
+                 "system_fingerprint": "b0000", "object": "chat.completion.chunk"}
+        frames.append(b"data: " + json.dumps(chunk, separators=(",", ":")).encode("utf-8") + b"\n\n")
+        if i % 64 == 0:
+            frames.append(b": keep-alive\n\n")
+
+    final = {"choices": [{"finish_reason": "stop", "index": 0, "delta": {}}],
+             "timings": {"prompt_n": 10, "predicted_n": tokens}}
+    frames.append(b"data: " + json.dumps(final, separators=(",", ":")).encode("utf-8") + b"\n\n")
+    frames.append(b"data: [DONE]\n\n")
+    return b"".join(frames)
+
+
+def split_chunks(stream: bytes, chunk_size: int) -> list:
+    return [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+
+def iter_lines(chunks):
+    # Same splitting as requests.Response.iter_lines()
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+            pending = lines.pop()
+        else:
+            pending = None
+        yield from lines
+    if pending is not None:
+        yield pending
+
+
+def old_loop(chunks):
+    count = 0
+    for line in iter_lines(chunks):
+        if line:
+            try:
+                decoded_line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                continue
+
+            if decoded_line.startswith("data: "):
+                try:
+                    data_json = json.loads(decoded_line[6:])
+                except json.JSONDecodeError:
+                    continue
+
+                if data_json["choices"][0]["finish_reason"] == "stop":
+                    return count
+
+                delta_content = data_json["choices"][0]["delta"].get("content", "")
+                if delta_content:
+                    count += 1
+    return count
+
+
+def new_loop(chunks):
+    count = 0
+    for event in iter_sse_events(chunks):
+        if type(event) is DeltaEvent:
+            if event.content:
+                count += 1
+        elif type(event) is FinishEvent:
+            continue
+        else:
+            break
+    return count
+
+
+def bench(func, chunks, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(chunks)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+
+    chunks = split_chunks(build_stream(tokens), chunk_size)
+    assert old_loop(chunks) == new_loop(chunks) == tokens
+
+    old_time = bench(old_loop, chunks)
+    new_time = bench(new_loop, chunks)
+    print(f"tokens: {tokens}, chunk size: {chunk_size}")
+    print(f"iter_lines loop: {old_time * 1000:.2f} ms ({tokens / old_time:,.0f} tokens/s)")
+    print(f"SSEParser:       {new_time * 1000:.2f} ms ({tokens / new_time:,.0f} tokens/s)")
+    print(f"speedup:         {old_time / new_time:.2f}x")
@@ -0,0 +1,89 @@
+"""
+Benchmark of ordering a large Drawflow workflow into levels with Workflow.get_node_tree.
+
+Compares the old loop, which went over every node once per node, against the leveled Kahn
+scheduler on generated graphs. Every node needs up to `fan_in` random nodes of earlier layers.
+
+Usage:
+    python -m benchmarks.bench_workflow_schedule [nodes] [layers] [fan_in]
+"""
+import importlib.util
+import os
+import random
+import sys
+import time
+
+# webui.py shadows the webui folder as a module, so load the workflow manager from its file
+MAIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location("workflow_manager", os.path.join(MAIN_DIR, "webui", "workflow_manager.py"))
+workflow_manager = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(workflow_manager)
+
+
+def build_drawflow(nodes: int, layers: int, fan_in: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    per_layer = max(1, nodes // layers)
+    data = {}
+    for i in range(1, nodes + 1):
+        data[str(i)] = {"id": i, "name": "string.concat_string", "data": {}, "inputs": {}, "outputs": {"output_1": {"connections": []}}}
+
+    for i in range(per_layer + 1, nodes + 1):
+        layer_start = ((i - 1) // per_layer) * per_layer
+        for port in range(1, rng.randint(1, fan_in) + 1):
+            need = rng.randint(1, layer_start)
+            data[str(i)]["inputs"][f"input_{port}"] = {"connections": [{"node": str(need), "input": "output_1"}]}
+            data[str(need)]["outputs"]["output_1"]["connections"].append({"node": str(i), "output": f"input_{port}"})
+
+    return {"drawflow": {"Home": {"data": data}}}
+
+
+def old_node_tree(nodes: list) -> list:
+    # get_node_tree before the leveled scheduler
+    node_tree = []
+    old_seen = set()
+    new_seen = set()
+    for i in range(len(nodes)):
+        node_tree.append([])
+        for node in nodes:
+            if (str(node.id) in new_seen):
+                continue
+
+            set_needs = set([need["node"] for need in node.needs])
+
+            if (not set_needs.issubset(old_seen) and set_needs != old_seen):
+                continue
+
+            node_tree[i].append(node)
+            new_seen.add(str(node.id))
+        old_seen = new_seen
+
+    return [level for level in node_tree if level != []]
+
+
+def bench(func, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    layers = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    fan_in = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    workflow = workflow_manager.Workflow()
+    workflow.load_workflow(build_drawflow(nodes, layers, fan_in))
+    workflow.convert_to_nodes()
+    connections = sum(len(node.needs) for node in workflow.nodes)
+
+    new_time = bench(workflow.get_node_tree)
+    old_time = bench(lambda: old_node_tree(workflow.nodes), repeat=1)
+
+    print(f"nodes: {nodes}, connections: {connections}, levels: {len(workflow.node_tree)}")
+    print(f"longest chain: {max(workflow.critical_path.values())} nodes")
+    print(f"old loop:          {old_time * 1000:.2f} ms")
+    print(f"leveled scheduler: {new_time * 1000:.2f} ms")
+    print(f"speedup:           {old_time / new_time:.1f}x")
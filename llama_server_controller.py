@@ -2,9 +2,16 @@ import requests
 import os
 import subprocess
 import signal
+import threading
+import time
 import psutil
 
 import settings
+from modules.http_client import LlamaHTTPClient
+from modules.slot_scheduler import SlotScheduler
+from modules.readiness import ReadinessWatcher, format_startup_timings
+from modules.launch_profiles import LaunchProfile, get_profile
+from modules.metrics import LLAMA_LOAD_PERCENT, LLAMA_WARMUP_DONE
 
 class LlamaServerController:
     """
@@ -14,54 +21,131 @@ class LlamaServerController:
         llama_server_path (str): The path to the llama-server executable.
         output_file (str): The path to the output file for logging.
         port (int): The port to run llama-server on. Default is 5050.
+        process (Optional[subprocess.Popen]): The llama-server process started by run().
+        parallel (int): Number of parallel slots llama-server is started with. Default is 1.
+        client (LlamaHTTPClient): Pooled keep-alive http client shared by every request to this llama-server.
+        scheduler (SlotScheduler): Hands out llama-server slots to concurrent requests.
+        launched (threading.Event): Set once run() started the llama-server process.
+        startup_history (list): Startup timing breakdown of every launch, see wait_until_ready().
+        readiness (Optional[ReadinessWatcher]): Follows the log of the last launch, see load_progress.
     """
-    def __init__(self, llama_server_path, port = 5050):
+    def __init__(self, llama_server_path, port = 5050, parallel: int = 1, pool_size: int = 8,
+                 connect_timeout: float = 3.0, read_timeout: float = 300.0, connect_retries: int = 3,
+                 log_file: str = "llama_server_log.txt"):
         self.llama_server_path = llama_server_path
-        self.output_file = os.path.join(settings.MAIN_DIR, "llama_server_log.txt")
+        self.output_file = os.path.join(settings.MAIN_DIR, log_file)
+        self.process = None
+        self.model_path = None
+        self.devices = None
+        self.profile = None
         self.running = False
         self.port = port
+        self.parallel = parallel
         self.API_URL = f'http://localhost:{self.port}/v1/chat/completions'
+        self.client = LlamaHTTPClient(f"http://127.0.0.1:{self.port}", pool_size=pool_size,
+                                      connect_timeout=connect_timeout, read_timeout=read_timeout,
+                                      connect_retries=connect_retries)
+        self.scheduler = SlotScheduler(parallel)
 
-    def run(self, vision : bool, llm_path : str, devices : str = "cuda0", *args):
+        self.launched = threading.Event()
+        self.launch_time = None
+        self.startup_history = []
+        self.readiness = None
+
+    def run(self, vision : bool, llm_path : str, devices : str = "cuda0", *args, profile: LaunchProfile = None):
         """
         Start llama server
+
+        Args:
+            vision (bool): Whether to load a multimodal projector, its path is the first of args.
+            llm_path (str): Path to the gguf model file.
+            devices (str): Devices llama-server runs on. (e.g. "cuda0" or "Vulkan0,Vulkan1")
+            profile (Optional[LaunchProfile]): Performance settings. Default is the tuned profile
+                        saved for the model file, or the "default" profile.
         """
         print("Controller starting up...")
-        # TODO: Add model settings support
+        if profile is None:
+            profile = get_profile(model_path=llm_path)
+
+        # Kept so the same llama-server can be restarted
+        self.vision = vision
+        self.model_path = llm_path
+        self.devices = devices
+        self.run_args = args
+        self.profile = profile
+
         command = [self.llama_server_path,
                     "--model", llm_path,
                     "--port", str(self.port),
-                    "--device", devices,
-                    "-t", "7",
-                    "-ncmoe", "10",
-                    "-b", "2048", 
-                    "-ub", "1024",
-                    "-ctk", "q8_0", # TODO: Add support for custom quatization
-                    "-ctv", "q8_0",
-                    "-ngl", "49",
-                    "--no-mmap",
-                    "-fa", "1",
-                    "-c", "32768"]
-        
+                    "--parallel", str(self.parallel),
+                    "--device", devices]
+        command += profile.to_args(devices)
+
         # Support for vision
         if vision:
             command.append("--mmproj")
             command.append(args[0])
-        
-        # Support for multiple GPUs
-        if ','  in devices:
-            command.append("-ts")
-            command.append("3,3")
 
         # Start llama-server
+        self.launch_time = time.monotonic()
         with open(self.output_file, 'w') as f:
             self.process = subprocess.Popen(command, stdout=f, stderr=subprocess.STDOUT, text=True)
             self.running = True
+        self.launched.set()
+
+    def wait_until_ready(self, timeout: float = None) -> dict:
+        """
+        Blocks until llama-server is ready, following its log instead of polling on a timer.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait after launch. Default waits forever.
+
+        Returns:
+            dict: Startup timing breakdown of this launch, {stage: seconds since launch}.
+
+        Raises:
+            LlamaServerStartError: If llama-server exited or did not get ready in time.
+        """
+        self.printed_quarter = 0
+        self.printed_warmup = False
+        self.readiness = ReadinessWatcher(self, on_progress=self.report_progress)
+        timings = self.readiness.wait(timeout)
+        self.startup_history.append(timings)
+        print(f"llama-server on port {self.port} is ready: {format_startup_timings(timings)}")
+        return timings
 
-    def get_health(self):
+    @property
+    def load_progress(self) -> dict:
+        """
+        Returns:
+            dict: {"stage", "load_percent", "warmup_done"} of the last launch, see ReadinessWatcher.
+        """
+        if self.readiness is None:
+            return {"stage": "stopped", "load_percent": 0, "warmup_done": False}
+        return dict(self.readiness.progress)
+
+    def report_progress(self, progress: dict):
+        """
+        Publishes the load progress of llama-server to the metrics gauges, printing every quarter.
+        """
+        LLAMA_LOAD_PERCENT.labels(self.port).set(progress["load_percent"])
+        LLAMA_WARMUP_DONE.labels(self.port).set(1 if progress["warmup_done"] else 0)
+
+        quarter = progress["load_percent"] // 25
+        if progress["stage"] == "tensors" and quarter > self.printed_quarter:
+            self.printed_quarter = quarter
+            print(f"llama-server on port {self.port} loaded {progress['load_percent']}% of the model")
+        if progress["warmup_done"] and not self.printed_warmup:
+            self.printed_warmup = True
+            print(f"llama-server on port {self.port} finished warming up")
+
+    def get_health(self, verbose: bool = True):
         """
         Check status of llama-server
 
+        Args:
+            verbose (bool): Whether to print the status.
+
         Returns:
             int: 200 if llama-server is running, 404 if not, 503 if still loading.
         """
@@ -70,19 +154,87 @@ class LlamaServerController:
             return 404
 
         try:
-            response = requests.get(f"http://127.0.0.1:{self.port}/health", stream=False)
-        except requests.exceptions.ConnectionError as e:
-            print(f"Error connecting to llama-server: {e}")
+            response = self.client.get("/health", timeout=(self.client.connect_timeout, 5))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if verbose:
+                print(f"Error connecting to llama-server: {e}")
             return 404
 
         if response.status_code == 503:
-            print("llama-server still loading")
+            if verbose:
+                print("llama-server still loading")
             return 503
         else:
-            print("llama-server is ready")
+            if verbose:
+                print("llama-server is ready")
             return 200
 
-    def terminate(self):
+    def get_slot_count(self) -> int:
+        """
+        Ask llama-server how many parallel slots it is running with.
+
+        Returns:
+            int: `total_slots` from /props, or the --parallel value if llama-server did not answer.
+        """
+        try:
+            response = self.client.get("/props", timeout=(self.client.connect_timeout, 5))
+            if response.status_code == 200:
+                return int(response.json().get("total_slots", self.parallel))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error reading llama-server slots: {e}")
+
+        return self.parallel
+
+    def get_slots(self) -> list:
+        """
+        Get the state of every slot of llama-server.
+
+        Returns:
+            list: Slot objects from /slots, each with `id` and `is_processing`. Empty if llama-server did not answer.
+        """
+        try:
+            response = self.client.get("/slots", timeout=(self.client.connect_timeout, 5))
+            if response.status_code == 200:
+                return response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error reading llama-server slots: {e}")
+
+        return []
+
+    def sync_slots(self):
+        """
+        Match the scheduler to the slot count of the running llama-server.
+        """
+        self.scheduler.resize(self.get_slot_count())
+
+    def terminate(self, timeout: float = 10):
+        """
+        Stops the llama-server process started by this controller.
+
+        Other llama-server processes, like the ones of sibling controllers, are left running.
+
+        Args:
+            timeout (float): Seconds to wait for llama-server to exit before killing it.
+        """
+        if self.process is None:
+            return
+
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            print(f"Killed llama-server with {self.process.pid} PID")
+
+        self.process = None
+        self.running = False
+        self.launched.clear()
+        self.client.close()
+
+    @staticmethod
+    def terminate_all():
         """
         Kills all llama-server processes
         """
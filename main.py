@@ -1,5 +1,4 @@
 import os
-import time
 import sys
 import threading
 
@@ -24,28 +23,25 @@ Archivist_settings = Archivist.get_role_settings()
 def main():
     # Wait until llama-server/kobold is ready
     try:
-        while controller.get_health() != 200:
-            print("Waiting for controller to be ready...")
-            time.sleep(2)
+        controller.wait_until_ready()
     except KeyboardInterrupt:
         print("\nInterrupted by user. Exiting.")
         sys.exit(0)
 
     # Initialize conversation
-    conversation_history = []
-    conversation_history.append({"role": "system", "content": Archivist_instruct})
     conversation = Conversation()
+    address = ""
 
     # Conversation loop
     while True:
         # User's turn
         message = input("User: ")
-        conversation_history.append({"role": "user", "content": message})
         temp_message = Message_Node("user", "User", message, "")
-        conversation.add_message(temp_message, "0"*(len(conversation_history)-2))
+        address = conversation.add_message(temp_message, address)
         model_message = ""
 
         # stream printing of model response
+        conversation_history = conversation.get_context(address, Archivist_instruct)
         for message_data, is_last in model.generate_stream(conversation_history, controller, Archivist_settings):
             if is_last:
                 print("\n")
@@ -57,9 +53,8 @@ def main():
         print("\n")
 
         # Saving assistant's response
-        conversation_history.append({"role": "assistant", "content": model_message})
         temp_message = Message_Node("Archivist", "Assistant", model_message, instruct=Archivist_instruct)
-        conversation.add_message(temp_message, "0"*(len(conversation_history)-2))
+        address = conversation.add_message(temp_message, address)
         conversation.save()
 
 
@@ -1,12 +1,14 @@
-import requests
-import json
+import time
+
+from modules.sse_parser import iter_sse_events, DeltaEvent, FinishEvent
+from modules.metrics import TIME_TO_FIRST_TOKEN, INTER_TOKEN_LATENCY, record_timings
 
 
 class Model:
     def __init__(self):
         pass
             
-    def generate(self, conversation, controller, settings: dict) -> str:
+    def generate(self, conversation, controller, settings: dict, id_slot: int = None) -> str:
         """
         Generates a response from the model using the conversation history and settings.
 
@@ -14,6 +16,7 @@ class Model:
             conversation (dict): Conversation in OpenAI Completion API format
             controller (LlamaServerController): LlamaServerController object
             settings (dict): Settings for the model
+            id_slot (Optional[int]): llama-server slot to run on, from controller.scheduler. Default lets llama-server pick.
 
         Returns:
             str: Response from the model
@@ -23,22 +26,21 @@ class Model:
         """
 
         # Send prompt and settings to llama-server
-        response = requests.post(
-            controller.API_URL,
-            headers={"Content-Type": "application/json"},
+        response = controller.client.post(
+            "/v1/chat/completions",
             json={
                 "messages": conversation,
                 "stream": False,
+                "id_slot": -1 if id_slot is None else id_slot,
+                "cache_prompt": True,
                 "temperature": settings["temperature"],
                 "top_p": settings["top_p"],
                 "top_k": settings["top_k"],
                 "min_p": settings["min_p"],
                 "frequency_penalty": settings["frequency_penalty"],
                 "presence_penalty": settings["presence_penalty"],
-            }, 
-            stream=True)
+            })
 
-        total = ""
         # Return response from llama-server
         if response.status_code == 200:
             data = response.json() 
@@ -47,67 +49,94 @@ class Model:
             print(f"Error: {response.status_code}")
             return response.status_code
 
-    def generate_stream(self, conversation : dict, controller, settings: dict):
+    def generate_stream(self, conversation : dict, controller, settings: dict, id_slot: int = None,
+                        timings: dict = None):
         """
         Generates a response from the model using the conversation history and settings.
 
         Args:
             conversation (dict): Conversation in OpenAI Completion API format
             controller (LlamaServerController): LlamaServerController object
-            settings (dict): Settings for the model
+            settings (dict): Settings for the model. A max_length above 0 caps the tokens generated.
+            id_slot (Optional[int]): llama-server slot to run on, from controller.scheduler. Default lets llama-server pick.
+            timings (Optional[dict]): Filled with the timings object llama-server sends at the end of the stream.
 
         Yields:
             str: Response from the model in tokens.
+            \n\tThe last yield is the number of tokens predicted, once generation stops for any
+            finish reason (stop, length, tool_calls, etc).
 
         Raises:
             Exception: Failure returned by llama-server. Usually malformed conversation or settings.
         """
+        start = time.perf_counter()
+        body = {
+            "messages": conversation,
+            "stream": True,
+            "id_slot": -1 if id_slot is None else id_slot,
+            "cache_prompt": True,
+            "temperature": settings["temperature"],
+            "top_p": settings["top_p"],
+            "top_k": settings["top_k"],
+            "min_p": settings["min_p"],
+            "frequency_penalty": settings["frequency_penalty"],
+            "presence_penalty": settings["presence_penalty"],
+        }
+        # Caps the answer to the tokens plan_context() kept free for it, otherwise it runs until the context is full
+        if int(settings.get("max_length") or 0) > 0:
+            body["max_tokens"] = int(settings["max_length"])
+
         # Send prompt and settings to llama-server
-        response = requests.post(
-            controller.API_URL,
-            headers={"Content-Type": "application/json"},
-            json={
-                "messages": conversation,
-                "stream": True,
-                "temperature": settings["temperature"],
-                "top_p": settings["top_p"],
-                "top_k": settings["top_k"],
-                "min_p": settings["min_p"],
-                "frequency_penalty": settings["frequency_penalty"],
-                "presence_penalty": settings["presence_penalty"],
-            }, 
-            stream=True)
+        response = controller.client.post("/v1/chat/completions", json=body, stream=True)
 
-        total = ""
-        if response.status_code == 200:
-            # 
-            for line in response.iter_lines():
-                if line:
-                    # Decode line from bytes to string
-                    try:
-                        decoded_line = line.decode('utf-8')
-                    except UnicodeDecodeError:
-                        print(f"\nWarning: Could not decode line as UTF-8: {line}")
-                        continue
-                    
-                    # Get dict data 
-                    if decoded_line.startswith("data: "):
-                        try:
-                            data_json = json.loads(decoded_line[6:])
-                        except json.JSONDecodeError:
-                            print(f"\nError decoding JSON: {decoded_line}")
-                            continue
-                        
-                        # End of stream
-                        if data_json["choices"][0]["finish_reason"] == "stop":
-                            yield data_json["timings"]["predicted_n"], True
-                            break
-                        
-                        # The token string generated
-                        delta_content = data_json["choices"][0]["delta"].get("content", "")
-                        if delta_content:
-                            yield delta_content, False
-        else:
-            print(f"Error: {response.status_code}")
-            return response.status_code
+        # Closing the response hands the connection back to the pool for the next turn
+        # Token gaps are recorded in one go at the end to keep the token loop cheap, also when the client left early
+        token_gaps = []
+        try:
+            if response.status_code != 200:
+                print(f"Error: {response.status_code}")
+                return response.status_code
+
+            finish = None
+            tokens = 0
+            last_token = None
+            for event in iter_sse_events(response.iter_content(chunk_size=None)):
+                # The token string generated
+                if type(event) is DeltaEvent:
+                    if event.content:
+                        now = time.perf_counter()
+                        if last_token is None:
+                            TIME_TO_FIRST_TOKEN.observe(now - start)
+                        else:
+                            token_gaps.append(now - last_token)
+                        last_token = now
+
+                        tokens += 1
+                        yield event.content, False
+
+                # Generation stopped (stop, length, tool_calls, etc), timings may still follow
+                elif type(event) is FinishEvent:
+                    if finish is None:
+                        finish = event
+                    else:
+                        finish.timings = event.timings or finish.timings
+                        finish.usage = event.usage or finish.usage
+
+                # End of stream
+                else:
+                    break
+
+            # Stream ended without finish_reason, the server closed the connection
+            if finish is None:
+                finish = FinishEvent("")
+
+            record_timings(finish.timings)
+            if timings is not None:
+                timings.update(finish.timings)
+
+            predicted_n = finish.timings.get("predicted_n", finish.usage.get("completion_tokens", tokens))
+            yield predicted_n, True
+        finally:
+            INTER_TOKEN_LATENCY.observe_many(token_gaps)
+            response.close()
 
@@ -0,0 +1,171 @@
+"""
+Finds the fastest llama-server launch profile for a model on this machine.
+
+Every combination of the parameter grid is launched, fed a fixed prompt set and measured
+with the prompt processing and generation tokens/s llama-server reports. The best profile
+is saved per model file and used by LlamaServerController.run() from then on.
+
+Usage:
+    python -m modules.autotune Qwen3-30B-A3B-Instruct-2507-UD-Q4_K_XL.gguf \\
+        --devices none --base cpu --grid threads=4,8 batch_size=512,2048 cache_type_k=f16,q8_0
+"""
+from dataclasses import fields, replace
+from itertools import product
+import argparse
+import os
+
+import settings
+from llama_server_controller import LlamaServerController
+from modules.launch_profiles import LaunchProfile, get_profile, save_profile
+
+# Fixed prompt set, one short chat turn and one long document so both phases get measured
+PROMPTS = [
+    "Explain the difference between a process and a thread in a few sentences.",
+    "Summarize the following notes.\n" + ("The archive stores conversations as trees of messages, "
+                                          "each branch is an edit or a regenerated answer. ") * 60,
+]
+
+METRICS = ["generation", "prompt", "both"]
+
+
+def parse_grid(grid_args: list[str]) -> dict:
+    """
+    Parses name=value1,value2 arguments into a parameter grid.
+
+    Args:
+        grid_args (list[str]): Arguments like "threads=4,8". Names are LaunchProfile fields.
+
+    Returns:
+        dict: {field name: [values]} with values converted to the field type.
+
+    Raises:
+        ValueError: If a name is not a LaunchProfile field.
+    """
+    types = {field.name: field.type for field in fields(LaunchProfile)}
+    grid = {}
+    for grid_arg in grid_args:
+        name, values = grid_arg.split("=", 1)
+        if name not in types:
+            raise ValueError(f"Unknown launch parameter: {name}. Available: {list(types)}")
+
+        field_type = types[name]
+        if field_type in (bool, "bool"):
+            grid[name] = [value.lower() in ("1", "true", "on") for value in values.split(",")]
+        elif field_type in (int, "int"):
+            grid[name] = [int(value) for value in values.split(",")]
+        else:
+            grid[name] = values.split(",")
+    return grid
+
+
+def measure(controller: LlamaServerController, n_predict: int) -> dict:
+    """
+    Runs the prompt set once and averages the speeds llama-server reports.
+
+    Returns:
+        dict: {"prompt_per_second": float, "predicted_per_second": float}
+    """
+    prompt_speeds = []
+    generation_speeds = []
+    for prompt in PROMPTS:
+        response = controller.client.post("/completion", json={
+            "prompt": prompt,
+            "n_predict": n_predict,
+            "cache_prompt": False,
+            "temperature": 0,
+        })
+        response.raise_for_status()
+        timings = response.json()["timings"]
+        prompt_speeds.append(timings["prompt_per_second"])
+        generation_speeds.append(timings["predicted_per_second"])
+
+    return {
+        "prompt_per_second": round(sum(prompt_speeds) / len(prompt_speeds), 2),
+        "predicted_per_second": round(sum(generation_speeds) / len(generation_speeds), 2),
+    }
+
+
+def score(results: dict, metric: str) -> float:
+    if metric == "generation":
+        return results["predicted_per_second"]
+    if metric == "prompt":
+        return results["prompt_per_second"]
+    # Geometric mean, so neither phase can be traded away completely
+    return (results["predicted_per_second"] * results["prompt_per_second"]) ** 0.5
+
+
+def autotune(model_path: str, grid: dict, devices: str = "none", base: LaunchProfile = None,
+             metric: str = "both", port: int = 5099, n_predict: int = 64, timeout: float = 600) -> tuple:
+    """
+    Launches llama-server with every profile of the grid and returns the fastest.
+
+    Args:
+        model_path (str): Path to the gguf model file.
+        grid (dict): {LaunchProfile field: [values]} to sweep.
+        devices (str): Devices llama-server runs on. "none" runs on the CPU only.
+        base (Optional[LaunchProfile]): Values for the fields not in the grid. Default is "default".
+        metric (str): What to optimize, one of "generation", "prompt" or "both".
+        port (int): Port used for the test llama-server.
+        n_predict (int): Tokens generated per prompt.
+        timeout (float): Seconds to wait for each launch to be ready.
+
+    Returns:
+        tuple: (best LaunchProfile, its results, list of (profile, results) for every run)
+    """
+    base = base or get_profile("default")
+    llama_server_path = os.path.join(settings.LLAMA_CPP_DIR, "llama-server")
+    controller = LlamaServerController(llama_server_path, port, log_file="llama_server_autotune_log.txt")
+
+    names = list(grid)
+    runs = []
+    best = None
+    best_results = None
+    for values in product(*(grid[name] for name in names)):
+        profile = replace(base, **dict(zip(names, values)))
+        print(f"Testing {dict(zip(names, values))}")
+
+        try:
+            controller.run(False, model_path, devices, profile=profile)
+            startup = controller.wait_until_ready(timeout)
+            results = measure(controller, n_predict)
+            results["load_seconds"] = startup.get("ready")
+        except Exception as e:
+            # Settings that do not fit the machine (e.g. out of memory) are skipped
+            print(f"Failed: {e}")
+            continue
+        finally:
+            controller.terminate()
+
+        print(f"  prompt {results['prompt_per_second']} tokens/s, generation {results['predicted_per_second']} tokens/s")
+        runs.append((profile, results))
+        if best is None or score(results, metric) > score(best_results, metric):
+            best = profile
+            best_results = results
+
+    return best, best_results, runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the fastest llama-server launch profile for a model.")
+    parser.add_argument("model", help="Model file name in the llms directory, or a full path")
+    parser.add_argument("--grid", nargs="+", required=True, help="Parameters to sweep, e.g. threads=4,8 ubatch_size=256,512")
+    parser.add_argument("--devices", default="none", help="Devices for llama-server, default runs on the CPU only")
+    parser.add_argument("--base", default="default", help="Named profile for the parameters not in the grid")
+    parser.add_argument("--metric", default="both", choices=METRICS)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--n-predict", type=int, default=64)
+    parser.add_argument("--no-save", action="store_true", help="Only print the best profile")
+    args = parser.parse_args()
+
+    model_path = args.model if os.path.isabs(args.model) else os.path.join(settings.LLMS_DIR, args.model)
+    best, best_results, runs = autotune(model_path, parse_grid(args.grid), args.devices, get_profile(args.base),
+                                        args.metric, args.port, args.n_predict)
+
+    if best is None:
+        print("No profile could be launched")
+    else:
+        print(f"Best profile: {best.to_json()}")
+        print(f"Results: {best_results}")
+        if not args.no_save:
+            save_profile(model_path, best, best_results)
+            print(f"Saved for {os.path.basename(model_path)}")
@@ -0,0 +1,184 @@
+"""
+Index of the saved conversations, kept next to them in the memory directory.
+
+Usage:
+    python -m modules.catalog --rebuild
+"""
+import argparse
+import os
+import sqlite3
+import threading
+
+import settings
+
+CATALOG_FILE = "catalog.db"
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+class ConversationCatalog:
+    """
+    SQLite catalog of the conversations saved in a memory directory.
+
+    Lists conversations with their title and times without opening their files, and answers
+    whether a conversation is saved with one primary key lookup. Conversation.save() keeps
+    it up to date.
+
+    Attributes:
+        directory (str): The memory directory the conversations are saved in.
+        path (str): Path to the SQLite database.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, CATALOG_FILE)
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        is_new = not os.path.exists(self.path)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL DEFAULT '',
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                size INTEGER NOT NULL DEFAULT 0
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated DESC)")
+        self.connection.commit()
+
+        # Memory directories from before the catalog existed
+        if is_new:
+            self.rebuild()
+
+    def update(self, conv_id: str, title: str, created: float, updated: float, message_count: int, size: int):
+        """
+        Adds a conversation to the catalog or updates its entry.
+
+        Args:
+            conv_id (str): Id of the conversation.
+            title (str): Title of the conversation.
+            created (float): Time the conversation was created, in unix format.
+            updated (float): Time of the last save, in unix format.
+            message_count (int): Number of messages in the conversation.
+            size (int): Bytes the conversation takes on disk.
+        """
+        with self.lock:
+            self.connection.execute("""
+                INSERT INTO conversations (id, title, created, updated, message_count, size)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET title = excluded.title, updated = excluded.updated,
+                    message_count = excluded.message_count, size = excluded.size""",
+                (conv_id, title, created, updated, message_count, size))
+            self.connection.commit()
+
+    def remove(self, conv_id: str):
+        with self.lock:
+            self.connection.execute("DELETE FROM conversations WHERE id = ?", (conv_id,))
+            self.connection.commit()
+
+    def exists(self, conv_id: str) -> bool:
+        """
+        Whether a conversation is saved.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM conversations WHERE id = ?", (conv_id,)).fetchone()
+        return row is not None
+
+    def list(self, limit: int = 50, offset: int = 0) -> list[dict]:
+        """
+        Lists saved conversations, the most recently updated first.
+
+        Args:
+            limit (int): Maximum number of conversations returned.
+            offset (int): Number of conversations to skip, for paging.
+
+        Returns:
+            list[dict]: {"id", "title", "created", "updated", "message_count", "size"} of every conversation.
+        """
+        with self.lock:
+            rows = self.connection.execute("""
+                SELECT id, title, created, updated, message_count, size FROM conversations
+                ORDER BY updated DESC LIMIT ? OFFSET ?""", (limit, offset)).fetchall()
+
+        keys = ("id", "title", "created", "updated", "message_count", "size")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def count(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def rebuild(self) -> int:
+        """
+        Replaces the catalog with the conversations found in the memory directory.
+
+        Every conversation is loaded, so this is slow on a large directory.
+
+        Returns:
+            int: Number of conversations added.
+        """
+        # Imported here, message_manager imports this module
+        from modules.message_manager import Conversation
+
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".json"):
+                continue
+
+            conv = Conversation()
+            try:
+                conv.load(os.path.join(self.directory, file_name))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Skipping {file_name}: {e}")
+                continue
+
+            updated = max(os.path.getmtime(path) for path in conv.journal.paths())
+            entries.append((conv.conv_id, conv.title, conv.time, updated, len(conv.index), conv.journal.size()))
+            conv.journal.close()
+
+        with self.lock:
+            self.connection.execute("DELETE FROM conversations")
+            self.connection.executemany("""
+                INSERT OR REPLACE INTO conversations (id, title, created, updated, message_count, size)
+                VALUES (?, ?, ?, ?, ?, ?)""", entries)
+            self.connection.commit()
+
+        return len(entries)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def get_catalog(directory: str = None) -> ConversationCatalog:
+    """
+    Gets the catalog of a memory directory, opened once per directory.
+
+    Args:
+        directory (Optional[str]): The memory directory. Default is settings.MEMORY_DIR.
+
+    Returns:
+        ConversationCatalog: The shared catalog of the directory.
+    """
+    directory = directory or settings.MEMORY_DIR
+    with _catalogs_lock:
+        catalog = _catalogs.get(directory)
+        if catalog is None:
+            catalog = _catalogs[directory] = ConversationCatalog(directory)
+    return catalog
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the conversation catalog of the memory directory.")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the catalog from the saved conversations")
+    parser.add_argument("--directory", default=settings.MEMORY_DIR)
+    args = parser.parse_args()
+
+    catalog = get_catalog(args.directory)
+    if args.rebuild:
+        print(f"Catalog rebuilt with {catalog.rebuild()} conversations")
+    else:
+        print(f"{catalog.count()} conversations in {catalog.path}")
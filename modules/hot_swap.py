@@ -0,0 +1,195 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
+from llama_server_controller import LlamaServerController
+
+
+class HotSwapController:
+    """
+    Switches llama-server models without downtime.
+
+    A new model is started on a second port next to the running one. Traffic moves over
+    only once it is ready, and the old llama-server is stopped after its in-flight streams
+    finish. The last warm_pool_size models can stay loaded, so switching back to one of
+    them costs no load time. Every warm model keeps its memory, so size the pool to what
+    the devices can hold.
+
+    Attribute access falls through to the active LlamaServerController, so it can be used
+    anywhere a controller is expected. Callers that make several calls for one request
+    should use select() once, so a switch cannot happen in between, and release() the
+    controller once the request is done. An old llama-server is only stopped once every
+    request that selected it was released.
+
+    Attributes:
+        llama_server_path (str): The path to the llama-server executable.
+        base_port (int): First port used, the others are the next free ports after it.
+        warm_pool_size (int): Number of models kept loaded, the active one included. Minimum is 1.
+        parallel (int): Number of parallel slots of every llama-server.
+        drain_timeout (float): Seconds to wait for in-flight requests before stopping an old llama-server.
+        warm (OrderedDict): {model_path: LlamaServerController} of loaded models, least recently used first.
+        ready (threading.Event): Set once the first model is active.
+        leases (dict): {LlamaServerController: number of requests that selected it and were not released yet}
+    """
+    def __init__(self, llama_server_path: str, base_port: int = 5050, warm_pool_size: int = 1,
+                 parallel: int = 1, log_file: str = "llama_server_log.txt", drain_timeout: float = 300.0):
+        self.llama_server_path = llama_server_path
+        # Node settings pass the port as text
+        self.base_port = int(base_port)
+        self.warm_pool_size = max(1, warm_pool_size)
+        self.parallel = parallel
+        self.log_file = log_file
+        self.drain_timeout = drain_timeout
+
+        self.active = None
+        self.warm = OrderedDict()
+        self.swap_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.retiring = set()
+        self.leases = {}
+        self.lease_lock = threading.Condition()
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on HotSwapController itself
+        active = self.__dict__.get("active")
+        if active is None:
+            raise AttributeError(f"No llama-server running, cannot get '{name}'")
+        return getattr(active, name)
+
+    def select(self, conv_id: str = None) -> LlamaServerController:
+        """
+        Gets the controller a new request should use, and keeps it running until release().
+
+        Returns:
+            LlamaServerController: The active controller.
+        """
+        with self.lease_lock:
+            controller = self.active
+            if controller is not None:
+                self.leases[controller] = self.leases.get(controller, 0) + 1
+            return controller
+
+    def release(self, controller: LlamaServerController):
+        """
+        Ends a request that got controller from select(), so a retired llama-server can be stopped.
+        """
+        with self.lease_lock:
+            count = self.leases.get(controller, 0) - 1
+            if count > 0:
+                self.leases[controller] = count
+            else:
+                self.leases.pop(controller, None)
+            self.lease_lock.notify_all()
+
+    def _free_port(self) -> int:
+        # Ports of old models still draining are not free yet
+        used = {controller.port for controller in self.warm.values()} | self.retiring
+        port = self.base_port
+        while port in used:
+            port += 1
+        return port
+
+    def _log_file(self, port: int) -> str:
+        if port == self.base_port:
+            return self.log_file
+        name, ext = os.path.splitext(self.log_file)
+        return f"{name}_{port}{ext}"
+
+    def switch_model(self, model_path: str, devices: str = "cuda0", vision: bool = False, *args) -> LlamaServerController:
+        """
+        Makes model_path the active model, loading it next to the current one if needed.
+
+        Blocks until the new llama-server is ready. Requests keep going to the old model
+        until then.
+
+        Args:
+            model_path (str): Path to the gguf model file.
+            devices (str): Devices given to llama-server.
+            vision (bool): Whether to load a multimodal projector, its path is the first of args.
+
+        Returns:
+            LlamaServerController: The new active controller.
+
+        Raises:
+            LlamaServerStartError: If the new llama-server did not start. The old one stays active.
+        """
+        with self.swap_lock:
+            controller = self.warm.get(model_path)
+            replaced = None
+
+            # Warm model that died in the meantime is started again
+            if controller is not None and (controller.process is None or controller.process.poll() is not None):
+                del self.warm[model_path]
+                controller.terminate()
+                controller = None
+
+            # Same model on other devices, the running one keeps serving until the new one is ready
+            if controller is not None and controller.devices != devices:
+                del self.warm[model_path]
+                self.retiring.add(controller.port)
+                replaced = controller
+                controller = None
+
+            if controller is None:
+                port = self._free_port()
+                controller = LlamaServerController(self.llama_server_path, port, parallel=self.parallel,
+                                                   log_file=self._log_file(port))
+                controller.run(vision, model_path, devices, *args)
+                try:
+                    controller.wait_until_ready()
+                except Exception:
+                    controller.terminate()
+                    if replaced is not None:
+                        self.warm[model_path] = replaced
+                        self.retiring.discard(replaced.port)
+                    raise
+                controller.sync_slots()
+                print(f"Loaded {os.path.basename(model_path)} on port {port}")
+
+            # Atomic switch, new requests go to the new model from here on
+            with self.lease_lock:
+                old = self.active
+                self.active = controller
+            self.warm[model_path] = controller
+            self.warm.move_to_end(model_path)
+            self.ready.set()
+
+            # Stop the replaced model and the ones that fell out of the warm pool once their streams are done
+            if replaced is not None:
+                threading.Thread(target=self._retire, args=(replaced,), daemon=True).start()
+            while len(self.warm) > self.warm_pool_size:
+                _, evicted = self.warm.popitem(last=False)
+                self.retiring.add(evicted.port)
+                threading.Thread(target=self._retire, args=(evicted,), daemon=True).start()
+
+            if old is not None and old is not controller:
+                print(f"Switched llama-server from port {old.port} to {controller.port}")
+
+            return controller
+
+    def _retire(self, controller: LlamaServerController):
+        # Requests that selected the controller may not have reached its scheduler yet
+        deadline = time.monotonic() + self.drain_timeout
+        with self.lease_lock:
+            while (self.leases.get(controller, 0) > 0 or controller.scheduler.active > 0
+                   or controller.scheduler.waiting > 0):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"llama-server on port {controller.port} still busy after {self.drain_timeout}s, stopping it")
+                    break
+                # Also checked on a timer, the scheduler does not notify lease_lock
+                self.lease_lock.wait(min(remaining, 0.5))
+        controller.terminate()
+        self.retiring.discard(controller.port)
+
+    def terminate(self):
+        """
+        Stops every llama-server started by this controller.
+        """
+        with self.swap_lock:
+            for controller in self.warm.values():
+                controller.terminate()
+            self.warm.clear()
+            self.active = None
+            self.ready.clear()
@@ -0,0 +1,101 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class LlamaHTTPClient:
+    """
+    Long-lived HTTP client for talking to a single llama-server instance.
+
+    Keeps a pooled keep-alive session so every chat turn reuses an already open
+    TCP connection instead of doing a fresh handshake.
+
+    Attributes:
+        base_url (str): Root url of llama-server. (e.g. http://127.0.0.1:5050)
+        pool_size (int): Max number of kept-alive connections to llama-server.
+        connect_timeout (float): Seconds to wait for a connection to be opened.
+        read_timeout (Optional[float]): Seconds to wait between bytes sent by llama-server. None waits forever.
+        connect_retries (int): Number of times a failed connection attempt is retried.
+        backoff (float): Backoff factor between connection retries in seconds.
+    """
+    def __init__(self, base_url: str, pool_size: int = 8, connect_timeout: float = 3.0,
+                 read_timeout: float = 300.0, connect_retries: int = 3, backoff: float = 0.2):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.connect_retries = connect_retries
+        self.backoff = backoff
+        self.session = self._new_session()
+
+    def _new_session(self) -> requests.Session:
+        # Only retry when the connection could not be opened, the request was never
+        # received by llama-server so it is safe to resend, even for POST.
+        retry = Retry(total=self.connect_retries,
+                      connect=self.connect_retries,
+                      read=0,
+                      status=0,
+                      other=0,
+                      backoff_factor=self.backoff,
+                      allowed_methods=None,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                              max_retries=retry, pool_block=False)
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Content-Type": "application/json"})
+        return session
+
+    def url(self, path: str) -> str:
+        """
+        Builds the full url of an llama-server endpoint.
+
+        Args:
+            path (str): Endpoint path. (e.g. /health)
+
+        Returns:
+            str: Full url of the endpoint.
+        """
+        return self.base_url + "/" + path.lstrip("/")
+
+    def get(self, path: str, timeout=None, **kwargs) -> requests.Response:
+        """
+        Sends a GET request to llama-server through the pooled session.
+
+        Args:
+            path (str): Endpoint path. (e.g. /health)
+            timeout (Optional[tuple]): (connect, read) timeout override.
+
+        Returns:
+            requests.Response: Response from llama-server.
+        """
+        return self.session.get(self.url(path), timeout=timeout or self.timeout, **kwargs)
+
+    def post(self, path: str, json=None, stream: bool = False, timeout=None, **kwargs) -> requests.Response:
+        """
+        Sends a POST request to llama-server through the pooled session.
+
+        Args:
+            path (str): Endpoint path. (e.g. /v1/chat/completions)
+            json (dict): Body of the request.
+            stream (bool): Whether the response body should be streamed.
+            timeout (Optional[tuple]): (connect, read) timeout override.
+
+        Returns:
+            requests.Response: Response from llama-server.
+        """
+        return self.session.post(self.url(path), json=json, stream=stream,
+                                 timeout=timeout or self.timeout, **kwargs)
+
+    @property
+    def timeout(self) -> tuple:
+        return (self.connect_timeout, self.read_timeout)
+
+    def close(self):
+        """
+        Closes all pooled connections. The client can still be used afterwards.
+        """
+        self.session.close()
+        self.session = self._new_session()
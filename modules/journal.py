@@ -0,0 +1,231 @@
+from typing import Optional
+import json
+import os
+import threading
+import time
+
+import settings
+
+
+class ConversationJournal:
+    """
+    Append-only persistence of one conversation.
+
+    Every added, edited or deleted message is one compact json line in memory/<conv_id>.journal,
+    so a save only writes what changed. Once the journal grows past compact_after records, the
+    whole conversation is written as a snapshot to memory/<conv_id>.json in the background and
+    the records it covers are dropped from the journal. Loading reads the snapshot and replays
+    the records after it.
+
+    Every record and the snapshot carry a sequence number ("seq"), so a crash between writing the
+    snapshot and trimming the journal never replays a record twice.
+
+    Attributes:
+        conv_id (str): Id of the conversation.
+        snapshot_path (str): Path to the snapshot file.
+        journal_path (str): Path to the journal file.
+        fsync_interval (float): Seconds between fsyncs of the journal. 0 fsyncs every save.
+        compact_after (int): Number of journal records that starts a compaction.
+        seq (int): Sequence number of the last written record.
+        records (int): Number of records in the journal file.
+    """
+    def __init__(self, conv_id: str, directory: str = None, fsync_interval: float = None, compact_after: int = None):
+        directory = directory or settings.MEMORY_DIR
+        self.conv_id = conv_id
+        self.snapshot_path = os.path.join(directory, conv_id + ".json")
+        self.journal_path = os.path.join(directory, conv_id + ".journal")
+        self.fsync_interval = settings.JOURNAL_FSYNC_INTERVAL if fsync_interval is None else fsync_interval
+        self.compact_after = settings.JOURNAL_COMPACT_RECORDS if compact_after is None else compact_after
+
+        self.lock = threading.Lock()
+        self.file = None
+        self.seq = 0
+        self.records = 0
+        self.last_fsync = time.monotonic()
+        self.fsync_timer = None
+        self.compaction = None
+
+    def exists(self) -> bool:
+        """
+        Whether the conversation has a snapshot on disk.
+        """
+        return os.path.exists(self.snapshot_path)
+
+    def paths(self) -> list[str]:
+        """
+        Returns:
+            list[str]: The snapshot and journal files that exist on disk.
+        """
+        return [path for path in (self.snapshot_path, self.journal_path) if os.path.exists(path)]
+
+    def size(self) -> int:
+        """
+        Returns:
+            int: Bytes the snapshot and journal take on disk.
+        """
+        return sum(os.path.getsize(path) for path in self.paths())
+
+    def append(self, records: list[dict]):
+        """
+        Appends records to the journal.
+
+        The records are flushed right away, fsync happens at most every fsync_interval seconds.
+        Records written in between are synced by a timer, so the last save before an idle period
+        is on disk fsync_interval seconds later at most.
+
+        Args:
+            records (list[dict]): Records with an "op" key. Their "seq" is set here.
+        """
+        if not records:
+            return
+
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.journal_path, "a", encoding="utf-8")
+
+            lines = []
+            for record in records:
+                self.seq += 1
+                record["seq"] = self.seq
+                lines.append(json.dumps(record, separators=(",", ":"), ensure_ascii=False))
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+            self.records += len(records)
+
+            elapsed = time.monotonic() - self.last_fsync
+            if elapsed >= self.fsync_interval:
+                os.fsync(self.file.fileno())
+                self.last_fsync = time.monotonic()
+            elif self.fsync_timer is None:
+                self.fsync_timer = threading.Timer(self.fsync_interval - elapsed, self.sync)
+                self.fsync_timer.daemon = True
+                self.fsync_timer.start()
+
+    def needs_compaction(self) -> bool:
+        """
+        Whether the journal is long enough to compact and no compaction is running.
+        """
+        running = self.compaction is not None and self.compaction.is_alive()
+        return self.records >= self.compact_after and not running
+
+    def compact(self, snapshot, wait: bool = False):
+        """
+        Writes a snapshot of the conversation and drops the journal records it covers.
+
+        Args:
+            snapshot (dict | Iterable[str] | Callable): The conversation from Conversation.get_flat_json(), taken
+                        after the last append. Or json text pieces from Conversation.iter_json() that already hold
+                        "seq", only with wait since they are read from the live conversation. Or a function
+                        called on the compaction thread that returns the conversation with its "seq" set,
+                        see Conversation.get_compaction_snapshot().
+            wait (bool): Whether to write on the calling thread. Default writes in the background.
+        """
+        seq = None
+        if not callable(snapshot):
+            with self.lock:
+                seq = self.seq
+                if isinstance(snapshot, dict):
+                    snapshot["seq"] = seq
+
+        if wait:
+            self._write_snapshot(snapshot, seq)
+            return
+
+        self.compaction = threading.Thread(target=self._write_snapshot, args=(snapshot, seq), daemon=True)
+        self.compaction.start()
+
+    def _write_snapshot(self, snapshot, seq: Optional[int]):
+        if callable(snapshot):
+            snapshot = snapshot()
+            seq = snapshot["seq"]
+
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            if isinstance(snapshot, dict):
+                json.dump(snapshot, file, indent=4)
+            else:
+                file.writelines(snapshot)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        # Keep the records written while the snapshot was saved
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+            tail = [record for record in self._read_records() if record["seq"] > seq]
+            if not tail:
+                if os.path.exists(self.journal_path):
+                    os.remove(self.journal_path)
+            else:
+                tmp_path = self.journal_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as file:
+                    for record in tail:
+                        file.write(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n")
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(tmp_path, self.journal_path)
+            self.records = len(tail)
+
+    def _read_records(self) -> list[dict]:
+        if not os.path.exists(self.journal_path):
+            return []
+
+        records = []
+        with open(self.journal_path, "r", encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Last line can be cut off by a crash during a write
+                    print(f"Skipping broken journal record in {self.journal_path}")
+        return records
+
+    def read(self) -> tuple[Optional[dict], list[dict]]:
+        """
+        Reads the snapshot and the records written after it.
+
+        Returns:
+            tuple: (snapshot dict or None, list of records to replay in order)
+        """
+        snapshot = None
+        if self.exists():
+            with open(self.snapshot_path, "r", encoding="utf-8") as file:
+                snapshot = json.load(file)
+
+        snapshot_seq = snapshot.get("seq", 0) if snapshot else 0
+        with self.lock:
+            tail = [record for record in self._read_records() if record.get("seq", 0) > snapshot_seq]
+            self.seq = max([snapshot_seq] + [record["seq"] for record in tail])
+            self.records = len(tail)
+        return snapshot, tail
+
+    def sync(self):
+        """
+        Forces the journal to disk.
+        """
+        with self.lock:
+            self.fsync_timer = None
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.last_fsync = time.monotonic()
+
+    def close(self):
+        """
+        Waits for a running compaction and closes the journal file.
+        """
+        if self.compaction is not None:
+            self.compaction.join()
+
+        if self.fsync_timer is not None:
+            self.fsync_timer.cancel()
+        self.sync()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,146 @@
+from dataclasses import dataclass, asdict, fields, replace
+from typing import Optional
+import json
+import os
+
+import settings
+
+PROFILES_FILE = os.path.join(settings.MAIN_DIR, "launch_profiles.json")
+
+
+@dataclass
+class LaunchProfile:
+    """
+    Performance settings llama-server is started with.
+
+    Attributes:
+        threads (int): CPU threads used for generation. (-t)
+        batch_size (int): Logical batch size for prompt processing. (-b)
+        ubatch_size (int): Physical batch size for prompt processing. (-ub)
+        n_cpu_moe (int): Number of MoE layers whose experts stay on the CPU. (-ncmoe)
+        n_gpu_layers (int): Number of layers offloaded to the GPU. (-ngl)
+        cache_type_k (str): KV cache quantization of K. (-ctk) (e.g. f16, q8_0, q4_0)
+        cache_type_v (str): KV cache quantization of V. (-ctv)
+        ctx_size (int): Context size shared by all slots. (-c)
+        flash_attn (bool): Whether flash attention is used. (-fa)
+        mmap (bool): Whether the model file is memory mapped.
+        tensor_split (str): How layers are split over several devices. (-ts) Only used with more than one device.
+    """
+    threads: int = 7
+    batch_size: int = 2048
+    ubatch_size: int = 1024
+    n_cpu_moe: int = 10
+    n_gpu_layers: int = 49
+    cache_type_k: str = "q8_0"
+    cache_type_v: str = "q8_0"
+    ctx_size: int = 32768
+    flash_attn: bool = True
+    mmap: bool = False
+    tensor_split: str = "3,3"
+
+    def to_args(self, devices: str = "") -> list[str]:
+        """
+        Converts the profile into llama-server command line arguments.
+
+        Args:
+            devices (str): Devices llama-server runs on, tensor_split is only added for several devices.
+
+        Returns:
+            list[str]: Arguments to append to the llama-server command.
+        """
+        args = ["-t", str(self.threads),
+                "-ncmoe", str(self.n_cpu_moe),
+                "-b", str(self.batch_size),
+                "-ub", str(self.ubatch_size),
+                "-ctk", self.cache_type_k,
+                "-ctv", self.cache_type_v,
+                "-ngl", str(self.n_gpu_layers),
+                "-fa", "1" if self.flash_attn else "0",
+                "-c", str(self.ctx_size)]
+
+        if not self.mmap:
+            args.append("--no-mmap")
+
+        # Support for multiple GPUs
+        if "," in devices:
+            args += ["-ts", self.tensor_split]
+
+        return args
+
+    def to_json(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_json(cls, data: dict) -> "LaunchProfile":
+        names = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in names})
+
+
+# Named profiles, "default" is what llama-server was always started with
+LAUNCH_PROFILES = {
+    "default": LaunchProfile(),
+    "cpu": LaunchProfile(threads=os.cpu_count() or 4, n_cpu_moe=0, n_gpu_layers=0, batch_size=512,
+                         ubatch_size=512, cache_type_k="f16", cache_type_v="f16", flash_attn=False),
+    "low_vram": LaunchProfile(n_cpu_moe=48, n_gpu_layers=99, batch_size=1024, ubatch_size=512,
+                              cache_type_k="q4_0", cache_type_v="q4_0", ctx_size=16384),
+    "max_gpu": LaunchProfile(n_cpu_moe=0, n_gpu_layers=99, batch_size=4096, ubatch_size=2048),
+}
+
+
+def load_saved_profiles() -> dict:
+    """
+    Reads the tuned profiles saved by the autotuner.
+
+    Returns:
+        dict: {model file name: {"profile": dict, "results": dict}}. Empty if nothing was saved.
+    """
+    if not os.path.exists(PROFILES_FILE):
+        return {}
+
+    with open(PROFILES_FILE, "r") as file:
+        return json.load(file)
+
+
+def save_profile(model_path: str, profile: LaunchProfile, results: Optional[dict] = None):
+    """
+    Saves the best profile of a model file, replacing any earlier one.
+
+    Args:
+        model_path (str): Path to the gguf model file. Only the file name is used as key.
+        profile (LaunchProfile): The profile to save.
+        results (Optional[dict]): Measurements the profile was picked with.
+    """
+    profiles = load_saved_profiles()
+    profiles[os.path.basename(model_path)] = {"profile": profile.to_json(), "results": results or {}}
+
+    with open(PROFILES_FILE, "w") as file:
+        json.dump(profiles, file, indent=4)
+
+
+def get_profile(name: str = None, model_path: str = None) -> LaunchProfile:
+    """
+    Gets the profile llama-server should be started with.
+
+    A named profile wins, then the tuned profile saved for the model file, then "default".
+
+    Args:
+        name (Optional[str]): Name of a profile in LAUNCH_PROFILES.
+        model_path (Optional[str]): Path to the gguf model file.
+
+    Returns:
+        LaunchProfile: A copy of the profile, safe to change.
+
+    Raises:
+        KeyError: If name is not a known profile.
+    """
+    if name is not None:
+        if name not in LAUNCH_PROFILES:
+            raise KeyError(f"Unknown launch profile: {name}. Available: {list(LAUNCH_PROFILES)}")
+        return replace(LAUNCH_PROFILES[name])
+
+    if model_path is not None:
+        saved = load_saved_profiles().get(os.path.basename(model_path))
+        if saved is not None:
+            return LaunchProfile.from_json(saved["profile"])
+
+    return replace(LAUNCH_PROFILES["default"])
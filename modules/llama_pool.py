@@ -0,0 +1,268 @@
+from dataclasses import dataclass, field
+from typing import Optional
+import threading
+import time
+
+from llama_server_controller import LlamaServerController
+from modules.launch_profiles import get_profile
+
+
+@dataclass
+class InstanceConfig:
+    """
+    Launch settings of one llama-server in a pool.
+
+    Attributes:
+        model_path (str): Path to the gguf model file.
+        port (int): Port llama-server listens on. Must be unique in the pool.
+        devices (str): Devices given to llama-server. (e.g. "cuda0" or "Vulkan0,Vulkan1")
+        parallel (int): Number of parallel slots. Default is 1.
+        vision (bool): Whether to load a multimodal projector. Default is False.
+        mmproj_path (Optional[str]): Path to the multimodal projector. Needed if vision is True.
+        profile (Optional[str]): Name of the launch profile. Default is the tuned profile of the model.
+    """
+    model_path: str
+    port: int
+    devices: str = "cuda0"
+    parallel: int = 1
+    vision: bool = False
+    mmproj_path: Optional[str] = None
+    profile: Optional[str] = None
+
+
+@dataclass
+class InstanceStatus:
+    """
+    Last known state of one llama-server in a pool.
+
+    Attributes:
+        health (int): 200 if ready, 503 if loading, 404 if not reachable.
+        idle_slots (int): Slots /slots reported as not processing.
+        total_slots (int): Slots /slots reported in total.
+        failures (int): Health checks failed in a row.
+        draining (bool): Whether the instance is being stopped and takes no new requests.
+        checked (float): time.monotonic() of the last check.
+    """
+    health: int = 404
+    idle_slots: int = 0
+    total_slots: int = 0
+    failures: int = 0
+    draining: bool = False
+    checked: float = field(default_factory=time.monotonic)
+
+
+class LlamaServerPool:
+    """
+    Runs several llama-server instances and spreads requests over them.
+
+    Each instance gets its own LlamaServerController, port, devices and model. Requests
+    go to the healthiest, least loaded instance based on /health and /slots. Instances
+    that keep failing health checks are drained and restarted on their own, the others
+    keep serving.
+
+    Attributes:
+        llama_server_path (str): The path to the llama-server executable.
+        configs (list[InstanceConfig]): Launch settings of every instance.
+        controllers (list[LlamaServerController]): Controller of every instance, same order as configs.
+        status (dict): {port: InstanceStatus} from the last health check.
+        max_failures (int): Failed health checks in a row before an instance is restarted.
+        drain_timeout (float): Seconds to wait for in-flight requests before stopping an instance.
+    """
+    def __init__(self, llama_server_path: str, configs: list[InstanceConfig], max_failures: int = 3,
+                 drain_timeout: float = 60.0):
+        ports = [config.port for config in configs]
+        if len(set(ports)) != len(ports):
+            raise ValueError(f"Every llama-server in a pool needs its own port, got {ports}")
+
+        self.llama_server_path = llama_server_path
+        self.configs = configs
+        self.max_failures = max_failures
+        self.drain_timeout = drain_timeout
+
+        self.lock = threading.Lock()
+        self.controllers = []
+        self.status = {}
+        for config in configs:
+            controller = LlamaServerController(llama_server_path, config.port, parallel=config.parallel,
+                                               log_file=f"llama_server_log_{config.port}.txt")
+            self.controllers.append(controller)
+            self.status[config.port] = InstanceStatus(total_slots=config.parallel)
+
+        self.monitor_thread = None
+        self.monitor_stop = threading.Event()
+
+    def _launch(self, controller: LlamaServerController, config: InstanceConfig):
+        args = (config.mmproj_path,) if config.vision else ()
+        profile = get_profile(config.profile, config.model_path)
+        controller.run(config.vision, config.model_path, config.devices, *args, profile=profile)
+
+    def start(self, wait: bool = True):
+        """
+        Starts every llama-server in the pool.
+
+        Args:
+            wait (bool): Whether to block until every instance is ready.
+        """
+        for controller, config in zip(self.controllers, self.configs):
+            self._launch(controller, config)
+
+        if wait:
+            for controller in self.controllers:
+                self.wait_until_ready(controller)
+
+    def wait_until_ready(self, controller: LlamaServerController):
+        controller.wait_until_ready()
+        controller.sync_slots()
+        self.check_instance(controller)
+
+    def check_instance(self, controller: LlamaServerController) -> InstanceStatus:
+        """
+        Updates the status of one instance from /health and /slots.
+
+        Returns:
+            InstanceStatus: The new status of the instance.
+        """
+        status = self.status[controller.port]
+
+        health = controller.get_health(verbose=False)
+        slots = controller.get_slots() if health == 200 else []
+
+        with self.lock:
+            status.health = health
+            status.checked = time.monotonic()
+            if slots:
+                status.total_slots = len(slots)
+                status.idle_slots = sum(1 for slot in slots if not slot.get("is_processing"))
+            else:
+                status.idle_slots = 0
+
+            # A process that exited or a server that stopped answering counts as a failure,
+            # still loading (503) does not
+            exited = controller.process is not None and controller.process.poll() is not None
+            if health == 404 or exited:
+                status.failures += 1
+            else:
+                status.failures = 0
+
+        return status
+
+    def check(self):
+        """
+        Checks every instance and restarts the ones that failed max_failures checks in a row.
+        """
+        for controller in self.controllers:
+            status = self.status[controller.port]
+            if status.draining:
+                continue
+
+            self.check_instance(controller)
+            if status.failures >= self.max_failures:
+                print(f"llama-server on port {controller.port} is unhealthy, restarting")
+                status.draining = True
+                threading.Thread(target=self.restart, args=(controller,), daemon=True).start()
+
+    def select(self, conv_id: str = None) -> LlamaServerController:
+        """
+        Picks the instance a new request should go to.
+
+        Healthy instances that are not draining are ranked by free slots, from the local
+        scheduler and the last /slots check. An instance already caching the conversation
+        is preferred while it has a free slot.
+
+        Args:
+            conv_id (Optional[str]): Conversation of the request, to keep its prompt cache.
+
+        Returns:
+            LlamaServerController: The controller to send the request to.
+
+        Raises:
+            RuntimeError: If no instance is healthy.
+        """
+        best = None
+        best_score = None
+        with self.lock:
+            for controller in self.controllers:
+                status = self.status[controller.port]
+                if status.health != 200 or status.draining:
+                    continue
+
+                # Slots busy with requests that did not come through this pool
+                scheduler = controller.scheduler
+                external_busy = max(0, status.total_slots - status.idle_slots - scheduler.active)
+                free = len(scheduler.free_slots) - scheduler.waiting - external_busy
+                cached = conv_id is not None and any(owner[0] == conv_id for owner in scheduler.owners.values())
+
+                score = (cached and free > 0, free, -scheduler.waiting)
+                if best_score is None or score > best_score:
+                    best = controller
+                    best_score = score
+
+        if best is None:
+            raise RuntimeError("No healthy llama-server in the pool")
+        return best
+
+    def drain(self, controller: LlamaServerController) -> bool:
+        """
+        Stops sending requests to an instance and waits for its in-flight requests.
+
+        Returns:
+            bool: True if every request finished before drain_timeout.
+        """
+        self.status[controller.port].draining = True
+
+        deadline = time.monotonic() + self.drain_timeout
+        while controller.scheduler.active > 0 or controller.scheduler.waiting > 0:
+            if time.monotonic() > deadline:
+                print(f"llama-server on port {controller.port} still busy after {self.drain_timeout}s")
+                return False
+            time.sleep(0.5)
+        return True
+
+    def restart(self, controller: LlamaServerController):
+        """
+        Drains, stops and starts again one instance. Its siblings keep running.
+
+        If the instance does not start, it stays unhealthy and the next check() restarts it again.
+        """
+        config = self.configs[self.controllers.index(controller)]
+        status = self.status[controller.port]
+
+        try:
+            self.drain(controller)
+            controller.terminate()
+            self._launch(controller, config)
+            self.wait_until_ready(controller)
+            with self.lock:
+                status.failures = 0
+        except Exception as e:
+            print(f"llama-server on port {controller.port} failed to restart: {e}")
+            with self.lock:
+                status.health = 404
+        finally:
+            # Back in the health checks either way, a failed instance is restarted on the next one
+            with self.lock:
+                status.draining = False
+
+    def start_monitor(self, interval: float = 10.0):
+        """
+        Checks the pool in a background thread every interval seconds.
+        """
+        if self.monitor_thread is not None:
+            return
+
+        def monitor():
+            while not self.monitor_stop.wait(interval):
+                self.check()
+
+        self.monitor_stop.clear()
+        self.monitor_thread = threading.Thread(target=monitor, daemon=True)
+        self.monitor_thread.start()
+
+    def terminate(self):
+        """
+        Stops the monitor and every llama-server of the pool.
+        """
+        self.monitor_stop.set()
+        self.monitor_thread = None
+        for controller in self.controllers:
+            controller.terminate()
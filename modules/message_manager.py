@@ -1,41 +1,78 @@
+from bisect import bisect_left
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Sequence
 from uuid import uuid4
 import json
 import os
+import re
+import sys
+import threading
 
 import settings 
+from modules.journal import ConversationJournal
+from modules.catalog import get_catalog
 
 MEMORY_DIR = settings.MEMORY_DIR
-
-@dataclass
+ADDRESS_PATTERN = re.compile(r"(\d+(\.\d+)*\.?)?", re.ASCII)
+# Tokens the chat template adds around every message (role header and end of turn), approximate
+MESSAGE_TOKEN_OVERHEAD = 4
+# Role of the messages that summarize the start of a branch, see Conversation.add_summary()
+SUMMARY_ROLE = "Summary"
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+
+@dataclass(slots=True)
 class Message_Node:
     """
     A node in the message tree.
 
+    Slotted and without a per-node list for leaves, since large archives hold hundreds of
+    thousands of nodes. Use add_child() instead of children.append().
+
     Attributes:
-        name (str): The name of sender.
-        role (str): The role of the sender. (User, Assistant, Tool, etc)
+        name (str): The name of sender. Interned, there are only a few different ones.
+        role (str): The role of the sender. (User, Assistant, Tool, etc) Interned.
         text (str): The text of the message.
         id (str): A uuid4 string. Auto-generated.
-        time (str): Time of message in {YYYY-MM-DD HH:MM:SS} format. Auto-generated.
+        time (float): Time of message in unix format. Auto-generated.
         instruct (Optional[str]): The instruction prompt used by the LLM. Default is None.
         parent (Optional[Message_Node]): The parent node of the message. Default is None.
-        children (List[Message_Node]): A list of child nodes of the message. Default is an empty list.
-        address (str): The address of the message in the tree in integers. Read left to right with 0 as first index.
-                    \n\tFor example, "01" represents the second message of the first message, 
-                        "0" represents the first message of the conversation.
+        children (Sequence[Message_Node]): The child nodes of the message. An empty tuple until the first child is added.
+        address (str): The address of the message in the tree, dot separated integers with 0 as first index.
+                    \n\tFor example, "0.1" represents the second message of the first message,
+                        "0" represents the first message of the conversation. See format_address().
+        tokens (Optional[int]): Number of tokens of the text. None until counted, see TokenCounter.
+        tokens_model (Optional[str]): File name of the model that counted tokens. Counts of another
+                    model are counted again. Default is None.
+        summary (Optional[Message_Node]): A message with role SUMMARY_ROLE that summarizes the branch from
+                    the first message up to and including this one. Not one of the children. Default is None.
     """
     name: str
     role: str
     text: str
     instruct: Optional[str] = None # Instructions for LLM only
     parent: Optional['Message_Node'] = None
-    children: List['Message_Node'] = field(default_factory=list)
+    children: Sequence['Message_Node'] = ()
     id: str = field(default_factory=lambda: str(uuid4()))
-    time: str = field(default_factory=lambda: datetime.now().timestamp())
+    time: float = field(default_factory=lambda: datetime.now().timestamp())
     address: str = field(default="")
+    tokens: Optional[int] = None
+    tokens_model: Optional[str] = None
+    summary: Optional['Message_Node'] = None
+
+    def __post_init__(self):
+        self.name = sys.intern(self.name)
+        self.role = sys.intern(self.role)
+
+    def add_child(self, child: 'Message_Node'):
+        """
+        Appends a child node, creating the children list on the first one.
+        """
+        if self.children:
+            self.children.append(child)
+        else:
+            self.children = [child]
 
     def to_json(self):
         data = {}
@@ -47,6 +84,12 @@ class Message_Node:
         data["address"] = self.address
         if self.instruct:
             data["instruct"] = self.instruct
+        if self.tokens is not None:
+            data["tokens"] = self.tokens
+        if self.tokens_model is not None:
+            data["tokens_model"] = self.tokens_model
+        if self.summary is not None:
+            data["summary"] = self.summary.to_json()
         return data
     
     def __str__(self):
@@ -66,6 +109,97 @@ class MessageAddressError(Exception):
         super().__init__(msg)
 
 
+def parse_address(address: str, conv_id: Optional[str] = None) -> tuple[int, ...]:
+    """
+    Parses a message address into its path of child indices.
+
+    Args:
+        address (str): Dot separated indices like "0.12.3". Addresses without a dot and more than one
+                    character are read in the old format, one digit per level. ("013" is "0.1.3")
+                    An already parsed path is returned as is.
+        conv_id (Optional[str]): Conversation id added to the error message.
+
+    Returns:
+        tuple[int, ...]: The index at every level, empty for an empty address.
+
+    Raises:
+        MessageAddressError: If a part of the address is not an integer.
+    """
+    if isinstance(address, tuple):
+        return address
+
+    if "." in address:
+        parts = address[:-1].split(".") if address.endswith(".") else address.split(".")
+    else:
+        parts = list(address)
+
+    # Address must be a string of integers, checked in one pass since deep addresses are long
+    if not ADDRESS_PATTERN.fullmatch(address):
+        bad = next((part for part in parts if not (part.isascii() and part.isdigit())), address)
+        msg = f"Invalid message address. Expected integer, got {bad!r}"
+        raise MessageAddressError(address, msg, conv_id)
+
+    return tuple(map(int, parts))
+
+
+def format_address(path: tuple[int, ...]) -> str:
+    """
+    Converts a path of child indices into its address.
+
+    Indices are joined by dots. A single index of two or more digits gets a trailing dot,
+    so it is not read as an old single digit address. ((12,) is "12.")
+
+    Args:
+        path (tuple[int, ...]): The index at every level.
+
+    Returns:
+        str: The address of the path.
+    """
+    address = ".".join(map(str, path))
+    if len(path) == 1 and path[0] >= 10:
+        address += "."
+    return address
+
+
+def nest_messages(messages: list[dict]) -> list[dict]:
+    """
+    Turns a flat message list (see Conversation.get_flat_json()) into the nested format.
+
+    The json objects are changed in place, "parent" is replaced by "children".
+
+    Args:
+        messages (list[dict]): Messages in conversation order, every parent before its children.
+
+    Returns:
+        list[dict]: The first messages, with their children nested below them.
+    """
+    by_id = {}
+    roots = []
+    for data in messages:
+        by_id[data["id"]] = data
+        parent_id = data.pop("parent", None)
+        if parent_id is None:
+            roots.append(data)
+        else:
+            by_id[parent_id].setdefault("children", []).append(data)
+    return roots
+
+
+def merge_system_prompt(system: str, context: list[dict]) -> list[dict]:
+    """
+    Puts a system prompt before a prompt, in the same system message as a summary at its start.
+
+    Chat templates often only accept one system message, as the first message.
+
+    Returns:
+        list[dict]: A new prompt that starts with the system message.
+    """
+    if context and context[0]["role"] == "system":
+        first = {"role": "system", "content": system + "\n\n" + context[0]["content"]}
+        return [first] + context[1:]
+    return [{"role": "system", "content": system}] + context
+
+
 class Conversation:
     """
     Stores a conversation between a user and an assistant.
@@ -75,9 +209,32 @@ class Conversation:
         conv_id (str): A uuid4 string representing the conversation id. Auto-generated.
         time (datetime): The time the conversation was created, in unix format. Auto-generated.
         title (str): Name of the conversation. Can be LLM generated or user generated/edited.
+        index (dict): {message id: Message_Node} of every message, for lookups without walking the tree.
+        journal (Optional[ConversationJournal]): Where the conversation is saved. Set by the first save() or load().
+        unsaved (list): Journal records of the changes since the last save().
+        pending (dict): {message id: list of child json objects} of messages whose children are not loaded yet.
+                    Only used after a lazy load().
+        context_cache (OrderedDict): {message id: prompt messages from the first message to it}, least recently used first.
+                    See get_context().
+        token_cache (OrderedDict): {message id: running token totals from the first message to it}. See plan_context().
+        context_cache_size (int): Number of branches kept in context_cache and token_cache.
+        summaries (dict): {summary message id: summary Message_Node} of every loaded summary. See add_summary().
+        lock (threading.RLock): Held by every change to the messages, caches and unsaved records, so a
+                    background summary and a request can use the conversation at the same time.
     """
-    def __init__(self):
+    def __init__(self, context_cache_size: int = 16):
         self.messages: List['Message_Node'] = None
+        self.index = {}
+        self.pending = {}
+        self.pending_count = 0
+        self.context_cache = OrderedDict()
+        self.token_cache = OrderedDict()
+        self.context_cache_size = context_cache_size
+        self.summaries = {}
+        self.journal: Optional[ConversationJournal] = None
+        self.unsaved = []
+        self.lock = threading.RLock()
+        self.saved_title = ""
         self.conv_id = str(uuid4())
         self.time = datetime.now().timestamp()
         self.title = ""
@@ -87,9 +244,10 @@ class Conversation:
         Gets a message from the conversation by its address.
 
         Args:
-            address (str): The address of the message in the tree in integers. Read left to right with 0 as first index.
-                        \n\tFor example, "01" represents the second message of the first message, 
+            address (str): The address of the message in the tree, dot separated integers with 0 as first index.
+                        \n\tFor example, "0.1" represents the second message of the first message,
                             "0" represents the first message of the conversation.
+                        \n\tOld single digit addresses like "01" are still accepted.
 
         Returns:
             Message_Node: The message at the specified address.
@@ -103,156 +261,533 @@ class Conversation:
             msg = "No messages in conversation"
             raise MessageAddressError(address, msg, self.conv_id)
 
+        path = parse_address(address, self.conv_id)
+
         # Address must not be empty
-        if (len(address) == 0):
+        if len(path) == 0:
             msg = f"Invalid message address. Expected index less than {len(self.messages)}, got empty string."
             raise MessageAddressError(address, msg, self.conv_id)
-        
-        # Address must be a string of integers
-        try:
-            idx = int(address[0])
-        except (ValueError, TypeError):
-            msg = f"Invalid message address. Expected integer, got {address[0]}"
-            raise MessageAddressError(address, msg, self.conv_id)
 
-        # Start traversal from the first message
-        curr = self.messages[int(address[0])]
-        address = address[1:]
-
-        # Traverse the tree
-        while len(address) > 0:
-            # Address must be a string of integers
-            try:
-                idx = int(address[0])
-            except (ValueError, TypeError):
-                msg = f"Invalid message address. Expected integer, got {address[0]}"
-                raise MessageAddressError(address, msg, self.conv_id)
-            
+        return self._walk(address, path)
+
+    def get_message_by_id(self, message_id: str) -> Message_Node:
+        """
+        Gets a message from the conversation by its id.
+
+        Args:
+            message_id (str): The uuid4 string of the message.
+
+        Returns:
+            Message_Node: The message with the id.
+
+        Raises:
+            MessageAddressError: If there is no message with the id.
+        """
+        message = self.index.get(message_id)
+        if message is None:
+            raise MessageAddressError(message_id, "No message with this id", self.conv_id)
+        return message
+
+    def _walk(self, address: str, path: tuple) -> Message_Node:
+        """
+        Follows a parsed address from the first messages down the tree.
+
+        Raises:
+            MessageAddressError: If an index of the path is out of range.
+        """
+        siblings = self.messages
+        curr = None
+        for idx in path:
             # Address must be in range
-            if (int(address[0]) >= len(curr.children)):
-                msg = f"Invalid message address. Expected index less than {len(curr.children)}, got {int(address[0])}"
+            if idx >= len(siblings):
+                msg = f"Invalid message address. Expected index less than {len(siblings)}, got {idx}"
                 raise MessageAddressError(address, msg, self.conv_id)
 
             # Continue traversal with child node
-            curr = curr.children[int(address[0])]
-            address = address[1:]
+            curr = siblings[idx]
+            if curr.id in self.pending:
+                self._load_children(curr)
+            siblings = curr.children
 
         return curr
 
+    def _node_from_json(self, data: dict, parent: Optional[Message_Node], path: tuple) -> Message_Node:
+        """
+        Creates a message from its json object, without its children.
+        Addresses are rebuilt from the tree position, saved ones may use the old single digit format.
+        """
+        message = Message_Node(data["name"], data["role"], data["text"], parent=parent, id=data["id"],
+                               time=data["time"], address=format_address(path), tokens=data.get("tokens"),
+                               tokens_model=data.get("tokens_model"))
+        if "instruct" in data:
+            message.instruct = data["instruct"]
+        if "summary" in data:
+            summary = data["summary"]
+            message.summary = Message_Node(summary["name"], summary["role"], summary["text"], parent=message,
+                                           id=summary["id"], time=summary["time"], tokens=summary.get("tokens"),
+                                           tokens_model=summary.get("tokens_model"))
+            self.summaries[message.summary.id] = message.summary
+        self.index[message.id] = message
+        return message
+
+    def _load_children(self, message: Message_Node):
+        """
+        Creates the children of a lazily loaded message. Their own children stay pending.
+        """
+        children = self.pending.pop(message.id)
+        path = parse_address(message.address)
+        for idx, child in enumerate(children):
+            child_node = self._node_from_json(child, message, path + (idx,))
+            if child.get("children"):
+                self.pending[child_node.id] = child["children"]
+            message.add_child(child_node)
+        self.pending_count -= len(children)
+
+    def load_all(self):
+        """
+        Loads every pending branch of a lazily loaded conversation.
+        """
+        for _ in self.iter_depth_first():
+            pass
+
+    def iter_depth_first(self, message: Optional[Message_Node] = None):
+        """
+        Walks the tree in conversation order, every message before its children.
+
+        Uses an explicit stack, so a chat of any length can be walked. Pending branches are loaded on the way.
+
+        Args:
+            message (Optional[Message_Node]): First message of the subtree to walk. Default walks the whole conversation.
+
+        Yields:
+            tuple[Message_Node, int]: A message and its depth below the start.
+        """
+        roots = [message] if message is not None else (self.messages or [])
+        stack = [(root, 0) for root in reversed(roots)]
+        while stack:
+            curr, depth = stack.pop()
+            if curr.id in self.pending:
+                self._load_children(curr)
+            yield curr, depth
+            stack.extend((child, depth + 1) for child in reversed(curr.children))
+
+    def get_active_path(self, address: str = "") -> list[Message_Node]:
+        """
+        Gets the branch shown in the chat, loading it if needed.
+
+        The branch follows the address, then the newest child at every level below it.
+
+        Args:
+            address (str): A message the branch must go through. Default starts at the newest first message.
+
+        Returns:
+            list[Message_Node]: The messages of the branch, the first message first.
+        """
+        if not self.messages:
+            return []
+
+        if address:
+            path = self.get_conv_list_nodes(address)
+        else:
+            path = [self.messages[-1]]
+
+        curr = path[-1]
+        while True:
+            if curr.id in self.pending:
+                self._load_children(curr)
+            if not curr.children:
+                break
+            curr = curr.children[-1]
+            path.append(curr)
+        return path
+
+    def get_last_address(self) -> str:
+        """
+        Gets the address of the last message of the branch shown in the chat, see get_active_path().
+
+        Returns:
+            str: The address, empty if the conversation has no messages.
+        """
+        path = self.get_active_path()
+        return path[-1].address if path else ""
+
+    def get_path_json(self, address: str = "") -> dict:
+        """
+        Converts the active path into a json object for the chat, see get_active_path().
+
+        Returns:
+            dict: {"id", "title", "time", "messages"} with the messages of the path in order. Every
+                message also has "siblings", the number of branches at its level, to switch between them.
+        """
+        messages = []
+        for message in self.get_active_path(address):
+            data = message.to_json()
+            data["siblings"] = len(self.messages) if message.parent is None else len(message.parent.children)
+            messages.append(data)
+
+        return {"id": self.conv_id, "title": self.title, "time": str(self.time), "messages": messages}
+
+    def get_conv_list_nodes(self, address: str) -> list[Message_Node]:
+        """
+        Gets the messages that lead to the address starting from 1st message.
+
+        Returns:
+            list[Message_Node]: A list of Message_Node objects.
+        """
+        nodes = []
+        curr = self.get_message(address)
+        while curr is not None:
+            nodes.append(curr)
+            curr = curr.parent
+        nodes.reverse()
+        return nodes
+
+    def message_count(self) -> int:
+        """
+        Returns:
+            int: Number of messages in the conversation, loaded or not.
+        """
+        return len(self.index) + self.pending_count
+
     def add_message(self, message: Message_Node, parent_address: str):
         """
         Adds a message to the conversation at the parent address.
 
         Args:
             message (Message_Node): The message to add.
-            parent_address (str): The address of the parent node in the tree in integers. Read left to right with 0 as first index.
-                        \n\tFor example, "01" represents the second message of the first message, 
+            parent_address (str): The address of the parent node in the tree, dot separated integers with 0 as first index.
+                        \n\tFor example, "0.1" represents the second message of the first message,
                             "0" represents the first message of the conversation.
+                        \n\tAn empty string adds a new first message.
 
-        Raises:
+        Returns:
+            str: The address of the added message.
 
+        Raises:
+            MessageAddressError: If the parent address is invalid or there is no message at it.
         """
-        if not self.messages:
-            # Address must be empty if there are no messages
-            if (len(parent_address) > 0):
-                msg = "Invalid parent address. No inital message in conversation."
-                raise MessageAddressError(parent_address, msg, self.conv_id)
-
-            self.messages = []
-            message.address = "0"
-            self.messages.append(message)
-            return message.address
+        with self.lock:
+            parent_path = parse_address(parent_address, self.conv_id)
+
+            if not self.messages:
+                # Address must be empty if there are no messages
+                if len(parent_path) > 0:
+                    msg = "Invalid parent address. No inital message in conversation."
+                    raise MessageAddressError(parent_address, msg, self.conv_id)
+
+                self.messages = []
+
+            # Add message to beginning of tree
+            if len(parent_path) == 0:
+                message.parent = None
+                message.address = format_address((len(self.messages),))
+                self.messages.append(message)
+                self.index[message.id] = message
+                self.unsaved.append({"op": "add", "parent": None, "message": message.to_json()})
+                return message.address
+
+            # Found parent node
+            # Add message to end of parent node
+            curr = self._walk(parent_address, parent_path)
+            message.parent = curr
+            message.address = format_address(parent_path + (len(curr.children),))
+            curr.add_child(message)
+            self.index[message.id] = message
+            self.unsaved.append({"op": "add", "parent": curr.id, "message": message.to_json()})
 
-        # Add message to beginning of tree
-        if (len(parent_address) == 0):
-            message.address = str(len(self.messages))
-            self.messages.append(message)
             return message.address
 
-        original_parent_address = parent_address
-
-        # Address must be a string of integers
-        try:
-            idx = int(parent_address[0])
-        except (ValueError, TypeError):
-            msg = f"Invalid parent address. Expected integer, got {parent_address[0]}"
-            raise MessageAddressError(parent_address, msg, self.conv_id)
-
-        # Start traversal from the first message
-        curr = self.messages[int(parent_address[0])]
-        parent_address = parent_address[1:]
-
-        # Traverse the tree
-        while len(parent_address) > 0:
-            # Address must be a string of integers
-            try:
-                idx = int(parent_address[0])
-            except (ValueError, TypeError):
-                msg = f"Invalid parent address. Expected integer, got {parent_address[0]}"
-                raise MessageAddressError(parent_address, msg, self.conv_id)
-            
-            # Address must be in range
-            if (int(parent_address[0]) >= len(curr.children)):
-                msg = f"Invalid parent address. Expected index less than {len(curr.children)}, got {int(parent_address[0])}"
-                raise MessageAddressError(parent_address, msg, self.conv_id)
+    def edit_message(self, message_address: str, text: str) -> Message_Node:
+        """
+        Changes the text of a message in place.
 
-            curr = curr.children[int(parent_address[0])]
-            parent_address = parent_address[1:]
+        Args:
+            message_address (str): The address of the message in the tree, dot separated integers with 0 as first index.
+            text (str): The new text of the message.
+
+        Returns:
+            Message_Node: The edited message.
+
+        Raises:
+            MessageAddressError: If there is no message at the address.
+        """
+        with self.lock:
+            message = self.get_message(message_address)
+            message.text = text
+            message.tokens = None
+            self._invalidate_context(message)
+            self.unsaved.append({"op": "edit", "id": message.id, "text": text})
+            return message
 
-        # Found parent node
-        # Add message to end of parent node
-        message.parent = curr
-        message.address = original_parent_address + str(len(curr.children))
-        curr.children.append(message)
+    def get_context(self, address: str, system: Optional[str] = None) -> list[dict]:
+        """
+        Builds the prompt for a branch, in OpenAI chat format.
 
-        return message.address
+        If a message before the address has a summary, the deepest one replaces the messages it
+        covers, as a system message at the start. See add_summary().
+
+        The prompts of recently used branches are cached, so the next turn on a branch only
+        converts the messages added since. Edits and deletes drop the cached prompts they change.
+
+        Args:
+            address (str): Address of the last message of the branch.
+            system (Optional[str]): System prompt put before the messages.
+
+        Returns:
+            list[dict]: [{"role": ..., "content": ...}] from the first message to the address. A new list, safe to change.
+
+        Raises:
+            MessageAddressError: If there is no message at the address.
+        """
+        with self.lock:
+            message = self.get_message(address)
+
+            # Walk up until a message whose prompt is cached, or one whose branch is summarized
+            new_messages = []
+            curr = message
+            prefix = []
+            while curr is not None:
+                cached = self.context_cache.get(curr.id)
+                if cached is not None:
+                    self.context_cache.move_to_end(curr.id)
+                    prefix = cached
+                    break
+                if curr.summary is not None and curr is not message:
+                    prefix = [{"role": "system", "content": SUMMARY_HEADER + curr.summary.text}]
+                    break
+                new_messages.append(curr)
+                curr = curr.parent
+
+            context = prefix + [{"role": node.role.lower(), "content": node.text} for node in reversed(new_messages)]
+
+            self.context_cache[message.id] = context
+            self.context_cache.move_to_end(message.id)
+            while len(self.context_cache) > self.context_cache_size:
+                self.context_cache.popitem(last=False)
+
+            if system is not None:
+                return merge_system_prompt(system, context)
+            return list(context)
+
+    def _invalidate_context(self, message: Message_Node):
+        """
+        Drops the cached prompts and token totals of the branches that go through a message.
+        """
+        for cache in (self.context_cache, self.token_cache):
+            for message_id in list(cache):
+                curr = self.index.get(message_id)
+                while curr is not None and curr is not message:
+                    curr = curr.parent
+                if curr is message:
+                    cache.pop(message_id, None)
+
+    def set_tokens(self, message: Message_Node, tokens: int, model: Optional[str] = None):
+        """
+        Saves the token count of a message, so it is not counted again while the model stays the same.
+
+        Args:
+            message (Message_Node): The counted message.
+            tokens (int): Number of tokens of the message text.
+            model (Optional[str]): File name of the model that counted them.
+        """
+        with self.lock:
+            # Recounted for another model, the running totals of its branches are stale
+            if message.tokens is not None and message.tokens != tokens:
+                self.token_cache.clear()
+            message.tokens = tokens
+            message.tokens_model = model
+            self.unsaved.append({"op": "tokens", "id": message.id, "tokens": tokens, "model": model})
+
+    def get_token_sums(self, address: str) -> list[int]:
+        """
+        Gets the running token totals of a branch, including MESSAGE_TOKEN_OVERHEAD per message.
+
+        Like get_context(), the deepest summary before the address counts as the first message.
+
+        Cached like get_context(), so the next turn on a branch only adds the new messages.
+
+        Args:
+            address (str): Address of the last message of the branch.
+
+        Returns:
+            list[int]: Total tokens from the first message up to and including every message of the branch.
+
+        Raises:
+            ValueError: If a message of the branch has no token count, see TokenCounter.count_branch().
+        """
+        with self.lock:
+            message = self.get_message(address)
+
+            # Walk up until a message whose totals are cached, or one whose branch is summarized
+            new_messages = []
+            curr = message
+            sums = []
+            while curr is not None:
+                cached = self.token_cache.get(curr.id)
+                if cached is not None:
+                    self.token_cache.move_to_end(curr.id)
+                    sums = list(cached)
+                    break
+                if curr.summary is not None and curr is not message:
+                    new_messages.append(curr.summary)
+                    break
+                new_messages.append(curr)
+                curr = curr.parent
+
+            total = sums[-1] if sums else 0
+            for node in reversed(new_messages):
+                if node.tokens is None:
+                    raise ValueError(f"Message {node.address or node.id} has no token count")
+                total += node.tokens + MESSAGE_TOKEN_OVERHEAD
+                sums.append(total)
+
+            self.token_cache[message.id] = sums
+            self.token_cache.move_to_end(message.id)
+            while len(self.token_cache) > self.context_cache_size:
+                self.token_cache.popitem(last=False)
+            return sums
+
+    def get_unsummarized(self, address: str) -> tuple[Optional[Message_Node], list[Message_Node]]:
+        """
+        Gets the deepest summary before the address and the messages of the branch after it.
+
+        Returns:
+            tuple: (summary Message_Node or None, list of the messages after the summary up to the address)
+        """
+        nodes = []
+        curr = self.get_message(address)
+        while curr is not None:
+            if curr.summary is not None and nodes:
+                nodes.reverse()
+                return curr.summary, nodes
+            nodes.append(curr)
+            curr = curr.parent
+        nodes.reverse()
+        return None, nodes
+
+    def add_summary(self, address: str, text: str, name: str = "Archivist", tokens: Optional[int] = None,
+                    tokens_model: Optional[str] = None) -> Message_Node:
+        """
+        Stores a summary of the branch from the first message up to and including the message at the address.
+
+        The prompts of later messages use the summary instead of the messages it covers, see get_context().
+        A message has at most one summary, a new one replaces the old one.
+
+        Args:
+            address (str): Address of the last message the summary covers.
+            text (str): The summary.
+            name (str): Name of the sender of the summary.
+            tokens (Optional[int]): Number of tokens of the summary, if already counted.
+            tokens_model (Optional[str]): File name of the model that counted tokens.
+
+        Returns:
+            Message_Node: The summary message, with role SUMMARY_ROLE.
+
+        Raises:
+            MessageAddressError: If there is no message at the address.
+        """
+        with self.lock:
+            message = self.get_message(address)
+            if message.summary is not None:
+                self.summaries.pop(message.summary.id, None)
+
+            summary = Message_Node(name, SUMMARY_ROLE, text, parent=message, tokens=tokens, tokens_model=tokens_model)
+            message.summary = summary
+            self.summaries[summary.id] = summary
+            self._invalidate_context(message)
+            self.unsaved.append({"op": "summary", "id": message.id, "message": summary.to_json()})
+            return summary
+
+    def plan_context(self, address: str, context_size: int, reserve: int = 0, system_tokens: int = 0) -> int:
+        """
+        Finds how many of the newest messages of a branch fit the context of the model.
+
+        Uses the cached running totals and a binary search, nothing is tokenized again.
+
+        Args:
+            address (str): Address of the last message of the branch.
+            context_size (int): Context size of the llama-server slot, in tokens.
+            reserve (int): Tokens kept free for the answer. (e.g. max_length)
+            system_tokens (int): Tokens of the system prompt.
+
+        Returns:
+            int: Number of messages, counted back from the address, that fit. 0 if not even the last one fits.
+
+        Raises:
+            ValueError: If a message of the branch has no token count.
+        """
+        sums = self.get_token_sums(address)
+        available = context_size - reserve - system_tokens
+        total = sums[-1]
+        if total <= available:
+            return len(sums)
+
+        # First message i with total - sums[i] <= available, the messages after it fit
+        first = bisect_left(sums, total - available)
+        return len(sums) - first - 1
         
     def delete_message(self, message_address: str):
         """
         Deletes a message from the conversation by its address.
 
         If the message has children, they will be deleted as well.
+        The later siblings of the message move up one index, so their addresses change.
 
         Args:
-            message_address (str): The address of the message in the tree in integers. Read left to right with 0 as first index.
-                        \n\tFor example, "01" represents the second message of the first message, 
+            message_address (str): The address of the message in the tree, dot separated integers with 0 as first index.
+                        \n\tFor example, "0.1" represents the second message of the first message,
                             "0" represents the first message of the conversation.
+
+        Raises:
+            MessageAddressError: If there is no message at the address.
         """
-        # Conversation must have messages
-        if not self.messages:
-            msg = "No messages to delete"
-            raise MessageAddressError(message_address, msg, self.conv_id)
-        
-        # Address must be a string of integers
-        try:
-            idx = int(message_address[0])
-        except (ValueError, TypeError):
-            msg = f"Invalid message address. Expected integer, got {message_address[0]}"
-            raise MessageAddressError(message_address, msg, self.conv_id)
-
-        # Start traversal from the first message
-        curr = self.messages[int(message_address[0])]
-        message_address = message_address[1:]
-        while len(message_address) > 1:
-            # Address must be a string of integers
-            try:
-                idx = int(message_address[0])
-            except (ValueError, TypeError):
-                msg = f"Invalid message address. Expected integer, got {message_address[0]}"
+        with self.lock:
+            # Conversation must have messages
+            if not self.messages:
+                msg = "No messages to delete"
                 raise MessageAddressError(message_address, msg, self.conv_id)
-            
-            # Address must be in range
-            if (int(message_address[0]) >= len(curr.children)):
-                msg = f"Invalid message address. Expected index less than {len(curr.children)}, got {int(message_address[0])}"
+
+            path = parse_address(message_address, self.conv_id)
+            if len(path) == 0:
+                msg = "Invalid message address. Expected an address, got empty string."
                 raise MessageAddressError(message_address, msg, self.conv_id)
-            
-            # Continue traversal with child node
-            curr = curr.children[int(message_address[0])]
-            message_address = message_address[1:]
-        
-        # Found message
-        # Delete message from parent node
-        curr.children.pop(int(message_address))
+
+            # Found message
+            message = self._walk(message_address, path)
+            siblings = self.messages if message.parent is None else message.parent.children
+            idx = path[-1]
+
+            # Delete message from parent node
+            siblings.pop(idx)
+            for node in self.iter_subtree(message):
+                self.index.pop(node.id, None)
+                self.context_cache.pop(node.id, None)
+                self.token_cache.pop(node.id, None)
+                if node.summary is not None:
+                    self.summaries.pop(node.summary.id, None)
+            self.unsaved.append({"op": "delete", "id": message.id})
+
+            # Renumber the later siblings and their subtrees
+            for sibling_idx in range(idx, len(siblings)):
+                self._renumber(siblings[sibling_idx], path[:-1] + (sibling_idx,))
+
+    def _renumber(self, message: Message_Node, path: tuple):
+        """
+        Sets the address of a message and its subtree from its position in the tree.
+        """
+        stack = [(message, path)]
+        while stack:
+            curr, curr_path = stack.pop()
+            curr.address = format_address(curr_path)
+            for idx, child in enumerate(curr.children):
+                stack.append((child, curr_path + (idx,)))
+
+    def iter_subtree(self, message: Message_Node):
+        """
+        Yields a message and every message below it.
+        """
+        for curr, _ in self.iter_depth_first(message):
+            yield curr
 
     def get_message_children(self, message_address: str) -> str:
         """
@@ -263,17 +798,8 @@ class Conversation:
         """
         if not self.messages:
             return ""
-        
-        if len(message_address) == 1:
-            return str(len(self.messages[int(message_address)].children))
 
-        def get_conv_list_helper(curr: Message_Node, level):
-            if level < len(message_address)-1:
-                get_conv_list_helper(curr.children[int(message_address[level+1])], level+1)
-            else:
-                return str(len(curr.children))
-
-        get_conv_list_helper(self.messages[int(message_address[0])], 0)
+        return str(len(self.get_message(message_address).children))
 
     def get_conv_list(self) -> list[Message_Node]:
         """
@@ -287,18 +813,8 @@ class Conversation:
         """
         if not self.messages:
             return []
-        
-        # Helper function to recursively get the list
-        data = []
-        def get_conv_list_helper(curr: Message_Node, level):
-            data.append(curr.to_json())
-            for child in curr.children:
-                get_conv_list_helper(child, level+1)
-
-        # Traverse the tree
-        for i in range(len(self.messages)):
-            get_conv_list_helper(self.messages[i], 0)
-        return data
+
+        return [message.to_json() for message, _ in self.iter_depth_first()]
     
     def get_conv_list_from_address(self, address: str) -> list[Message_Node]:
         """
@@ -309,28 +825,17 @@ class Conversation:
         """
         if not self.messages:
             return []
-        
-        if len(address) == 1:
-            return [self.messages[int(address)]]
-        
-        conv_list = []
 
-        def get_conv_list_helper(curr: Message_Node, level):
-            conv_list.append(curr.to_json())
+        return [message.to_json() for message in self.get_conv_list_nodes(address)]
 
-            if len(address) <= level:
-                get_conv_list_helper(curr.children[int(address[level+1])], level+1)
-
-        get_conv_list_helper(self.messages[int(address[0])], 0)
-
-        return conv_list
-
-    def load_json(self, json_data: dict):
+    def load_json(self, json_data: dict, lazy: bool = False):
         """
         Loads a conversation from a json object.
 
         Args:
             json_data (dict): The json object to load the conversation from.
+            lazy (bool): Whether to only create the active path (see get_active_path()) and the
+                        siblings along it. Other branches are created when they are first used.
 
         Example:
         {
@@ -360,22 +865,48 @@ class Conversation:
         self.time = float(json_data["time"])
         self.messages = []
         self.title = json_data["title"]
+        self.saved_title = self.title
+        self.index = {}
+        self.pending = {}
+        self.pending_count = 0
+        self.context_cache.clear()
+        self.token_cache.clear()
+        self.summaries = {}
+        self.unsaved = []
+
+        roots = json_data["messages"]
+        if json_data.get("format") == "flat":
+            roots = nest_messages(roots)
+
+        if lazy:
+            for idx, data in enumerate(roots):
+                message = self._node_from_json(data, None, (idx,))
+                if data.get("children"):
+                    self.pending[message.id] = data["children"]
+                self.messages.append(message)
+
+            # Messages not created yet, counted without creating them
+            stack = list(self.pending.values())
+            while stack:
+                children = stack.pop()
+                self.pending_count += len(children)
+                stack.extend(child["children"] for child in children if child.get("children"))
+
+            self.get_active_path()
+            return
 
-        # Helper function to recursively read the json
-        def json_to_conversation_helper(curr):
-            message = Message_Node(curr["name"], curr["role"], curr["text"], id=curr["id"], time=curr["time"],address=curr["address"])
-            if "instruct" in curr:
-                message.instruct = curr["instruct"]
-
-            if "children" in curr:
-                message.children = []
-                for child in curr["children"]:
-                    message.children.append(json_to_conversation_helper(child))
-            return message
+        # Traverse the json with a stack of (json object, parent node, path)
+        stack = [(data, None, (idx,)) for idx, data in reversed(list(enumerate(roots)))]
+        while stack:
+            data, parent, path = stack.pop()
+            message = self._node_from_json(data, parent, path)
+            if parent is None:
+                self.messages.append(message)
+            else:
+                parent.add_child(message)
 
-        # Traverse the json
-        for message in json_data["messages"]:
-            self.messages.append(json_to_conversation_helper(message))
+            children = data.get("children", ())
+            stack.extend((child, message, path + (idx,)) for idx, child in reversed(list(enumerate(children))))
 
     def print_tree(self):
         """
@@ -384,16 +915,9 @@ class Conversation:
         if not self.messages:
             print("No messages")
             return
-        
-        # Helper function to recursively print the tree
-        def print_tree_helper(curr, level):
-            print(f"{level * ' '}{curr.name} ({curr.role})")
-            for child in curr.children:
-                print_tree_helper(child, level + 1)
-        
-        # Traverse the tree
-        for i in range(len(self.messages)):
-            print_tree_helper(self.messages[i], 0)
+
+        for message, depth in self.iter_depth_first():
+            print(f"{depth * ' '}{message.name} ({message.role})")
 
     def get_json(self):
         """
@@ -435,40 +959,192 @@ class Conversation:
         data_json["messages"] = []
         data_json["title"] = self.title
 
-        # Helper function to recursively traverse the conversation tree
-        def get_json_helper(curr):
-            data = curr.to_json()
-            if curr.children:
+        # Traverse the tree with a stack of (message, its json object)
+        stack = []
+        for message in self.messages:
+            data = message.to_json()
+            data_json["messages"].append(data)
+            stack.append((message, data))
+
+        while stack:
+            curr, data = stack.pop()
+            # Branches that were never loaded are copied as they were read
+            if curr.id in self.pending:
+                data["children"] = self.pending[curr.id]
+            elif curr.children:
                 data["children"] = []
                 for child in curr.children:
-                    data["children"].append(get_json_helper(child))
-                    curr = child
-            return data
-
-        # Traverse the tree
-        for message in self.messages:
-            data_json["messages"].append(get_json_helper(message))
+                    child_data = child.to_json()
+                    data["children"].append(child_data)
+                    stack.append((child, child_data))
 
         return data_json
+
+    def _iter_flat(self):
+        """
+        Yields the json object of every message in conversation order, with the id of its parent
+        instead of its children. Pending branches are read from their json without loading them.
+        """
+        stack = [(message, None) for message in reversed(self.messages or [])]
+        while stack:
+            curr, parent_id = stack.pop()
+            if type(curr) is dict:
+                data = {key: value for key, value in curr.items() if key != "children"}
+                children = curr.get("children", ())
+            else:
+                data = curr.to_json()
+                children = self.pending.get(curr.id, curr.children)
+            data["parent"] = parent_id
+            yield data
+            stack.extend((child, data["id"]) for child in reversed(children))
+
+    def get_flat_json(self) -> dict:
+        """
+        Converts the conversation to a json object with a flat message list.
+
+        Unlike get_json(), the result is not nested, so it can be written with json.dump at any
+        conversation length. Saved snapshots use this format.
+
+        Returns:
+            dict: {"id", "time", "title", "format": "flat", "messages"} with every message in conversation
+                order and a "parent" id, None for first messages.
+        """
+        return {"id": self.conv_id, "time": str(self.time), "title": self.title, "format": "flat",
+                "messages": list(self._iter_flat())}
+
+    def iter_json(self, flat: bool = False, extra: Optional[dict] = None, chunk_size: int = 65536):
+        """
+        Encodes the conversation as json text piece by piece, without building the whole json object.
+
+        Used to write a conversation straight to a file or an http response.
+
+        Args:
+            flat (bool): Whether to use the get_flat_json() format. Default is the nested get_json() format.
+            extra (Optional[dict]): More top level keys to write.
+            chunk_size (int): Characters collected before a piece is yielded.
+
+        Yields:
+            str: Pieces of the json text.
+        """
+        header = {"id": self.conv_id, "time": str(self.time), "title": self.title}
+        if flat:
+            header["format"] = "flat"
+        header.update(extra or {})
+
+        parts = [json.dumps(header)[:-1] + ', "messages": [']
+        size = len(parts[0])
+
+        for text in (self._iter_flat_text() if flat else self._iter_nested_text()):
+            parts.append(text)
+            size += len(text)
+            if size >= chunk_size:
+                yield "".join(parts)
+                parts = []
+                size = 0
+
+        parts.append("]}")
+        yield "".join(parts)
+
+    def _iter_flat_text(self):
+        first = True
+        for data in self._iter_flat():
+            yield json.dumps(data) if first else ", " + json.dumps(data)
+            first = False
+
+    def _iter_nested_text(self):
+        # Stack of (message or pending json object, first in its list), or CLOSE after the last child
+        CLOSE = None
+        stack = [(message, idx == 0) for idx, message in reversed(list(enumerate(self.messages or [])))]
+        while stack:
+            curr, first = stack.pop()
+            if curr is CLOSE:
+                yield "]}"
+                continue
+
+            if type(curr) is dict:
+                data = {key: value for key, value in curr.items() if key != "children"}
+                children = curr.get("children", ())
+            else:
+                data = curr.to_json()
+                children = self.pending.get(curr.id, curr.children)
+
+            text = json.dumps(data)
+            if not first:
+                text = ", " + text
+            if not children:
+                yield text
+                continue
+
+            # Leave the object open for its children
+            yield text[:-1] + ', "children": ['
+            stack.append((CLOSE, False))
+            stack.extend((child, idx == 0) for idx, child in reversed(list(enumerate(children))))
+
+    def write_json(self, file, flat: bool = False):
+        """
+        Writes the conversation as json to an open text file, see iter_json().
+        """
+        for chunk in self.iter_json(flat):
+            file.write(chunk)
     
     def save(self):
         """
-        Saves the conversation to a json file in the memory directory
+        Saves the changes since the last save to the journal in the memory directory.
+
+        The first save writes a full snapshot, later saves only append one record per change,
+        so saving costs the same no matter how long the conversation is. See ConversationJournal.
         """
-        if not self.messages:
-            print("No messages to save")
-            return
+        with self.lock:
+            if self.journal is None:
+                self.journal = ConversationJournal(self.conv_id)
+
+            # First save, or the snapshot was removed
+            if not self.journal.exists():
+                if not self.messages:
+                    print("No messages to save")
+                    return
+
+                self.journal.compact(self.iter_json(flat=True, extra={"seq": self.journal.seq}), wait=True)
+                self.unsaved = []
+                self.saved_title = self.title
+            else:
+                if self.title != self.saved_title:
+                    self.unsaved.append({"op": "title", "title": self.title})
+                    self.saved_title = self.title
+
+                self.journal.append(self.unsaved)
+                self.unsaved = []
 
-        file_path = os.path.join(settings.MEMORY_DIR, self.conv_id + ".json")
-        with open(file_path, "w") as file:
-            json.dump(self.get_json(), file, indent=4)
+                # The snapshot is taken on the compaction thread, see get_compaction_snapshot()
+                if self.messages and self.journal.needs_compaction():
+                    self.journal.compact(self.get_compaction_snapshot)
 
-    def load(self, json_path: str):
+        catalog = get_catalog(os.path.dirname(self.journal.snapshot_path))
+        catalog.update(self.conv_id, self.title, self.time, datetime.now().timestamp(), self.message_count(), self.journal.size())
+
+    def get_compaction_snapshot(self) -> dict:
         """
-        Loads a conversation from a json file.
+        Gets the conversation for a background compaction, see ConversationJournal.compact().
+
+        Unsaved changes are appended first, so none of them is replayed on top of the snapshot.
+
+        Returns:
+            dict: The flat json of the conversation, with the "seq" of the last journal record it covers.
+        """
+        with self.lock:
+            self.journal.append(self.unsaved)
+            self.unsaved = []
+            snapshot = self.get_flat_json()
+            snapshot["seq"] = self.journal.seq
+            return snapshot
+
+    def load(self, json_path: str, lazy: bool = False):
+        """
+        Loads a conversation from its snapshot json file and replays its journal.
 
         Args:
             json_path (str): The path to the json file.
+            lazy (bool): Whether to only create the active path, see load_json().
 
         Raises:
             FileNotFoundError: If the file does not exist.
@@ -476,26 +1152,80 @@ class Conversation:
         if not json_path.endswith(".json"):
             raise FileNotFoundError("File is not json")
 
-        json_data = {}
-        with open(json_path, "r") as file:
-            json_data = json.load(file)
+        # Outside the lock, a running compaction takes it for its snapshot
+        if self.journal is not None:
+            self.journal.close()
+
+        with self.lock:
+            conv_id = os.path.basename(json_path)[:-5]
+            self.journal = ConversationJournal(conv_id, os.path.dirname(json_path))
+            json_data, records = self.journal.read()
+            if json_data is None:
+                raise FileNotFoundError(f"No conversation saved at {json_path}")
+
+            self.load_json(json_data, lazy)
+            for record in records:
+                self.apply_record(record)
+            self.unsaved = []
+
+    def apply_record(self, record: dict):
+        """
+        Replays one journal record on the conversation.
+
+        Args:
+            record (dict): A record written by save(). ("add", "edit", "delete", "tokens", "summary" or "title")
+        """
+        op = record["op"]
+
+        # Record about a branch that was not loaded yet
+        target = record.get("parent") if op == "add" else record.get("id")
+        if target is not None and target not in self.index and self.pending:
+            self.load_all()
+
+        if op == "add":
+            data = record["message"]
+            message = Message_Node(data["name"], data["role"], data["text"], instruct=data.get("instruct"),
+                                   id=data["id"], time=data["time"], tokens=data.get("tokens"),
+                                   tokens_model=data.get("tokens_model"))
+            parent_address = "" if record["parent"] is None else self.index[record["parent"]].address
+            self.add_message(message, parent_address)
+        elif op == "edit":
+            self.edit_message(self.index[record["id"]].address, record["text"])
+        elif op == "delete":
+            self.delete_message(self.index[record["id"]].address)
+        elif op == "tokens":
+            message = self.index.get(record["id"]) or self.summaries[record["id"]]
+            message.tokens = record["tokens"]
+            message.tokens_model = record.get("model")
+        elif op == "summary":
+            data = record["message"]
+            summary = self.add_summary(self.index[record["id"]].address, data["text"], data["name"], data.get("tokens"),
+                                       data.get("tokens_model"))
+            # Keep the saved id, tokens records of the summary refer to it
+            del self.summaries[summary.id]
+            summary.id = data["id"]
+            summary.time = data["time"]
+            self.summaries[summary.id] = summary
+        elif op == "title":
+            self.title = record["title"]
+            self.saved_title = self.title
+        else:
+            print(f"Unknown journal record: {op}")
+
+    def close(self):
+        """
+        Saves the conversation and closes its journal, waiting for a running compaction.
+        """
+        self.save()
+        if self.journal is not None:
+            self.journal.close()
 
-        self.load_json(json_data)
-    
     def find_conversation(self):
         """
         Check if the conversation is saved in the memory directory.
         """
-        memories = os.listdir(settings.MEMORY_DIR)
-
-        # remove .json ending
-        memories = [memory[:-5] for memory in memories]
+        return get_catalog().exists(self.conv_id)
 
-        if self.conv_id in memories:
-            return True
-        else:
-            return False
-        
     def is_empty(self):
         if (self.messages is None):
             return True
@@ -0,0 +1,285 @@
+from bisect import bisect_left
+import threading
+import time
+
+# Buckets in seconds, from a fast token to a slow prompt on a long context
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0)
+SPEED_BUCKETS = (1, 5, 10, 20, 40, 60, 80, 100, 200, 500, 1000, 2000, 5000)
+
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{escape_label(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Base of every metric, a family of values split by label values.
+
+    Attributes:
+        name (str): Metric name in Prometheus format. (e.g. archivist_stream_requests_total)
+        documentation (str): Help text shown in the exposition.
+        label_names (tuple): Names of the labels, empty for a single unlabelled value.
+    """
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, *label_values):
+        """
+        Gets the value for one set of label values, created on first use.
+
+        Returns:
+            The child metric holding the value.
+        """
+        if len(label_values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {label_values}")
+
+        child = self.children.get(label_values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(label_values, self.new_child())
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for label_values, child in sorted(self.children.items()):
+            lines += child.render(self.name, self.label_names, label_values)
+        return lines
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name: str, label_names: tuple, label_values: tuple) -> list[str]:
+        return [f"{name}{format_labels(label_names, label_values)} {format_value(self.value)}"]
+
+
+class GaugeValue(CounterValue):
+    def set(self, value: float):
+        self.value = value
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+
+class HistogramValue:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def observe_many(self, values: list):
+        """
+        Records several observations under one lock, e.g. every inter-token gap of a stream.
+        """
+        buckets = self.buckets
+        indexes = [bisect_left(buckets, value) for value in values]
+        total = sum(values)
+        with self.lock:
+            for index in indexes:
+                self.counts[index] += 1
+            self.sum += total
+
+    def render(self, name: str, label_names: tuple, label_values: tuple) -> list[str]:
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = format_labels(label_names, label_values, f'le="{format_value(bound)}"')
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = format_labels(label_names, label_values)
+        lines.append(f"{name}_sum{labels} {format_value(total)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def new_child(self):
+        return CounterValue()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def new_child(self):
+        return GaugeValue()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def observe_many(self, values: list):
+        self.labels().observe_many(values)
+
+    def time(self, *label_values):
+        """
+        Measures the duration of a with block.
+
+        Example:
+            with WORKFLOW_COMPILE_SECONDS.time():
+                ...
+        """
+        return Timer(self.labels(*label_values))
+
+
+class Timer:
+    def __init__(self, histogram_value: HistogramValue):
+        self.histogram_value = histogram_value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram_value.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Holds every metric and renders them in the Prometheus text exposition format.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        """
+        Returns:
+            str: Every metric in text exposition format. (text/plain; version=0.0.4)
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Generation
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "archivist_time_to_first_token_seconds", "Time from sending a prompt to llama-server until the first token.")
+INTER_TOKEN_LATENCY = REGISTRY.histogram(
+    "archivist_inter_token_latency_seconds", "Time between two streamed tokens.", buckets=TOKEN_BUCKETS)
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "archivist_tokens_per_second", "Speed llama-server reported in its timings.", ("phase",), SPEED_BUCKETS)
+PROMPT_TOKENS = REGISTRY.counter(
+    "archivist_prompt_tokens_total", "Prompt tokens llama-server processed or took from its cache.", ("source",))
+GENERATED_TOKENS = REGISTRY.counter(
+    "archivist_generated_tokens_total", "Tokens generated by llama-server.")
+
+# llama-server startup
+LLAMA_LOAD_PERCENT = REGISTRY.gauge(
+    "archivist_llama_server_load_percent", "Model load progress of llama-server read from its log.", ("port",))
+LLAMA_WARMUP_DONE = REGISTRY.gauge(
+    "archivist_llama_server_warmup_done", "1 once llama-server finished warming up its model.", ("port",))
+
+# Web UI
+STREAM_DURATION = REGISTRY.histogram(
+    "archivist_stream_duration_seconds", "Duration of a /stream request until the last chunk was sent.")
+WORKFLOW_COMPILE_SECONDS = REGISTRY.histogram(
+    "archivist_workflow_compile_seconds", "Time to get the runnable function tree of a workflow, compiling it if its file changed.")
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "archivist_http_request_duration_seconds", "Time until a route returned its response.", ("route", "method"))
+HTTP_REQUESTS = REGISTRY.counter(
+    "archivist_http_requests_total", "Requests handled by the web UI.", ("route", "method", "status"))
+
+
+def record_timings(timings: dict):
+    """
+    Records the timings object llama-server sends at the end of a generation.
+
+    Args:
+        timings (dict): Timings from the final stream chunk. (prompt_n, cache_n, predicted_n, ..._per_second)
+    """
+    if not timings:
+        return
+
+    PROMPT_TOKENS.labels("processed").inc(timings.get("prompt_n", 0))
+    PROMPT_TOKENS.labels("cached").inc(timings.get("cache_n", 0))
+    GENERATED_TOKENS.inc(timings.get("predicted_n", 0))
+    if timings.get("prompt_per_second"):
+        TOKENS_PER_SECOND.labels("prompt").observe(timings["prompt_per_second"])
+    if timings.get("predicted_per_second"):
+        TOKENS_PER_SECOND.labels("generation").observe(timings["predicted_per_second"])
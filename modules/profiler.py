@@ -0,0 +1,177 @@
+from typing import Callable, Iterator
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+
+def output_size(result) -> int:
+    """
+    Approximate bytes of the outputs of a node, the shallow size of every output.
+    """
+    if result is None:
+        return 0
+    if type(result) == tuple or type(result) == list:
+        return sum(sys.getsizeof(value) for value in result)
+    return sys.getsizeof(result)
+
+
+class WorkflowProfiler:
+    """
+    Records how long every node of a workflow run took.
+
+    Every node call records its wall time, CPU time of its thread, output size and, with
+    trace_allocations, the change of traced memory. Generators returned by a node are wrapped,
+    so the time spent producing their items (e.g. the tokens of a response stream) is recorded
+    as a second event once they are exhausted or closed.
+
+    Attributes:
+        trace_allocations (bool): Whether allocations are measured with tracemalloc. Slows every
+                    allocation down, and nodes running at the same time count in each other's delta.
+        calls (list[dict]): One dict per node call or stream, see measure().
+        start (float): perf_counter() when the profiler was created, the zero of the trace.
+    """
+    def __init__(self, trace_allocations: bool = False):
+        self.trace_allocations = trace_allocations
+        self.calls = []
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.started_tracing = False
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def record(self, call: dict):
+        with self.lock:
+            self.calls.append(call)
+
+    def measure(self, func_id: str, func_type: str, function: Callable, *args, cached: bool = False):
+        """
+        Calls a node function and records the call.
+
+        Returns:
+            The return value of the function.
+        """
+        alloc_start = tracemalloc.get_traced_memory()[0] if self.trace_allocations else 0
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        result = None
+        try:
+            result = function(*args)
+            return result
+        finally:
+            end = time.perf_counter()
+            call = {"id": func_id, "type": func_type, "name": func_type, "start": start - self.start,
+                    "wall": end - start, "cpu": time.thread_time() - cpu_start, "thread": threading.get_ident(),
+                    "cached": cached}
+            if self.trace_allocations:
+                call["alloc"] = tracemalloc.get_traced_memory()[0] - alloc_start
+            call["output_size"] = output_size(result)
+            self.record(call)
+
+    async def measure_async(self, func_id: str, func_type: str, function: Callable, *args):
+        """
+        Awaits a coroutine node function and records the call, see measure().
+
+        The CPU time also counts other coroutines that ran on the event loop meanwhile.
+        """
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        result = None
+        try:
+            result = await function(*args)
+            return result
+        finally:
+            self.record({"id": func_id, "type": func_type, "name": func_type, "start": start - self.start,
+                         "wall": time.perf_counter() - start, "cpu": time.thread_time() - cpu_start,
+                         "thread": threading.get_ident(), "cached": False, "output_size": output_size(result)})
+
+    def wrap_stream(self, func_id: str, func_type: str, stream: Iterator) -> Iterator:
+        """
+        Passes a stream returned by a node through, recording the time spent inside it.
+
+        Yields:
+            The items of the stream.
+        """
+        wall = 0.0
+        cpu = 0.0
+        items = 0
+        size = 0
+        first_item = None
+        start = time.perf_counter()
+        try:
+            while True:
+                item_start = time.perf_counter()
+                cpu_start = time.thread_time()
+                try:
+                    item = next(stream)
+                except StopIteration:
+                    return
+                finally:
+                    wall += time.perf_counter() - item_start
+                    cpu += time.thread_time() - cpu_start
+
+                if first_item is None:
+                    first_item = time.perf_counter() - start
+                items += 1
+                size += sys.getsizeof(item)
+                yield item
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+            self.record({"id": func_id, "type": func_type, "name": f"{func_type} (stream)", "start": start - self.start,
+                         "wall": wall, "cpu": cpu, "thread": threading.get_ident(), "cached": False,
+                         "duration": time.perf_counter() - start, "first_item": first_item, "items": items,
+                         "output_size": size})
+
+    def summary(self) -> list[dict]:
+        """
+        Returns:
+            list[dict]: The recorded calls, the slowest first. Times in milliseconds.
+        """
+        with self.lock:
+            calls = list(self.calls)
+
+        summary = []
+        for call in sorted(calls, key=lambda call: call["wall"], reverse=True):
+            data = {"id": call["id"], "name": call["name"], "wall_ms": round(call["wall"] * 1000, 3),
+                    "cpu_ms": round(call["cpu"] * 1000, 3), "output_size": call["output_size"], "cached": call["cached"]}
+            if "alloc" in call:
+                data["alloc"] = call["alloc"]
+            if "items" in call:
+                data["items"] = call["items"]
+                if call["first_item"] is not None:
+                    data["first_item_ms"] = round(call["first_item"] * 1000, 3)
+            summary.append(data)
+        return summary
+
+    def to_chrome_trace(self) -> dict:
+        """
+        Converts the recorded calls to Chrome trace-event json, for chrome://tracing or Perfetto.
+
+        Node calls are complete events on the thread that ran them. Streams span from their first
+        read to their end, with the time spent inside them in args.
+        """
+        with self.lock:
+            calls = list(self.calls)
+
+        events = []
+        for call in calls:
+            args = {key: value for key, value in call.items() if key not in ("name", "start", "thread")}
+            events.append({"name": call["name"], "cat": "stream" if "items" in call else "node", "ph": "X",
+                           "ts": round(call["start"] * 1e6, 3), "dur": round(call.get("duration", call["wall"]) * 1e6, 3),
+                           "pid": 1, "tid": call["thread"], "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_chrome_trace(), file)
+
+    def close(self):
+        """
+        Stops tracemalloc if this profiler started it.
+        """
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
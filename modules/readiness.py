@@ -0,0 +1,191 @@
+from typing import Callable
+import time
+
+import requests
+
+# Lines llama-server writes while starting, in the order they usually appear
+LOG_STAGES = [
+    ("llama_model_loader: loaded meta data", "metadata"),
+    ("load_tensors:", "tensors"),
+    ("warming up the model", "warmup"),
+    ("model loaded", "model_loaded"),
+    ("server is listening on", "listening"),
+    ("all slots are idle", "idle"),
+]
+
+# Stages after which llama-server should already answer /health with 200
+READY_STAGES = {"model_loaded", "listening", "idle"}
+
+
+class LlamaServerStartError(Exception):
+    def __init__(self, port: int, reason: str):
+        self.port = port
+        self.reason = reason
+        super().__init__(f"LlamaServerStartError: llama-server on port {port} failed to start ({reason})")
+
+
+class ReadinessWatcher:
+    """
+    Waits for a freshly launched llama-server to be ready without fixed sleeps.
+
+    Follows the llama-server log file and process state, reporting load progress as it
+    happens. Readiness is confirmed with a /health probe as soon as the log says the
+    server is up. Probes are also sent on an exponential backoff in case the log format
+    changes.
+
+    Attributes:
+        controller (LlamaServerController): The controller that launched llama-server.
+        progress (dict): {"stage": str, "load_percent": int, "warmup_done": bool}
+        timings (dict): {stage: seconds since launch} for every stage seen.
+        log_interval (float): Seconds between log file reads.
+        probe_delay (float): First delay between /health probes, doubled up to probe_max_delay.
+        probe_max_delay (float): Max delay between /health probes.
+        on_progress (Optional[Callable]): Called with a copy of progress every time it changes.
+    """
+    def __init__(self, controller, log_interval: float = 0.05, probe_delay: float = 0.1,
+                 probe_max_delay: float = 2.0, on_progress: Callable[[dict], None] = None):
+        self.controller = controller
+        self.on_progress = on_progress
+        self.log_interval = log_interval
+        self.probe_delay = probe_delay
+        self.probe_max_delay = probe_max_delay
+
+        self.progress = {"stage": "starting", "load_percent": 0, "warmup_done": False}
+        self.reported = dict(self.progress)
+        self.timings = {}
+        self.log_position = 0
+        self.log_remainder = ""
+
+    def _elapsed(self) -> float:
+        return round(time.monotonic() - self.controller.launch_time, 3)
+
+    def _report(self):
+        if self.progress == self.reported:
+            return
+        self.reported = dict(self.progress)
+        if self.on_progress is not None:
+            self.on_progress(dict(self.progress))
+
+    def _set_stage(self, stage: str):
+        if stage in self.timings:
+            return
+        self.timings[stage] = self._elapsed()
+        self.progress["stage"] = stage
+
+        if stage == "tensors":
+            print("llama-server loading model...")
+        elif stage in READY_STAGES:
+            self.progress["load_percent"] = 100
+            self.progress["warmup_done"] = True
+        elif stage == "warmup":
+            self.progress["load_percent"] = 100
+        self._report()
+
+    def _read_log(self) -> bool:
+        """
+        Reads new lines of the log file.
+
+        Returns:
+            bool: True if a stage after which llama-server should be ready was seen.
+        """
+        try:
+            with open(self.controller.output_file, "r", errors="replace") as file:
+                file.seek(self.log_position)
+                text = file.read()
+                self.log_position = file.tell()
+        except FileNotFoundError:
+            return False
+
+        if not text:
+            return False
+
+        # Last line may not be complete yet
+        lines = (self.log_remainder + text).split("\n")
+        self.log_remainder = lines.pop()
+
+        ready = False
+        for line in lines + [self.log_remainder]:
+            # Model load progress is printed as one dot per percent, on a line that grows as it loads
+            if self.progress["stage"] == "tensors" and line.endswith("."):
+                dots = len(line) - len(line.rstrip("."))
+                self.progress["load_percent"] = max(self.progress["load_percent"], min(100, dots))
+
+            for marker, stage in LOG_STAGES:
+                if marker in line:
+                    self._set_stage(stage)
+                    ready = ready or stage in READY_STAGES
+                    break
+        self._report()
+        return ready
+
+    def _probe(self) -> bool:
+        # One-off request, the pooled client would retry a refused connection with backoff
+        try:
+            response = requests.get(self.controller.client.url("/health"), timeout=(0.5, 2))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            return False
+        return response.status_code == 200
+
+    def wait(self, timeout: float = None) -> dict:
+        """
+        Blocks until llama-server answers /health with 200.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait after launch. Default waits forever.
+
+        Returns:
+            dict: Startup timing breakdown, {stage: seconds since launch}.
+
+        Raises:
+            LlamaServerStartError: If llama-server exited or did not get ready in time.
+        """
+        controller = self.controller
+
+        # Nothing to follow until run() truncated the log and started the process
+        if not controller.launched.wait(timeout):
+            raise LlamaServerStartError(controller.port, "never launched")
+
+        self._set_stage("process_started")
+        probe_delay = self.probe_delay
+        next_probe = time.monotonic() + probe_delay
+
+        log_ready = False
+        while True:
+            log_ready = self._read_log() or log_ready
+
+            now = time.monotonic()
+            if log_ready or now >= next_probe:
+                if self._probe():
+                    break
+                probe_delay = min(probe_delay * 2, self.probe_max_delay)
+                next_probe = now + probe_delay
+
+            if controller.process is not None and controller.process.poll() is not None:
+                raise LlamaServerStartError(controller.port, f"exited with code {controller.process.returncode}, see {controller.output_file}")
+
+            if timeout is not None and now - controller.launch_time > timeout:
+                raise LlamaServerStartError(controller.port, f"not ready after {timeout}s")
+
+            time.sleep(self.log_interval)
+
+        self._set_stage("model_loaded")
+        self._set_stage("ready")
+        return self.timings
+
+
+def format_startup_timings(timings: dict) -> str:
+    """
+    Formats a startup timing breakdown for printing.
+
+    Args:
+        timings (dict): {stage: seconds since launch}, from ReadinessWatcher.wait().
+
+    Returns:
+        str: One line, stages in the order they happened with the time spent in each.
+    """
+    parts = []
+    previous = 0.0
+    for stage, elapsed in sorted(timings.items(), key=lambda item: item[1]):
+        parts.append(f"{stage} +{elapsed - previous:.2f}s")
+        previous = elapsed
+    return f"{', '.join(parts)} (total {previous:.2f}s)"
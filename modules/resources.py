@@ -0,0 +1,79 @@
+from typing import Any, Callable, Hashable
+import threading
+
+
+class ResourceRegistry:
+    """
+    Long-lived objects shared by every workflow run, such as llama-server controllers.
+
+    A resource is created once per key by the first node that asks for it, later runs and
+    concurrent nodes get the same object. Resources with a terminate() or close() method are
+    stopped when removed.
+
+    Attributes:
+        resources (dict): {key: resource}
+    """
+    def __init__(self):
+        self.resources = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        Gets the resource of a key, creating it with factory() if there is none.
+
+        Only one thread runs the factory of a key, others asking for the same key wait for it.
+        Resources of other keys can be created at the same time.
+
+        Args:
+            key (Hashable): Name of the resource, e.g. ("llama_server", 5001).
+            factory (Callable): Creates the resource. An exception leaves the key without a resource.
+
+        Returns:
+            The resource.
+        """
+        with self.lock:
+            if key in self.resources:
+                return self.resources[key]
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                if key in self.resources:
+                    return self.resources[key]
+
+            resource = factory()
+            with self.lock:
+                self.resources[key] = resource
+            return resource
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            return self.resources.get(key, default)
+
+    def remove(self, key: Hashable):
+        """
+        Removes a resource and stops it.
+        """
+        with self.lock:
+            resource = self.resources.pop(key, None)
+            self.key_locks.pop(key, None)
+
+        if resource is None:
+            return
+        if hasattr(resource, "terminate"):
+            resource.terminate()
+        elif hasattr(resource, "close"):
+            resource.close()
+
+    def close_all(self):
+        """
+        Removes and stops every resource.
+        """
+        with self.lock:
+            keys = list(self.resources)
+        for key in keys:
+            self.remove(key)
+
+
+RESOURCES = ResourceRegistry()
@@ -0,0 +1,229 @@
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+import threading
+import time
+
+
+class SlotUnavailableError(Exception):
+    def __init__(self, reason: str, waiting: int, n_slots: int):
+        self.reason = reason
+        self.waiting = waiting
+        self.n_slots = n_slots
+        super().__init__(f"SlotUnavailableError: {reason} ({waiting} waiting for {n_slots} slots)")
+
+
+def is_branch_of(held_address: str, address: str) -> bool:
+    """
+    Whether a message address continues the branch that ends at held_address.
+
+    Args:
+        held_address (str): Address of the last message a slot processed.
+        address (str): Address of the message being sent.
+
+    Returns:
+        bool: True if held_address is on the path from the first message to address.
+    """
+    # Single multi-digit indices end with a dot, "12." is the same message as "12"
+    held_address = held_address.rstrip(".")
+    if not address.startswith(held_address):
+        return False
+
+    # Dotted addresses must match whole indices, "0.1" is not a branch of "0.12"
+    if len(address) == len(held_address) or "." not in address:
+        return True
+    return address[len(held_address)] == "."
+
+
+class SlotScheduler:
+    """
+    Hands out the parallel slots of one llama-server to concurrent requests.
+
+    Requests past the slot count wait in first come, first served order. The wait is
+    bounded both in time and in queue length so an overloaded server rejects early
+    instead of piling up requests.
+
+    Each slot remembers the conversation branch it last processed. A request for the same
+    conversation goes back to that slot, so llama-server can reuse the cached prompt
+    prefix instead of processing the whole history again. When there are more
+    conversations than slots the least recently used slot is given away.
+
+    Attributes:
+        n_slots (int): Number of parallel slots of llama-server. (--parallel)
+        max_queue (int): Max number of requests waiting for a slot.
+        max_wait (float): Default seconds a request waits for a slot before giving up.
+        owners (dict): {slot: (conv_id, address)} of the branch cached in each slot.
+        cache_stats (dict): Prompt cache counters, see record_timings().
+        slot_stats (dict): {slot: {"requests", "prompt_tokens", "cached_tokens"}} prompt cache counters of each slot.
+    """
+    def __init__(self, n_slots: int = 1, max_queue: int = 32, max_wait: float = 30.0):
+        self.n_slots = n_slots
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self.lock = threading.Condition()
+        self.free_slots = list(range(n_slots))
+        self.busy_slots = set()
+        self.queue = deque()
+
+        self.owners = {}
+        # Least recently used slot first
+        self.recent = OrderedDict((slot, None) for slot in range(n_slots))
+        self.cache_stats = {
+            "requests": 0,
+            "affinity_hits": 0,
+            "evictions": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "last_cached_tokens": 0,
+        }
+        self.slot_stats = {}
+
+    @property
+    def active(self) -> int:
+        return len(self.busy_slots)
+
+    @property
+    def waiting(self) -> int:
+        return len(self.queue)
+
+    def resize(self, n_slots: int):
+        """
+        Changes the number of slots, e.g. after reading `total_slots` from llama-server.
+
+        Slots above the new count that are in use are dropped once they are released.
+
+        Args:
+            n_slots (int): New number of slots.
+        """
+        with self.lock:
+            self.n_slots = n_slots
+            self.free_slots = [slot for slot in range(n_slots) if slot not in self.busy_slots]
+            for slot in range(n_slots):
+                self.recent.setdefault(slot, None)
+            for slot in [slot for slot in self.recent if slot >= n_slots]:
+                del self.recent[slot]
+                self.owners.pop(slot, None)
+            self.lock.notify_all()
+
+    def acquire(self, timeout: float = None, conv_id: str = None, address: str = "") -> int:
+        """
+        Waits for a free slot and reserves it.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait. Default is max_wait.
+            conv_id (Optional[str]): Conversation the request belongs to, used to find the slot caching it.
+            address (str): Address of the message being sent, used to match the cached branch.
+
+        Returns:
+            int: The id of the reserved slot. Pass it as `id_slot` to llama-server.
+
+        Raises:
+            SlotUnavailableError: If the queue is full or no slot was freed in time.
+        """
+        timeout = self.max_wait if timeout is None else timeout
+
+        with self.lock:
+            # Fast path, nobody is waiting ahead of this request
+            if self.free_slots and not self.queue:
+                return self._take_slot(conv_id, address)
+
+            if len(self.queue) >= self.max_queue:
+                raise SlotUnavailableError("queue is full", len(self.queue), self.n_slots)
+
+            ticket = object()
+            self.queue.append(ticket)
+            deadline = time.monotonic() + timeout
+            try:
+                while not (self.free_slots and self.queue[0] is ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise SlotUnavailableError(f"no slot freed after {timeout}s", len(self.queue), self.n_slots)
+                    self.lock.wait(remaining)
+                return self._take_slot(conv_id, address)
+            finally:
+                self.queue.remove(ticket)
+                # Let the next request in line check for a slot
+                self.lock.notify_all()
+
+    def _take_slot(self, conv_id: str, address: str) -> int:
+        slot = None
+        self.cache_stats["requests"] += 1
+
+        # Free slot holding the longest part of this branch
+        if conv_id is not None:
+            best_length = -1
+            for free_slot in self.free_slots:
+                owner = self.owners.get(free_slot)
+                if (owner is not None and owner[0] == conv_id and is_branch_of(owner[1], address)
+                        and len(owner[1]) > best_length):
+                    slot = free_slot
+                    best_length = len(owner[1])
+            if slot is not None:
+                self.cache_stats["affinity_hits"] += 1
+
+        # Otherwise give away the least recently used free slot
+        if slot is None:
+            free = set(self.free_slots)
+            slot = next(recent_slot for recent_slot in self.recent if recent_slot in free)
+            if slot in self.owners and conv_id is not None:
+                self.cache_stats["evictions"] += 1
+
+        self.free_slots.remove(slot)
+        self.busy_slots.add(slot)
+        self.recent.move_to_end(slot)
+        if conv_id is not None:
+            self.owners[slot] = (conv_id, address)
+        else:
+            self.owners.pop(slot, None)
+        return slot
+
+    def release(self, slot: int):
+        """
+        Gives a slot back to the scheduler.
+
+        Args:
+            slot (int): The id returned by acquire().
+        """
+        with self.lock:
+            self.busy_slots.discard(slot)
+            if slot < self.n_slots and slot not in self.free_slots:
+                self.free_slots.append(slot)
+            self.lock.notify_all()
+
+    def record_timings(self, slot: int, timings: dict) -> int:
+        """
+        Counts how much of the prompt llama-server took from the slot's cache, in total and per slot.
+
+        Args:
+            slot (int): The slot the request ran on.
+            timings (dict): The timings object from the end of the llama-server stream.
+
+        Returns:
+            int: Number of prompt tokens reused from the cache for this request.
+        """
+        cached_tokens = int(timings.get("cache_n", 0))
+        with self.lock:
+            self.cache_stats["prompt_tokens"] += int(timings.get("prompt_n", 0)) + cached_tokens
+            self.cache_stats["cached_tokens"] += cached_tokens
+            self.cache_stats["last_cached_tokens"] = cached_tokens
+
+            stats = self.slot_stats.setdefault(slot, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+            stats["requests"] += 1
+            stats["prompt_tokens"] += int(timings.get("prompt_n", 0)) + cached_tokens
+            stats["cached_tokens"] += cached_tokens
+        return cached_tokens
+
+    @contextmanager
+    def slot(self, timeout: float = None, conv_id: str = None, address: str = ""):
+        """
+        Reserves a slot for the duration of a with block.
+
+        Example:
+            with controller.scheduler.slot(conv_id=conv.conv_id, address=address) as id_slot:
+                ...
+        """
+        id_slot = self.acquire(timeout, conv_id, address)
+        try:
+            yield id_slot
+        finally:
+            self.release(id_slot)
@@ -0,0 +1,178 @@
+from dataclasses import dataclass, field
+from typing import Optional, Iterable, Iterator
+import json
+
+NEWLINE = 0x0A  # \n
+
+# Keys of a plain token chunk, used to pull the token out without decoding the whole frame
+FAST_FINISH_NULL = '"finish_reason":null'
+FAST_CONTENT = '"content":"'
+FAST_TOOL_CALLS = '"tool_calls"'
+
+
+@dataclass(slots=True)
+class DeltaEvent:
+    """
+    A token chunk generated by llama-server.
+
+    Attributes:
+        content (str): Text of the token(s). Empty if the chunk only carries tool calls.
+        tool_calls (Optional[list]): Partial tool calls in OpenAI format. Default is None.
+    """
+    content: str
+    tool_calls: Optional[list] = None
+
+
+@dataclass(slots=True)
+class FinishEvent:
+    """
+    End of generation reported by llama-server.
+
+    Attributes:
+        finish_reason (str): Why generation stopped. (stop, length, tool_calls, etc)
+        timings (dict): The timings object sent by llama-server. Empty if not sent.
+        usage (dict): The usage object sent by llama-server. Empty if not sent.
+    """
+    finish_reason: str
+    timings: dict = field(default_factory=dict)
+    usage: dict = field(default_factory=dict)
+
+
+@dataclass(slots=True)
+class DoneEvent:
+    """
+    The `data: [DONE]` frame that closes an OpenAI style stream.
+    """
+    pass
+
+
+class SSEParser:
+    """
+    Incremental parser for the server-sent events stream returned by llama-server.
+
+    Works directly on raw byte chunks as they arrive from the socket. Chunks are appended
+    to a single reusable buffer, every complete line in it is decoded in one pass and JSON
+    payloads are scanned in place from their offset, so no per-line bytes or str objects
+    are created. Keep-alive (empty) lines and comment (`:`) frames are skipped without
+    allocating.
+
+    Example:
+        parser = SSEParser()
+        for chunk in response.iter_content(chunk_size=None):
+            for event in parser.feed(chunk):
+                ...
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.scan_once = json.decoder.JSONDecoder().scan_once
+        self.scanstring = json.decoder.scanstring
+
+    def feed(self, chunk: bytes) -> list:
+        """
+        Adds a chunk of bytes to the parser and returns every event it completed.
+
+        Args:
+            chunk (bytes): Raw bytes from the stream. Can split frames anywhere.
+
+        Returns:
+            list: DeltaEvent, FinishEvent and DoneEvent objects in stream order.
+        """
+        buffer = self.buffer
+        buffer += chunk
+
+        # Only complete lines are parsed, a newline never splits a UTF-8 character
+        complete = buffer.rfind(NEWLINE) + 1
+        if not complete:
+            return []
+
+        with memoryview(buffer) as view:
+            text = str(view[:complete], "utf-8", "replace")
+        # Drop consumed frames, the buffer keeps its allocation for the next chunk
+        del buffer[:complete]
+
+        events = []
+        scan_once = self.scan_once
+        scanstring = self.scanstring
+        start = 0
+        while start < complete:
+            line_end = text.find("\n", start)
+            line_start = start
+            start = line_end + 1
+
+            # Keep-alive and comment frames
+            if line_end == line_start or text[line_start] in ":\r":
+                continue
+
+            # Other SSE fields (event:, id:, retry:) are not used by llama-server
+            if not text.startswith("data:", line_start, line_end):
+                continue
+
+            payload_start = line_start + 5
+            if text.startswith(" ", payload_start, line_end):
+                payload_start += 1
+
+            if text.startswith("[DONE]", payload_start, line_end):
+                events.append(DoneEvent())
+                continue
+
+            # Fast path for plain token chunks, which are nearly all of the stream.
+            # Only the content string is decoded, anything else falls back to a full decode.
+            if (text.find(FAST_FINISH_NULL, payload_start, line_end) != -1
+                    and text.find(FAST_TOOL_CALLS, payload_start, line_end) == -1):
+                content_start = text.find(FAST_CONTENT, payload_start, line_end)
+                if content_start != -1:
+                    try:
+                        content, _ = scanstring(text, content_start + len(FAST_CONTENT))
+                    except ValueError:
+                        content = None
+
+                    if content is not None:
+                        if content:
+                            events.append(DeltaEvent(content))
+                        continue
+
+            try:
+                data, _ = scan_once(text, payload_start)
+            except (StopIteration, ValueError):
+                print(f"\nError decoding SSE data: {text[line_start:line_end]}")
+                continue
+
+            self._to_events(data, events)
+
+        return events
+
+    def _to_events(self, data: dict, events: list):
+        choices = data.get("choices")
+        if not choices:
+            # Trailing usage/timings only chunk
+            if "timings" in data or "usage" in data:
+                events.append(FinishEvent("", data.get("timings") or {}, data.get("usage") or {}))
+            return
+
+        choice = choices[0]
+        delta = choice.get("delta")
+        if delta:
+            content = delta.get("content")
+            tool_calls = delta.get("tool_calls")
+            if content or tool_calls:
+                events.append(DeltaEvent(content or "", tool_calls))
+
+        finish_reason = choice.get("finish_reason")
+        if finish_reason:
+            events.append(FinishEvent(finish_reason, data.get("timings") or {}, data.get("usage") or {}))
+
+
+def iter_sse_events(chunks: Iterable[bytes]) -> Iterator:
+    """
+    Parses an iterable of raw byte chunks into SSE events.
+
+    Args:
+        chunks (Iterable[bytes]): Raw bytes from the stream. (e.g. response.iter_content(chunk_size=None))
+
+    Yields:
+        DeltaEvent | FinishEvent | DoneEvent: Events in stream order.
+    """
+    parser = SSEParser()
+    for chunk in chunks:
+        if chunk:
+            yield from parser.feed(chunk)
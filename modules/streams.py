@@ -0,0 +1,132 @@
+from typing import Callable, Iterable, Iterator
+import queue
+import threading
+
+# Marks the end of a buffered stream
+_END = object()
+
+
+class StreamBufferError(Exception):
+    def __init__(self, size: int):
+        self.size = size
+        super().__init__(f"StreamBufferError: a stream copy fell {size} items behind the others")
+
+
+def buffered(stream: Iterable, size: int = 64) -> Iterator:
+    """
+    Reads a stream ahead on a background thread, keeping at most size items in memory.
+
+    The reader blocks once the buffer is full, so a slow consumer slows the producer down
+    instead of the buffer growing. Closing the returned generator stops the reader.
+
+    Args:
+        stream (Iterable): The stream to read ahead, e.g. the token stream of a llama-server.
+        size (int): Number of items read ahead at most.
+
+    Yields:
+        The items of the stream, in order. An exception of the stream is raised here.
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def read():
+        try:
+            for item in stream:
+                while not stop.is_set():
+                    try:
+                        items.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    break
+        except Exception as e:
+            items.put((_END, e))
+            return
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+        items.put((_END, None))
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = items.get()
+            if type(item) is tuple and len(item) == 2 and item[0] is _END:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+    finally:
+        stop.set()
+        # Unblock a reader waiting on a full buffer
+        while reader.is_alive():
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                reader.join(0.1)
+
+
+def tap(stream: Iterable, callback: Callable) -> Iterator:
+    """
+    Passes a stream through, calling callback with every item as it goes by.
+
+    For side outputs such as saving or logging a response, without a second consumer.
+    """
+    for item in stream:
+        callback(item)
+        yield item
+
+
+def tee(stream: Iterable, n: int = 2, max_buffer: int = 1024) -> list[Iterator]:
+    """
+    Splits a stream into n copies that are read independently.
+
+    Items are kept until every copy has read them. Unlike itertools.tee, the buffer is bounded.
+
+    Args:
+        stream (Iterable): The stream to split.
+        n (int): Number of copies.
+        max_buffer (int): Items a copy may fall behind the furthest one.
+
+    Returns:
+        list[Iterator]: The copies.
+
+    Raises:
+        StreamBufferError: While reading a copy, once another copy fell max_buffer items behind it.
+    """
+    iterator = iter(stream)
+    lock = threading.Lock()
+    buffer = []
+    # Index in the stream of buffer[0], and the next index of every copy
+    state = {"start": 0, "done": False}
+    positions = [0] * n
+
+    def copy(idx: int):
+        while True:
+            with lock:
+                offset = positions[idx] - state["start"]
+                if offset < len(buffer):
+                    item = buffer[offset]
+                elif state["done"]:
+                    return
+                else:
+                    if len(buffer) >= max_buffer:
+                        raise StreamBufferError(max_buffer)
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        state["done"] = True
+                        return
+                    buffer.append(item)
+
+                positions[idx] += 1
+                # Drop the items every copy has read
+                read_by_all = min(positions) - state["start"]
+                if read_by_all > 0:
+                    del buffer[:read_by_all]
+                    state["start"] += read_by_all
+            yield item
+
+    return [copy(idx) for idx in range(n)]
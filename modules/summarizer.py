@@ -0,0 +1,134 @@
+from typing import Optional
+import threading
+
+from modules.message_manager import Conversation, Message_Node, SUMMARY_HEADER
+
+SUMMARY_INSTRUCT = ("Summarize the conversation below for yourself, so it can be continued without it. "
+                    "Keep names, facts, decisions, open questions and anything the user asked to remember. "
+                    "Answer with the summary only.")
+
+
+class ContextSummarizer:
+    """
+    Keeps the prompt of long conversations bounded by summarizing their older messages.
+
+    Once the prompt of a branch reaches token_threshold tokens, every message except the newest
+    keep_messages is summarized by the LLM in a background thread, together with the previous summary.
+    The summary is stored on the last message it covers with Conversation.add_summary(), and later
+    prompts of the branch start with it instead of the messages it covers.
+
+    Attributes:
+        model (Model): Generates the summaries.
+        token_counter (TokenCounter): Counts the tokens of the branch and the summaries.
+        token_threshold (int): Prompt tokens of a branch that start a summary.
+        keep_messages (int): Number of the newest messages that are never summarized.
+        instruct (str): System prompt of the summary requests.
+        threads (dict): {conversation id: the running summary thread}
+    """
+    def __init__(self, model, token_counter, token_threshold: int, keep_messages: int = 4, instruct: str = SUMMARY_INSTRUCT):
+        self.model = model
+        self.token_counter = token_counter
+        self.token_threshold = token_threshold
+        self.keep_messages = keep_messages
+        self.instruct = instruct
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def is_running(self, conversation: Conversation) -> bool:
+        thread = self.threads.get(conversation.conv_id)
+        return thread is not None and thread.is_alive()
+
+    def get_summarized_messages(self, controller, conversation: Conversation, address: str) -> list[Message_Node]:
+        """
+        Finds the messages to summarize if the prompt of the branch reached token_threshold.
+
+        Returns:
+            list[Message_Node]: The messages after the current summary, except the newest keep_messages.
+                    Empty if the branch does not need a summary.
+        """
+        self.token_counter.count_branch(controller, conversation, address)
+        if conversation.get_token_sums(address)[-1] < self.token_threshold:
+            return []
+
+        _, messages = conversation.get_unsummarized(address)
+        messages = messages[:max(0, len(messages) - self.keep_messages)]
+        # One message is not worth a request
+        if len(messages) < 2:
+            return []
+        return messages
+
+    def build_prompt(self, summary: Optional[Message_Node], messages: list[Message_Node]) -> list[dict]:
+        """
+        Builds the summary request, in OpenAI chat format.
+        """
+        lines = []
+        if summary is not None:
+            lines.append(SUMMARY_HEADER + summary.text + "\n")
+        for message in messages:
+            lines.append(f"{message.role}: {message.text}")
+
+        return [{"role": "system", "content": self.instruct}, {"role": "user", "content": "\n".join(lines)}]
+
+    def summarize(self, controller, conversation: Conversation, address: str, settings: dict,
+                  wait: bool = False) -> Optional[threading.Thread]:
+        """
+        Starts a summary of the branch if its prompt reached token_threshold.
+
+        At most one summary runs per conversation, a branch that still needs one is checked again
+        on the next call. The summary is added to the conversation and saved with its next save().
+
+        Args:
+            controller (LlamaServerController): The llama-server that writes the summary.
+            conversation (Conversation): The conversation of the branch.
+            address (str): Address of the last message of the branch.
+            settings (dict): Sampling settings of the agent, see Model.generate().
+            wait (bool): Whether to summarize on the calling thread. Default summarizes in the background.
+
+        Returns:
+            Optional[threading.Thread]: The started thread, None if no summary was needed or wait was set.
+        """
+        with self.lock:
+            if not address or self.is_running(conversation):
+                return None
+
+            messages = self.get_summarized_messages(controller, conversation, address)
+            if not messages:
+                return None
+
+            summary, _ = conversation.get_unsummarized(messages[-1].address)
+            prompt = self.build_prompt(summary, messages)
+            args = (controller, conversation, messages[-1], prompt, settings)
+            if wait:
+                self._run(*args)
+                return None
+
+            thread = threading.Thread(target=self._run, args=args, daemon=True)
+            self.threads[conversation.conv_id] = thread
+            thread.start()
+            return thread
+
+    def _run(self, controller, conversation: Conversation, last_message: Message_Node, prompt: list[dict], settings: dict):
+        print(f"Summarizing conversation {conversation.conv_id} up to {last_message.address}")
+        try:
+            scheduler = getattr(controller, "scheduler", None)
+            if scheduler is not None:
+                with scheduler.slot() as id_slot:
+                    text = self.model.generate(prompt, controller, settings, id_slot)
+            else:
+                text = self.model.generate(prompt, controller, settings)
+        except Exception as e:
+            print(f"Error summarizing conversation {conversation.conv_id}: {e}")
+            return
+
+        # generate() returns the status code on failure
+        if not isinstance(text, str) or not text.strip():
+            print(f"Error summarizing conversation {conversation.conv_id}: {text}")
+            return
+
+        tokens = self.token_counter.count(controller, text.strip())
+        # The request thread may be building a prompt or saving, see Conversation.lock
+        with conversation.lock:
+            # The message may have been deleted while the summary was written
+            if conversation.index.get(last_message.id) is not last_message:
+                return
+            conversation.add_summary(last_message.address, text.strip(), tokens=tokens)
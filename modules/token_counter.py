@@ -0,0 +1,99 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+import requests
+
+from modules.message_manager import Conversation, Message_Node
+
+
+class TokenCounter:
+    """
+    Counts message tokens with llama-server's /tokenize, caching counts by model and text.
+
+    The same text is only sent to llama-server once per model, so regenerated answers,
+    repeated prompts and reloaded conversations cost no requests.
+
+    Attributes:
+        max_entries (int): Number of counts kept in the cache.
+        cache (OrderedDict): {(model file name, sha1 of text): token count}, least recently used first.
+        requests (int): Number of /tokenize requests sent.
+    """
+    def __init__(self, max_entries: int = 8192):
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    @staticmethod
+    def model_name(controller) -> str:
+        """
+        Gets the file name of the model of a llama-server, which counts are kept for.
+        """
+        return os.path.basename(controller.model_path or "")
+
+    def count(self, controller, text: str) -> int:
+        """
+        Counts the tokens of a text for the model of a llama-server.
+
+        Falls back to an estimate of 4 characters per token if llama-server does not answer.
+
+        Args:
+            controller (LlamaServerController): The llama-server whose model counts the tokens.
+            text (str): The text to count.
+
+        Returns:
+            int: Number of tokens of the text.
+        """
+        key = (self.model_name(controller), hashlib.sha1(text.encode("utf-8")).hexdigest())
+        with self.lock:
+            tokens = self.cache.get(key)
+            if tokens is not None:
+                self.cache.move_to_end(key)
+                return tokens
+
+        try:
+            response = controller.client.post("/tokenize", json={"content": text}, timeout=(controller.client.connect_timeout, 30))
+            response.raise_for_status()
+            tokens = len(response.json()["tokens"])
+            self.requests += 1
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            print(f"Error counting tokens, using an estimate: {e}")
+            return len(text) // 4 + 1
+
+        with self.lock:
+            self.cache[key] = tokens
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return tokens
+
+    def count_message(self, controller, conversation: Conversation, message: Message_Node) -> int:
+        """
+        Gets the token count of a message, counting and saving it on the message if it has none.
+
+        A count of another model, e.g. from before a model switch, is counted again.
+
+        Returns:
+            int: Number of tokens of the message text.
+        """
+        model = self.model_name(controller)
+        if message.tokens is None or message.tokens_model != model:
+            conversation.set_tokens(message, self.count(controller, message.text), model)
+        return message.tokens
+
+    def count_branch(self, controller, conversation: Conversation, address: str):
+        """
+        Counts every message of the prompt of the address that has no token count of the model yet.
+
+        The prompt starts at the deepest summary of the branch, see Conversation.get_unsummarized().
+        Only new messages are counted, the rest of the branch already carries its count. After a
+        model switch the branch is counted once more for the new model.
+        """
+        model = self.model_name(controller)
+        summary, messages = conversation.get_unsummarized(address)
+        if summary is not None:
+            messages.insert(0, summary)
+        for message in messages:
+            if message.tokens is None or message.tokens_model != model:
+                self.count_message(controller, conversation, message)
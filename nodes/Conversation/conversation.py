@@ -1,12 +1,28 @@
 from modules.message_manager import Message_Node, Conversation
+from modules.resources import RESOURCES
 import settings
 from nodes.node_handler import node
 
+CONVERSATION_KEY = ("conversation",)
+
+def get_conversation() -> Conversation:
+    """
+    Gets the live conversation, shared by the web UI routes and every workflow run.
+    """
+    return RESOURCES.get_or_create(CONVERSATION_KEY, Conversation)
+
+def new_conversation() -> Conversation:
+    """
+    Closes the live conversation, which saves it, and starts an empty one in its place.
+    """
+    RESOURCES.remove(CONVERSATION_KEY)
+    return get_conversation()
+
 @node(inputs=["agent_instruct"], outputs=["conversation", "conversation_history"])
 def memory(agent_instruct: str) -> tuple[Conversation, list]:
     conversation_history = []
     conversation_history.append({"role": "system", "content": agent_instruct})
-    conversation = Conversation()
-    conversation_history
+    # The chat loaded in the web UI, so every node works on the one the agent continues
+    conversation = get_conversation()
 
-    return conversation, conversation_history
\ No newline at end of file
+    return conversation, conversation_history
@@ -0,0 +1,31 @@
+from modules.message_manager import Conversation
+from modules.summarizer import ContextSummarizer
+from modules.resources import RESOURCES
+from nodes.node_handler import node
+from nodes.agent import model, token_counter
+from llama_server_controller import LlamaServerController
+
+@node(inputs=["conversation", "address", "llama_controller", "agent_info"], settings=["token_threshold", "keep_messages"],
+        outputs=["conversation"])
+def summarize_context(conversation: Conversation, address: str, llama_controller: LlamaServerController, agent_info: dict,
+                      token_threshold: int, keep_messages: int) -> tuple[Conversation]:
+    """
+    Summarizes the older messages of the branch in the background once its prompt reaches token_threshold.
+
+    The conversation is passed through unchanged, so the node can sit between the memory and agent nodes.
+    It runs before the new message is added, so the summary is used from the next message on.
+    """
+    # One summarizer for every workflow run, it keeps track of the summaries running
+    summarizer = RESOURCES.get_or_create(("summarizer",),
+                                         lambda: ContextSummarizer(model, token_counter, int(token_threshold), int(keep_messages)))
+    summarizer.token_threshold = int(token_threshold)
+    summarizer.keep_messages = int(keep_messages)
+
+    if conversation.is_empty():
+        return conversation
+
+    # Like the agent node, no address means the branch shown in the chat
+    address = address or conversation.get_last_address()
+    summarizer.summarize(llama_controller, conversation, address, agent_info["agent_settings"])
+
+    return conversation
@@ -1,42 +1,75 @@
 import os
-import threading
 import sys
-import time
 
 from llama_server_controller import LlamaServerController
+from modules.llama_pool import LlamaServerPool, InstanceConfig
+from modules.hot_swap import HotSwapController
 from modules.message_manager import Message_Node, Conversation
+from modules.resources import RESOURCES
 import settings
 from nodes.node_handler import node
 
-controller = None
-output_file_name = None
-
 
 @node(inputs=None, settings=["port", "log_file", "model_path", "devices"], outputs=["controller", "output_file"])
 def initalize_llama_server(port: int, log_file: str, model_name: str, devices: str) -> tuple[LlamaServerController, str]:
-    global controller, output_file_name
+    model_path = os.path.join(settings.LLMS_DIR, model_name)
+
+    def start_llama_server():
+        llama_server_path = os.path.join(settings.LLAMA_CPP_DIR, "llama-server")
+        llama_controller = HotSwapController(llama_server_path, port, log_file=log_file)
+
+        try:
+            llama_controller.switch_model(model_path, devices)
+        except KeyboardInterrupt:
+            print("\nInterrupted by user. Exiting.")
+            sys.exit(0)
+        return llama_controller
+
+    # One llama-server per port for every workflow run
+    controller = RESOURCES.get_or_create(("llama_server", port), start_llama_server)
 
-    if controller != None:
-        return controller, output_file_name
+    # Changing the model loads it next to the running one and switches over once ready
+    if controller.model_path != model_path or controller.devices != devices:
+        controller.switch_model(model_path, devices)
+
+    return controller, controller.output_file
+
+
+@node(inputs=None, settings=["ports", "model_name", "devices", "parallel"], outputs=["controller"])
+def initalize_llama_server_pool(ports: str, model_name: str, devices: str, parallel: int) -> tuple[LlamaServerPool]:
+    """
+    Starts one llama-server per port and balances requests over them.
+
+    ports is comma separated (e.g. "5001,5002") and devices has one entry per port
+    separated by ";" (e.g. "cuda0;cuda1"). A single devices entry is used for every port.
+    """
+    port_list = [int(port) for port in ports.split(",")]
+    device_list = devices.split(";")
+    if len(device_list) == 1:
+        device_list = device_list * len(port_list)
+    if len(device_list) != len(port_list):
+        raise ValueError(f"Expected devices for {len(port_list)} ports, got {len(device_list)}")
 
-    PORT_NUM = port
-    output_file = os.path.join(settings.MAIN_DIR, log_file)
     llama_server_path = os.path.join(settings.LLAMA_CPP_DIR, "llama-server")
     model_path = os.path.join(settings.LLMS_DIR, model_name)
-    llama_controller = LlamaServerController(llama_server_path, PORT_NUM)
-
-    t = threading.Thread(target=llama_controller.run, args=(False, model_path, devices), daemon=True)
-    t.start()
+    configs = [InstanceConfig(model_path, port, device, int(parallel)) for port, device in zip(port_list, device_list)]
 
-    try:
-        while llama_controller.get_health() != 200:
-            print("Waiting for controller to be ready...")
-            time.sleep(2)
-    except KeyboardInterrupt:
-        print("\nInterrupted by user. Exiting.")
-        sys.exit(0)
+    def start_pool():
+        llama_pool = LlamaServerPool(llama_server_path, configs)
+        try:
+            llama_pool.start()
+        except KeyboardInterrupt:
+            print("\nInterrupted by user. Exiting.")
+            llama_pool.terminate()
+            sys.exit(0)
+        llama_pool.start_monitor()
+        return llama_pool
 
-    controller = llama_controller
-    output_file_name = output_file
+    # One pool per set of ports, changing its model, devices or slots restarts it on the same ports
+    key = ("llama_server_pool", tuple(port_list))
+    llama_pool = RESOURCES.get(key)
+    if llama_pool is not None and llama_pool.configs != configs:
+        print(f"llama-server pool settings changed, restarting the pool on ports {ports}")
+        RESOURCES.remove(key)
 
-    return llama_controller, output_file
\ No newline at end of file
+    return RESOURCES.get_or_create(key, start_pool)
@@ -4,44 +4,125 @@ import markdown
 from typing import Generator
 
 import settings
-from modules.message_manager import Message_Node, Conversation
+from modules.message_manager import Message_Node, Conversation, MESSAGE_TOKEN_OVERHEAD, merge_system_prompt
+from modules.token_counter import TokenCounter
 from nodes.node_handler import node
 from model import Model
 from llama_server_controller import LlamaServerController
+from modules.slot_scheduler import SlotUnavailableError
 
-conv_history = []
+system_prompt = None
 controller = None
 model = Model()
 agent_settings = []
-conv = None
 agent_instruct = {}
-
-def response_stream(user_address):
-    global conv_history, controller, model, conv, agent_settings, agent_instruct
+token_counter = TokenCounter()
+
+def get_context_size(llama_controller) -> int:
+    """
+    Context size of one llama-server slot, the -c value is shared by all parallel slots.
+    """
+    profile = getattr(llama_controller, "profile", None)
+    ctx_size = profile.ctx_size if profile is not None else 32768
+    return ctx_size // max(1, llama_controller.parallel)
+
+def build_context(llama_controller, conv: Conversation, user_address: str) -> list:
+    """
+    Builds the prompt of the branch, dropping the oldest messages that do not fit the context.
+
+    Only messages without a token count are tokenized, the history keeps its counts.
+
+    Returns:
+        list: Messages in OpenAI format, empty if not even the last message fits.
+    """
+    token_counter.count_branch(llama_controller, conv, user_address)
+    system_tokens = 0
+    if system_prompt:
+        system_tokens = token_counter.count(llama_controller, system_prompt) + MESSAGE_TOKEN_OVERHEAD
+
+    # Node settings pass max_length as text
+    fit = conv.plan_context(user_address, get_context_size(llama_controller),
+                            int(agent_settings.get("max_length") or 0), system_tokens)
+    if fit == 0:
+        return []
+
+    context = conv.get_context(user_address)
+    if fit < len(context):
+        print(f"Context full, leaving out the {len(context) - fit} oldest messages")
+        context = context[len(context) - fit:]
+
+    if system_prompt:
+        context = merge_system_prompt(system_prompt, context)
+    return context
+
+def response_stream(conv: Conversation, user_address: str):
+    global system_prompt, controller, model, agent_settings, agent_instruct
 
     yield json.dumps({"type":"user_address", "value":user_address}) + "\n"
     model_message = ""
 
-    # Stream the LLM response by token
-    for message_data, is_last in model.generate_stream(conv_history, controller, agent_settings):
-        if is_last:
-            yield json.dumps({"type":"final", "value":markdown.markdown(model_message)}) + "\n"
-            break
-        yield json.dumps({"type":"message", "value": message_data}) + "\n"
-        model_message += message_data
+    # A pool or hot-swap switch picks the llama-server once for the whole request
+    switch = controller
+    llama_controller = switch
+    try:
+        if hasattr(switch, "select"):
+            llama_controller = switch.select(conv.conv_id)
+    except RuntimeError as e:
+        print(e)
+        yield json.dumps({"type":"error", "value":"llama-server is not available"}) + "\n"
+        return
+
+    # A switch stops an old llama-server only once the requests that selected it are released
+    try:
+        # Prompt of the branch ending at the user message, reuses the cached history of earlier turns
+        context = build_context(llama_controller, conv, user_address)
+        if not context:
+            yield json.dumps({"type":"error", "value":"Message is too long for the context"}) + "\n"
+            return
+
+        # Wait for a free llama-server slot, requests past the slot count are queued
+        # Conversations go back to the slot holding their branch, so the prompt cache is reused
+        try:
+            id_slot = llama_controller.scheduler.acquire(conv_id=conv.conv_id, address=user_address)
+        except SlotUnavailableError as e:
+            print(e)
+            yield json.dumps({"type":"error", "value":"llama-server is busy, try again later"}) + "\n"
+            return
+
+        # Stream the LLM response by token
+        timings = {}
+        predicted_tokens = None
+        try:
+            for message_data, is_last in model.generate_stream(context, llama_controller, agent_settings, id_slot, timings):
+                if is_last:
+                    predicted_tokens = message_data
+                    yield json.dumps({"type":"final", "value":markdown.markdown(model_message)}) + "\n"
+                    break
+                yield json.dumps({"type":"message", "value": message_data}) + "\n"
+                model_message += message_data
+        finally:
+            llama_controller.scheduler.release(id_slot)
+
+        if timings:
+            cached_tokens = llama_controller.scheduler.record_timings(id_slot, timings)
+            print(f"Prompt cache reused {cached_tokens} tokens on slot {id_slot}")
+    finally:
+        if hasattr(switch, "release"):
+            switch.release(llama_controller)
 
     # Keep track of the conversation
-    conv_history.append({"role": "assistant", "content": model_message})
     temp_message = Message_Node("Archivist", "Assistant", model_message, instruct=agent_instruct)
     assistant_address = conv.add_message(temp_message, user_address)
+    if isinstance(predicted_tokens, int):
+        conv.set_tokens(temp_message, predicted_tokens, TokenCounter.model_name(llama_controller))
 
     yield json.dumps({"type":"assistant_address", "value":assistant_address}) + "\n"
 
-    if (not conv.find_conversation()):
-        conv.save()
+    # Only appends the new messages to the journal
+    conv.save()
 
 @node(settings=["agent_instruct", "max_length", "temperature", "top_p", "top_k", "min_p", "frequency_penalty", "presence_penalty"],
-        outputs=["agent_info"])
+        outputs=["agent_info"], pure=True)
 def load_agent_info(agent_instruct: str, max_length: int, temperature: int, 
                 top_p: int, top_k: int, min_p: int, frequency_penalty: int, presence_penalty: int) -> tuple[dict]:
     agent_settings = {
@@ -61,24 +142,28 @@ def load_agent_info(agent_instruct: str, max_length: int, temperature: int,
 
     return agent_info
 
-@node(inputs=["message", "address", "type", "llama_controller", "conversation_history", "conversation", "agent_info"], outputs=["stream_response"])
+@node(inputs=["message", "address", "type", "llama_controller", "conversation_history", "conversation", "agent_info"], outputs=["stream_response"],
+        concurrent=False)
 def agent(message: str, address: str, type:str, llama_controller:LlamaServerController, conversation_history: list, conversation: Conversation, agent_info: dict) -> tuple[Generator]:
-    global conv, conv_history, agent_settings, agent_instruct, controller
+    global system_prompt, agent_settings, agent_instruct, controller
 
     controller = llama_controller
-    
-    # First time user is sending a message in the conversation
-    if conv_history == []:
-        conv_history = conversation_history
-        conv = conversation
+    if conversation_history and conversation_history[0]["role"] == "system":
+        system_prompt = conversation_history[0]["content"]
+
+    # Loading a chat or starting a new one replaces the conversation, so it is not kept between runs
+    conv = conversation
 
     agent_settings = agent_info["agent_settings"]
     agent_instruct = agent_info["agent_instruct"]
 
     # Webui live resposne
     if type == "stream":
-        conv_history.append({"role": "user", "content": message})
+        # Without an address the message continues the branch shown in the chat
+        if not address:
+            address = conv.get_last_address()
+
         msg_node = Message_Node("user", "User", message, "")
         user_address = conv.add_message(msg_node, address)
 
-        return response_stream(user_address)
\ No newline at end of file
+        return response_stream(conv, user_address)
\ No newline at end of file
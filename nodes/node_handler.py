@@ -1,10 +1,97 @@
-from typing import get_args
-import os
+from collections import OrderedDict
+from typing import get_args, Optional
+import ast
+import hashlib
 import importlib
+import json
+import os
+import threading
+
+import settings
 
 NODE_REGISTRY = {}
+NODES_DIR = os.path.dirname(os.path.abspath(__file__))
+# Node metadata of every node file, see load_node_manifest()
+MANIFEST_PATH = os.path.join(NODES_DIR, ".node_manifest.json")
+MANIFEST_VERSION = 1
+
+
+class NodeCache:
+    """
+    Least recently used cache of the outputs of pure nodes, see node(pure=True).
+
+    Keys are the node type and a hash of the node arguments, so changed inputs or settings
+    miss the cache by themselves.
+
+    Attributes:
+        max_entries (int): Number of outputs kept.
+        cache (OrderedDict): {(node type, sha1 of the arguments): output}, least recently used first.
+        hits (int): Number of calls answered from the cache.
+        misses (int): Number of calls that ran the node.
+    """
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, node_type: str, args: list) -> Optional[tuple]:
+        """
+        Returns:
+            Optional[tuple]: The cache key, None if the arguments are not json (e.g. a controller), which are never cached.
+        """
+        try:
+            data = json.dumps(args, sort_keys=True, separators=(",", ":"))
+        except (TypeError, ValueError):
+            return None
+        return (node_type, hashlib.sha1(data.encode("utf-8")).hexdigest())
+
+    def get(self, key: tuple) -> tuple[bool, object]:
+        """
+        Returns:
+            tuple: (whether the key was found, the cached output)
+        """
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return True, self.cache[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: tuple, value):
+        with self.lock:
+            self.cache[key] = value
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def invalidate(self, node_type: str = None):
+        """
+        Drops the cached outputs of one node type, or of every node.
+        """
+        with self.lock:
+            if node_type is None:
+                self.cache.clear()
+                return
+            for key in [key for key in self.cache if key[0] == node_type]:
+                del self.cache[key]
 
-def node(inputs=None, settings=None, outputs=None, trigger_inputs=None, send_outputs=None):
+
+NODE_CACHE = NodeCache(settings.NODE_CACHE_ENTRIES)
+
+def node(inputs=None, settings=None, outputs=None, trigger_inputs=None, send_outputs=None, concurrent=True, pure=False):
+    """
+    Registers a function as a workflow node.
+
+    concurrent=False keeps the node from running at the same time as the other nodes of its
+    workflow level, for nodes that change shared state. See Workflow.call_funcs().
+
+    pure=True declares that the node always returns the same outputs for the same inputs and settings
+    and has no side effects. Its outputs are then kept in NODE_CACHE across workflow runs. The cached
+    outputs are shared, later nodes must not change them.
+    """
     def wrap(func):
         func_data = func.__annotations__    
 
@@ -79,7 +166,9 @@ def node(inputs=None, settings=None, outputs=None, trigger_inputs=None, send_out
             "settings": node_settings or {},
             "outputs": node_outputs or {},
             "trigger_inputs": node_trigger_inputs or {},
-            "send_outputs": function_send_outputs or {}
+            "send_outputs": function_send_outputs or {},
+            "concurrent": concurrent,
+            "pure": pure
         }
 
         func._node_meta = node_metadata
@@ -94,6 +183,9 @@ def import_nodes():
     Searches for all python files in nodes dir and imports them, so that no main file editing
     needs to be done to add new nodes
     """
+    # Outputs of the node functions being replaced
+    NODE_CACHE.invalidate()
+
     for dirpath, dirnames, files in os.walk("nodes"):
         for file in files:
             if file.endswith(".py") and file != "__init__.py" and file != "node_handler.py":
@@ -105,5 +197,178 @@ def import_nodes():
                 except Exception as e:
                     print(f"Error importing: {import_name} Error: {e}")
 
+def _type_name(annotation: Optional[ast.expr]):
+    # Same names node() takes from the runtime type hints, e.g. "str", "Generator", "list"
+    if annotation is None:
+        return None
+    if isinstance(annotation, ast.Name):
+        return annotation.id
+    if isinstance(annotation, ast.Attribute):
+        return annotation.attr
+    if isinstance(annotation, ast.Subscript):
+        return _type_name(annotation.value)
+    if isinstance(annotation, ast.Constant) and isinstance(annotation.value, str):
+        return annotation.value
+    return ast.unparse(annotation)
+
+def scan_node_file(path: str, module: str) -> dict:
+    """
+    Reads the @node metadata of a node file from its source, without importing it.
+
+    Args:
+        path (str): Path to the python file.
+        module (str): Module of the file below nodes, e.g. "Conversation.conversation".
+
+    Returns:
+        dict: {node type: metadata} like NODE_REGISTRY, without "callable".
+
+    Raises:
+        SyntaxError: If the file is not valid python.
+        ValueError: If the arguments of a @node decorator are not literals.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        tree = ast.parse(file.read(), filename=path)
+
+    param_names = ("inputs", "settings", "outputs", "trigger_inputs", "send_outputs", "concurrent", "pure")
+    nodes = {}
+    for func in tree.body:
+        if not isinstance(func, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+
+        for decorator in func.decorator_list:
+            if not isinstance(decorator, ast.Call):
+                continue
+            name = decorator.func.id if isinstance(decorator.func, ast.Name) else getattr(decorator.func, "attr", None)
+            if name != "node":
+                continue
+
+            params = {"concurrent": True, "pure": False}
+            for param_name, arg in zip(param_names, decorator.args):
+                params[param_name] = ast.literal_eval(arg)
+            for keyword in decorator.keywords:
+                params[keyword.arg] = ast.literal_eval(keyword.value)
+
+            annotations = {arg.arg: _type_name(arg.annotation) for arg in func.args.args if arg.annotation is not None}
+
+            # Type of every returned value, from tuple[...]
+            return_values = []
+            if isinstance(func.returns, ast.Subscript):
+                elements = func.returns.slice
+                return_values = [_type_name(element) for element in (elements.elts if isinstance(elements, ast.Tuple) else [elements])]
+
+            outputs = params.get("outputs") or []
+            send_outputs = params.get("send_outputs") or []
+            # node() starts the send outputs at the index of the last output
+            global_index = len(outputs) - 1 if outputs else 0
+
+            nodes[f"{module}.{func.name}"] = {
+                "name": func.name,
+                "module": module,
+                "inputs": {arg: type_name for arg, type_name in annotations.items() if arg in (params.get("inputs") or [])},
+                "settings": {arg: type_name for arg, type_name in annotations.items() if arg in (params.get("settings") or [])},
+                "outputs": {output: return_values[index] for index, output in enumerate(outputs)},
+                "trigger_inputs": {arg: type_name for arg, type_name in annotations.items() if arg in (params.get("trigger_inputs") or [])},
+                "send_outputs": {output: return_values[global_index + index] for index, output in enumerate(send_outputs)},
+                "concurrent": params["concurrent"],
+                "pure": params["pure"]
+            }
+    return nodes
+
+def load_node_manifest(directory: str = None, manifest_path: str = None) -> int:
+    """
+    Fills NODE_REGISTRY with the metadata of every node file, without importing them.
+
+    The metadata is read from the source of the @node decorators (see scan_node_file()) and kept
+    in a manifest file, so only files changed since the last start are read again. Modules are
+    imported by get_node() once a workflow that uses them is compiled.
+
+    Args:
+        directory (Optional[str]): The nodes directory. Default is the directory of this file.
+        manifest_path (Optional[str]): Where the manifest is kept. Default is MANIFEST_PATH.
+
+    Returns:
+        int: Number of nodes found.
+    """
+    directory = directory or NODES_DIR
+    manifest_path = manifest_path or MANIFEST_PATH
+
+    manifest = {"version": MANIFEST_VERSION, "files": {}}
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Rebuilding node manifest: {e}")
+        if manifest.get("version") != MANIFEST_VERSION:
+            manifest = {"version": MANIFEST_VERSION, "files": {}}
+
+    files = {}
+    changed = False
+    for dirpath, dirnames, file_names in os.walk(directory):
+        dirnames[:] = [dirname for dirname in dirnames if dirname != "__pycache__"]
+        for file_name in file_names:
+            if not file_name.endswith(".py") or file_name in ("__init__.py", "node_handler.py"):
+                continue
+
+            path = os.path.join(dirpath, file_name)
+            relative_path = os.path.relpath(path, directory)
+            stat = os.stat(path)
+            entry = manifest["files"].get(relative_path)
+            if entry is None or entry["mtime_ns"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+                module = relative_path[:-len(".py")].replace(os.sep, ".")
+                try:
+                    nodes = scan_node_file(path, module)
+                except (SyntaxError, ValueError) as e:
+                    print(f"Error reading nodes of: {relative_path} Error: {e}")
+                    nodes = {}
+                entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "nodes": nodes}
+                changed = True
+            files[relative_path] = entry
+
+    if changed or files.keys() != manifest["files"].keys():
+        manifest = {"version": MANIFEST_VERSION, "files": files}
+        try:
+            tmp_path = manifest_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(manifest, file, indent=4)
+            os.replace(tmp_path, manifest_path)
+        except OSError as e:
+            print(f"Error writing node manifest: {e}")
+
+    count = 0
+    for entry in files.values():
+        for node_type, metadata in entry["nodes"].items():
+            # Imported nodes already have their callable
+            if "callable" not in NODE_REGISTRY.get(node_type, {}):
+                NODE_REGISTRY[node_type] = metadata
+            count += 1
+    return count
+
+def get_node(node_type: str, registry: dict = None) -> dict:
+    """
+    Gets the metadata of a node, importing its module if it was only read from the manifest.
+
+    Returns:
+        dict: The NODE_REGISTRY entry, with "callable".
+
+    Raises:
+        ValueError: If the node is not registered or its module does not define it.
+        ImportError: If the module of the node cannot be imported, e.g. a missing dependency.
+    """
+    registry = NODE_REGISTRY if registry is None else registry
+    if node_type not in registry:
+        raise ValueError(f"Node type: {node_type} not in node registry")
+
+    node_data = registry[node_type]
+    if "callable" not in node_data:
+        module = "nodes." + node_data["module"]
+        # Registers the imported nodes with their callable
+        importlib.import_module(module)
+        node_data = NODE_REGISTRY.get(node_type, {})
+        if "callable" not in node_data:
+            raise ValueError(f"Node type: {node_type} not found in module {module}")
+        registry[node_type] = node_data
+    return node_data
+
 if __name__ == "__main__":
     import_nodes()
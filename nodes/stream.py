@@ -0,0 +1,28 @@
+from typing import Generator
+import json
+
+from modules.streams import buffered, tap
+from nodes.node_handler import node
+
+@node(inputs=["stream"], settings=["size"], outputs=["stream"])
+def buffer_stream(stream: Generator, size: int) -> tuple[Generator]:
+    """
+    Reads up to size chunks of a response stream ahead, so llama-server is not held up by a slow client.
+    """
+    return buffered(stream, int(size))
+
+def write_messages(stream, file_path):
+    with open(file_path, "a", encoding="utf-8") as file:
+        def write(chunk):
+            data = json.loads(chunk)
+            if data["type"] == "message":
+                file.write(data["value"])
+        yield from tap(stream, write)
+        file.write("\n")
+
+@node(inputs=["stream"], settings=["file_path"], outputs=["stream"])
+def save_stream(stream: Generator, file_path: str) -> tuple[Generator]:
+    """
+    Appends the text of a response stream to a file while it is sent.
+    """
+    return write_messages(stream, file_path)
@@ -3,7 +3,7 @@ import json
 
 from nodes.node_handler import node
 
-@node(settings=["string"], outputs=["string"])
+@node(settings=["string"], outputs=["string"], pure=True)
 def string_textbox(string: str) -> tuple[str]:
     return string
 
@@ -11,7 +11,7 @@ def string_textbox(string: str) -> tuple[str]:
 def print_string(string: str):
     print(string)
 
-@node(inputs=["stringA", "stringB"], outputs=["string"])
+@node(inputs=["stringA", "stringB"], outputs=["string"], pure=True)
 def concat_string(stringA: str, stringB: str) -> tuple[str]:
     return stringA + stringB
 
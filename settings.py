@@ -40,4 +40,16 @@ else:
 
 if must_includes > 0:
     print("Please add all required paths to config.json")
-    sys.exit(1)
\ No newline at end of file
+    sys.exit(1)
+
+# Optional config
+# Seconds between fsyncs of a conversation journal, 0 fsyncs on every save
+JOURNAL_FSYNC_INTERVAL = float(config.get("journal_fsync_interval", 1.0))
+# Journal records written before a conversation is compacted into a new snapshot
+JOURNAL_COMPACT_RECORDS = int(config.get("journal_compact_records", 200))
+# Threads that run the independent nodes of a workflow level at the same time
+WORKFLOW_MAX_WORKERS = int(config.get("workflow_max_workers", 4))
+# Items a copy of a workflow stream may fall behind the other copies, see modules.streams.tee()
+WORKFLOW_STREAM_BUFFER = int(config.get("workflow_stream_buffer", 1024))
+# Outputs of pure workflow nodes kept between runs, see nodes.node_handler.NodeCache
+NODE_CACHE_ENTRIES = int(config.get("node_cache_entries", 256))
@@ -1,3 +1,10 @@
+// Number of levels of a message address, "0.12.3" is 3 deep. Old addresses use one digit per level
+function addressDepth(address) {
+    if (address === "") return 0;
+    if (!address.includes(".")) return address.length;
+    return address.replace(/\.$/, "").split(".").length;
+}
+
 async function saveEditMessage(event) {
     const textEntryDiv = event.currentTarget;
     const inputText = textEntryDiv.value;
@@ -21,7 +28,7 @@ async function saveEditMessage(event) {
     // Remove irrelavent messages due to message change 
     // TODO: Add a way to switch to past unedited message
     const messagesDiv = document.getElementById("chat-messages")
-    while (messagesDiv.children.length > text_address.length) {
+    while (messagesDiv.children.length > addressDepth(text_address)) {
         messagesDiv.removeChild(messagesDiv.lastChild);
     }
 
@@ -61,6 +68,9 @@ async function saveEditMessage(event) {
         case "assistant_address":
             assistantMessageDiv.dataset.address = obj.value;
             break;
+        case "error":
+            assistantTextDiv.textContent = obj.value;
+            break;
         default:
             console.warn("Unknown chunk type:", obj.type);
         }
@@ -207,6 +217,10 @@ async function receiveMessage() {
     inputText.value = "";
 
     const parent = document.getElementById("chat-messages");
+    // The new message continues the branch after the last message shown, skipping failed responses
+    const lastMessageDiv = Array.from(parent.children).reverse().find(div => div.dataset.address);
+    const parentAddress = lastMessageDiv?.dataset.address ?? "";
+
     const userMessageDiv = await createMessageDiv("user", inputText);
     parent.appendChild(userMessageDiv);
 
@@ -219,7 +233,7 @@ async function receiveMessage() {
     const response = await fetch("/stream", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ text: inputText })
+        body: JSON.stringify({ text: inputText, address: parentAddress })
     });
 
     const reader = response.body.getReader();
@@ -247,6 +261,9 @@ async function receiveMessage() {
         case "assistant_address":
             assistantMessageDiv.dataset.address = obj.value;
             break;
+        case "error":
+            assistantTextDiv.textContent = obj.value;
+            break;
         default:
             console.warn("Unknown chunk type:", obj.type);
         }
@@ -303,7 +320,7 @@ async function loadChatList() {
         const chat = document.createElement("div");
         chat.classList.add("chat-list-section");
         chat.id = message.id;
-        chat.textContent = message.id; // Placeholder for now
+        chat.textContent = message.title || message.id;
         chat.role = "button";
 
         chat.addEventListener("click", () => {
@@ -323,28 +340,15 @@ async function loadChat(chatId) {
 
     const chat_message = document.getElementById("chat-messages");
     chat_message.innerHTML = "";
-    
-    // helper function to recursively read json
-    // message tree
-    async function loadChat_helper(curr, level){
-        const messageDiv = await createMessageDiv(curr.role, curr.text);
-        
-        chat_message.appendChild(messageDiv);
-        
-        if ("children" in curr) {
-            for (const child of curr.children) {
-                loadChat_helper(child, level + 1);
-            }
-        }
-        
-    }
-    
+
+    // Only the shown branch is sent, first message first
     const data = await response.json();
     chat_message.dataset.conv_id = data.id;
-    const message_list = data.messages
-    // Traverse json
-    for (const message of message_list) {
-        loadChat_helper(message, 0);
+    for (const message of data.messages) {
+        const messageDiv = await createMessageDiv(message.role, message.text);
+        messageDiv.dataset.address = message.address;
+        messageDiv.dataset.siblings = message.siblings;
+        chat_message.appendChild(messageDiv);
     }
 }
 
@@ -0,0 +1,123 @@
+import json
+import pytest
+
+pytest.importorskip("markdown")
+pytest.importorskip("requests")
+pytest.importorskip("psutil")
+from modules.message_manager import Conversation, SUMMARY_HEADER
+from modules.resources import ResourceRegistry
+from modules.slot_scheduler import SlotScheduler
+import nodes.agent as agent_module
+import nodes.Conversation.conversation as conversation_module
+import nodes.Conversation.summary as summary_module
+
+AGENT_INFO = {"agent_instruct": "", "agent_settings": {"max_length": 0}}
+
+
+class FakeModel:
+    def __init__(self, answers):
+        self.answers = answers
+        self.prompts = []
+
+    def generate(self, conversation, controller, settings, id_slot=None):
+        return "Bob introduced himself"
+
+    def generate_stream(self, conversation, controller, settings, id_slot=None, timings=None):
+        self.prompts.append(conversation)
+        answer = self.answers[len(self.prompts) - 1]
+        yield answer, False
+        yield len(answer.split()), True
+
+class FakeCounter:
+    def count(self, controller, text):
+        return len(text.split())
+
+    def count_branch(self, controller, conversation, address):
+        summary, messages = conversation.get_unsummarized(address)
+        for message in ([summary] if summary else []) + messages:
+            if message.tokens is None:
+                conversation.set_tokens(message, self.count(controller, message.text))
+
+class FakeController:
+    parallel = 1
+    profile = None
+    model_path = "model.gguf"
+
+    def __init__(self):
+        self.scheduler = SlotScheduler(1)
+
+@pytest.fixture
+def fake_agent(monkeypatch):
+    model = FakeModel(["hi Bob", "Your name is Bob", "Yes", "Bob"])
+    counter = FakeCounter()
+    resources = ResourceRegistry()
+    for module in (agent_module, summary_module):
+        monkeypatch.setattr(module, "model", model)
+        monkeypatch.setattr(module, "token_counter", counter)
+    for module in (conversation_module, summary_module):
+        monkeypatch.setattr(module, "RESOURCES", resources)
+    monkeypatch.setattr(agent_module, "system_prompt", None)
+    # Saving is not part of these tests
+    monkeypatch.setattr(Conversation, "save", lambda self: None)
+    return model, resources
+
+def send(message, address, controller, summarize=False):
+    # The nodes of a workflow run, in order
+    conversation, history = conversation_module.memory("You are the Archivist")
+    if summarize:
+        conversation = summary_module.summarize_context(conversation, address, controller, AGENT_INFO, 1, 2)
+    stream = agent_module.agent(message, address, "stream", controller, history, conversation, AGENT_INFO)
+    return [json.loads(chunk) for chunk in stream]
+
+def test_second_turn_without_address_keeps_history(fake_agent):
+    model, _ = fake_agent
+    controller = FakeController()
+    send("my name is Bob", "", controller)
+    chunks = send("what is my name?", "", controller)
+
+    assert chunks[0] == {"type": "user_address", "value": "0.0.0"}
+    assert model.prompts[1] == [{"role": "system", "content": "You are the Archivist"},
+                                {"role": "user", "content": "my name is Bob"},
+                                {"role": "assistant", "content": "hi Bob"},
+                                {"role": "user", "content": "what is my name?"}]
+
+def test_summary_node_summarizes_agent_branch(fake_agent):
+    model, resources = fake_agent
+    controller = FakeController()
+    send("my name is Bob", "", controller, summarize=True)
+    send("what is my name?", "", controller, summarize=True)
+    # Four messages now, the two oldest are summarized before the third turn
+    send("are you sure?", "", controller, summarize=True)
+    summarizer = resources.get(("summarizer",))
+    for thread in summarizer.threads.values():
+        thread.join(5)
+
+    send("what was it again?", "", controller)
+    assert model.prompts[3][0] == {"role": "system", "content": "You are the Archivist\n\n" + SUMMARY_HEADER + "Bob introduced himself"}
+    assert [message["content"] for message in model.prompts[3][1:]] == ["what is my name?", "Your name is Bob", "are you sure?",
+                                                                         "Yes", "what was it again?"]
+
+def test_new_conversation_is_not_continued(fake_agent):
+    model, _ = fake_agent
+    controller = FakeController()
+    send("my name is Bob", "", controller)
+    conversation_module.new_conversation()
+    chunks = send("what is my name?", "", controller)
+
+    assert chunks[0] == {"type": "user_address", "value": "0"}
+    assert model.prompts[1] == [{"role": "system", "content": "You are the Archivist"},
+                                {"role": "user", "content": "what is my name?"}]
+
+def test_text_max_length_is_reserved(fake_agent):
+    model, _ = fake_agent
+    controller = FakeController()
+    controller.profile = type("Profile", (), {"ctx_size": 28})()
+    agent_info = {"agent_instruct": "", "agent_settings": {"max_length": "10"}}
+    conversation, history = conversation_module.memory("You are the Archivist")
+    send("my name is Bob", "", controller)
+    stream = agent_module.agent("what is my name?", "", "stream", controller, history, conversation, agent_info)
+    [json.loads(chunk) for chunk in stream]
+
+    # 18 tokens left after the answer, the system prompt takes 8 and only the newest message fits
+    assert model.prompts[1][-1] == {"role": "user", "content": "what is my name?"}
+    assert len(model.prompts[1]) == 2
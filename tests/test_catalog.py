@@ -0,0 +1,45 @@
+from modules.catalog import get_catalog
+from modules.message_manager import Message_Node, Conversation
+
+
+def save_conversation(title: str) -> Conversation:
+    conv = Conversation()
+    conv.title = title
+    conv.add_message(Message_Node("user", "User", "Hello"), "")
+    conv.save()
+    return conv
+
+def test_save_updates_catalog(tmp_path, monkeypatch):
+    monkeypatch.setattr("settings.MEMORY_DIR", str(tmp_path))
+    conv = save_conversation("First")
+    conv.add_message(Message_Node("Archivist", "Assistant", "Hi"), "0")
+    conv.save()
+
+    entry = get_catalog().list()[0]
+    assert conv.find_conversation()
+    assert not Conversation().find_conversation()
+    assert entry["id"] == conv.conv_id
+    assert entry["title"] == "First"
+    assert entry["message_count"] == 2
+    assert entry["size"] > 0
+
+def test_list_pages_newest_first(tmp_path, monkeypatch):
+    monkeypatch.setattr("settings.MEMORY_DIR", str(tmp_path))
+    convs = [save_conversation(str(i)) for i in range(3)]
+    convs[0].title = "Updated"
+    convs[0].save()
+
+    catalog = get_catalog()
+    assert [entry["title"] for entry in catalog.list(limit=2)] == ["Updated", "2"]
+    assert [entry["title"] for entry in catalog.list(limit=2, offset=2)] == ["1"]
+
+def test_rebuild_from_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr("settings.MEMORY_DIR", str(tmp_path))
+    conv = save_conversation("Old")
+    conv.close()
+    catalog = get_catalog()
+    catalog.remove(conv.conv_id)
+
+    assert catalog.rebuild() == 1
+    assert catalog.exists(conv.conv_id)
+    assert catalog.list()[0]["title"] == "Old"
@@ -1,6 +1,7 @@
+import json
 import pytest
 
-from modules.message_manager import Message_Node, Conversation, MessageAddressError
+from modules.message_manager import Message_Node, Conversation, MessageAddressError, parse_address, format_address, MESSAGE_TOKEN_OVERHEAD, SUMMARY_HEADER
 
 
 def test_message_node_creation():
@@ -73,4 +74,199 @@ def test_get_conv_list():
 
     assert conv.get_conv_list() == [message1.to_json(), message2.to_json()]
 
-# TODO: add test case for loading json memory
\ No newline at end of file
+def test_more_than_ten_children():
+    conv = Conversation()
+    conv.add_message(Message_Node("Message 1", "User", "Hello"), "")
+
+    addresses = [conv.add_message(Message_Node(f"Reply {i}", "Assistant", str(i)), "0") for i in range(12)]
+
+    assert addresses[11] == "0.11"
+    assert conv.get_message("0.11").text == "11"
+    assert conv.add_message(Message_Node("Message 2", "User", "Hi"), "0.11") == "0.11.0"
+
+def test_multi_digit_first_message():
+    conv = Conversation()
+    for i in range(13):
+        address = conv.add_message(Message_Node(f"Message {i}", "User", str(i)), "")
+
+    assert address == "12."
+    assert conv.get_message("12.").text == "12"
+    assert conv.add_message(Message_Node("Reply", "Assistant", "Hi"), "12.") == "12.0"
+
+def test_parse_address():
+    assert parse_address("0.12.3") == (0, 12, 3)
+    assert parse_address("013") == (0, 1, 3)
+    assert parse_address("12.") == (12,)
+    assert parse_address("") == ()
+    assert format_address((0, 12, 3)) == "0.12.3"
+    assert format_address((12,)) == "12."
+
+    with pytest.raises(MessageAddressError):
+        parse_address("0.a")
+
+def test_delete_message_renumbers_siblings():
+    conv = Conversation()
+    conv.add_message(Message_Node("Message 1", "User", "Hello"), "")
+    conv.add_message(Message_Node("Reply 0", "Assistant", "0"), "0")
+    conv.add_message(Message_Node("Reply 1", "Assistant", "1"), "0")
+    deleted = conv.get_message("0.0")
+    conv.add_message(Message_Node("Message 2", "User", "Hi"), "0.1")
+
+    conv.delete_message("0.0")
+
+    assert conv.get_message("0.0").text == "1"
+    assert conv.get_message("0.0.0").address == "0.0.0"
+    assert deleted.id not in conv.index
+
+def test_get_message_by_id():
+    conv = Conversation()
+    conv.add_message(Message_Node("Message 1", "User", "Hello"), "")
+    message2 = Message_Node("Message 2", "Assistant", "Hi")
+    conv.add_message(message2, "0")
+
+    assert conv.get_message_by_id(message2.id) is message2
+    with pytest.raises(MessageAddressError):
+        conv.get_message_by_id("missing")
+
+def test_load_json_old_addresses():
+    conv = Conversation()
+    conv.load_json({
+        "id": "12345678-1234-1234-1234-123456789012",
+        "time": "1700000000.0",
+        "title": "Old",
+        "messages": [{
+            "name": "User", "role": "User", "id": "a", "text": "Hello", "time": 1, "address": "0",
+            "children": [{"name": "Assistant", "role": "Assistant", "id": "b", "text": "Hi", "time": 2, "address": "00"}]
+        }]
+    })
+
+    assert conv.get_message("00").id == "b"
+    assert conv.get_message("0.0").address == "0.0"
+    assert conv.get_message_by_id("b").parent.id == "a"
+    assert conv.get_conv_list_from_address("0.0") == [conv.get_message("0").to_json(), conv.get_message("0.0").to_json()]
+
+def make_deep_conversation(depth: int) -> Conversation:
+    conv = Conversation()
+    address = ""
+    for i in range(depth):
+        address = conv.add_message(Message_Node("user", "User", str(i)), address)
+    return conv
+
+def test_deep_conversation_traversal():
+    conv = make_deep_conversation(1500)
+
+    assert len(conv.get_conv_list()) == 1500
+    assert [depth for _, depth in conv.iter_depth_first()][-1] == 1499
+    assert len(conv.get_flat_json()["messages"]) == 1500
+
+def test_deep_conversation_load():
+    conv = make_deep_conversation(1500)
+    loaded = Conversation()
+
+    loaded.load_json(json.loads("".join(conv.iter_json(flat=True))))
+
+    assert loaded.get_conv_list() == conv.get_conv_list()
+
+def test_iter_json_matches_get_json():
+    conv = Conversation()
+    conv.add_message(Message_Node("Message 1", "User", "Hello"), "")
+    conv.add_message(Message_Node("Message 2", "Assistant", "Hi"), "0")
+    conv.add_message(Message_Node("Message 3", "Assistant", "Hey"), "0")
+    conv.add_message(Message_Node("Message 4", "User", "Bye"), "0.1")
+
+    assert json.loads("".join(conv.iter_json(chunk_size=10))) == conv.get_json()
+
+def test_get_context():
+    conv = Conversation()
+    conv.add_message(Message_Node("user", "User", "Hello"), "")
+    conv.add_message(Message_Node("Archivist", "Assistant", "Hi"), "0")
+    conv.add_message(Message_Node("Archivist", "Assistant", "Hey"), "0")
+    conv.add_message(Message_Node("user", "User", "Bye"), "0.1")
+
+    assert conv.get_context("0.1.0", "Be brief") == [
+        {"role": "system", "content": "Be brief"},
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "Hey"},
+        {"role": "user", "content": "Bye"},
+    ]
+    assert conv.get_context("0.0") == [{"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Hi"}]
+
+def test_get_context_reuses_cached_prefix():
+    conv = Conversation()
+    conv.add_message(Message_Node("user", "User", "Hello"), "")
+    conv.add_message(Message_Node("Archivist", "Assistant", "Hi"), "0")
+    conv.get_context("0.0")
+    conv.get_message("0").text = "Not read again"
+
+    conv.add_message(Message_Node("user", "User", "Bye"), "0.0")
+
+    assert conv.get_context("0.0.0")[0]["content"] == "Hello"
+
+def test_get_context_after_edit_and_delete():
+    conv = Conversation()
+    conv.add_message(Message_Node("user", "User", "Hello"), "")
+    conv.add_message(Message_Node("Archivist", "Assistant", "Hi"), "0")
+    conv.add_message(Message_Node("Archivist", "Assistant", "Hey"), "0")
+    conv.get_context("0.0")
+    conv.get_context("0.1")
+
+    conv.edit_message("0", "Hello there")
+    conv.delete_message("0.0")
+
+    assert conv.get_context("0.0") == [{"role": "user", "content": "Hello there"}, {"role": "assistant", "content": "Hey"}]
+
+def make_counted_conversation() -> Conversation:
+    conv = Conversation()
+    address = ""
+    for tokens in (100, 20, 30, 40):
+        address = conv.add_message(Message_Node("user", "User", str(tokens)), address)
+        conv.set_tokens(conv.get_message(address), tokens)
+    return conv
+
+def test_plan_context():
+    conv = make_counted_conversation()
+    overhead = MESSAGE_TOKEN_OVERHEAD
+
+    assert conv.get_token_sums("0.0.0.0")[-1] == 190 + 4 * overhead
+    assert conv.plan_context("0.0.0.0", 1000) == 4
+    assert conv.plan_context("0.0.0.0", 100, reserve=20) == 2
+    assert conv.plan_context("0.0.0.0", 100, reserve=20, system_tokens=10) == 1
+    assert conv.plan_context("0.0.0.0", 30) == 0
+
+def test_plan_context_needs_counts():
+    conv = make_counted_conversation()
+    conv.edit_message("0.0", "changed")
+
+    with pytest.raises(ValueError):
+        conv.plan_context("0.0.0.0", 1000)
+
+def test_recount_updates_token_sums():
+    conv = make_counted_conversation()
+    conv.get_token_sums("0.0.0.0")
+    conv.set_tokens(conv.get_message("0"), 50, "other.gguf")
+
+    assert conv.get_token_sums("0.0.0.0")[-1] == 140 + 4 * MESSAGE_TOKEN_OVERHEAD
+    assert conv.get_message("0").tokens_model == "other.gguf"
+
+def test_summary_replaces_covered_messages():
+    conv = make_counted_conversation()
+    conv.get_context("0.0.0.0")
+    conv.add_summary("0.0", "Said 100 and 20", tokens=10)
+    overhead = MESSAGE_TOKEN_OVERHEAD
+
+    assert conv.get_context("0.0.0.0", "Be brief") == [{"role": "system", "content": "Be brief\n\n" + SUMMARY_HEADER + "Said 100 and 20"},
+                                                      {"role": "user", "content": "30"}, {"role": "user", "content": "40"}]
+    assert conv.get_token_sums("0.0.0.0") == [10 + overhead, 40 + 2 * overhead, 80 + 3 * overhead]
+    # The summarized message itself still ends with its own messages
+    assert len(conv.get_context("0.0")) == 2
+
+def test_get_last_address_continues_shown_branch():
+    conv = Conversation()
+    assert conv.get_last_address() == ""
+
+    user_address = conv.add_message(Message_Node("user", "User", "my name is Bob"), conv.get_last_address())
+    conv.add_message(Message_Node("Archivist", "Assistant", "hi Bob"), user_address)
+    # Second turn sent without an address
+    user_address = conv.add_message(Message_Node("user", "User", "what is my name?"), conv.get_last_address())
+
+    assert [message["content"] for message in conv.get_context(user_address)] == ["my name is Bob", "hi Bob", "what is my name?"]
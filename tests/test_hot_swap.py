@@ -0,0 +1,93 @@
+import threading
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("psutil")
+from modules import hot_swap
+from modules.hot_swap import HotSwapController
+from modules.slot_scheduler import SlotScheduler
+
+
+class FakeProcess:
+    def poll(self):
+        return None
+
+
+class FakeController:
+    def __init__(self, llama_server_path, port, parallel=1, log_file=""):
+        self.port = port
+        self.devices = None
+        self.process = None
+        self.scheduler = SlotScheduler(parallel)
+        self.terminated = threading.Event()
+
+    def run(self, vision, model_path, devices, *args):
+        self.devices = devices
+        self.process = FakeProcess()
+
+    def wait_until_ready(self):
+        pass
+
+    def sync_slots(self):
+        pass
+
+    def terminate(self):
+        self.terminated.set()
+
+
+@pytest.fixture
+def swap(monkeypatch):
+    monkeypatch.setattr(hot_swap, "LlamaServerController", FakeController)
+    return HotSwapController("llama-server", base_port=6000, warm_pool_size=2, drain_timeout=5)
+
+
+def test_switch_moves_new_requests(swap):
+    first = swap.switch_model("a.gguf")
+    second = swap.switch_model("b.gguf")
+
+    assert first.port == 6000 and second.port == 6001
+    assert swap.select() is second
+    # Switching back to a warm model does not start a new llama-server
+    assert swap.switch_model("a.gguf") is first
+    assert not first.terminated.is_set()
+
+def test_warm_pool_eviction(swap):
+    first = swap.switch_model("a.gguf")
+    swap.switch_model("b.gguf")
+    swap.switch_model("c.gguf")
+
+    assert list(swap.warm) == ["b.gguf", "c.gguf"]
+    assert first.terminated.wait(2)
+    # The port of the stopped model is free again
+    assert swap.switch_model("d.gguf").port == 6000
+
+def test_drain_waits_for_selected_requests(swap):
+    swap.warm_pool_size = 1
+    first = swap.switch_model("a.gguf")
+    selected = swap.select()
+    swap.switch_model("b.gguf")
+
+    # The request selected the old model before the switch and has not reached its scheduler yet
+    assert not first.terminated.wait(0.3)
+    swap.release(selected)
+    assert first.terminated.wait(2)
+    assert swap.leases == {}
+
+def test_switch_with_text_port(monkeypatch):
+    monkeypatch.setattr(hot_swap, "LlamaServerController", FakeController)
+    # Ports come from the node settings as text
+    swap = HotSwapController("llama-server", base_port="6000", warm_pool_size=2)
+    swap.switch_model("a.gguf")
+
+    assert swap.switch_model("b.gguf").port == 6001
+
+def test_device_change_drains_old_server(swap):
+    first = swap.switch_model("a.gguf", "cuda0")
+    selected = swap.select()
+    second = swap.switch_model("a.gguf", "cuda1")
+
+    # The new server gets its own port, the old one keeps serving the selected request
+    assert second.port != first.port and swap.select() is second
+    assert not first.terminated.wait(0.3)
+    swap.release(selected)
+    assert first.terminated.wait(2)
@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+
+from modules.message_manager import Message_Node, Conversation
+from modules.journal import ConversationJournal
+
+
+def make_conversation(tmp_path, monkeypatch):
+    monkeypatch.setattr("settings.MEMORY_DIR", str(tmp_path))
+    conv = Conversation()
+    conv.add_message(Message_Node("user", "User", "Hello"), "")
+    conv.add_message(Message_Node("Archivist", "Assistant", "Hi"), "0")
+    conv.save()
+    return conv
+
+def load_conversation(tmp_path, conv_id):
+    conv = Conversation()
+    conv.load(os.path.join(tmp_path, conv_id + ".json"))
+    return conv
+
+def test_first_save_writes_snapshot(tmp_path, monkeypatch):
+    conv = make_conversation(tmp_path, monkeypatch)
+
+    assert os.path.exists(tmp_path / (conv.conv_id + ".json"))
+    assert not os.path.exists(tmp_path / (conv.conv_id + ".journal"))
+
+def test_replay_journal(tmp_path, monkeypatch):
+    conv = make_conversation(tmp_path, monkeypatch)
+    conv.add_message(Message_Node("user", "User", "Second"), "0.0")
+    conv.add_message(Message_Node("Archivist", "Assistant", "Other answer"), "0")
+    conv.edit_message("0", "Hello there")
+    conv.delete_message("0.0")
+    conv.title = "Greetings"
+    conv.save()
+    conv.close()
+
+    loaded = load_conversation(tmp_path, conv.conv_id)
+
+    assert loaded.get_json() == conv.get_json()
+    assert loaded.get_message("0.0").text == "Other answer"
+    assert loaded.title == "Greetings"
+
+def test_save_only_appends_changes(tmp_path, monkeypatch):
+    conv = make_conversation(tmp_path, monkeypatch)
+    conv.add_message(Message_Node("user", "User", "Second"), "0.0")
+    conv.save()
+    conv.save()
+    conv.close()
+
+    with open(tmp_path / (conv.conv_id + ".journal")) as file:
+        assert len(file.readlines()) == 1
+
+def test_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr("settings.JOURNAL_COMPACT_RECORDS", 3)
+    conv = make_conversation(tmp_path, monkeypatch)
+    address = "0.0"
+    for i in range(5):
+        address = conv.add_message(Message_Node("user", "User", str(i)), address)
+        conv.save()
+    conv.close()
+
+    assert conv.journal.records < 3
+    loaded = load_conversation(tmp_path, conv.conv_id)
+    assert loaded.get_message(address).text == "4"
+    assert loaded.get_json() == conv.get_json()
+
+def test_compaction_snapshot_off_request_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr("settings.JOURNAL_COMPACT_RECORDS", 2)
+    conv = make_conversation(tmp_path, monkeypatch)
+    threads = []
+    get_flat_json = conv.get_flat_json
+
+    def record_thread():
+        threads.append(threading.current_thread())
+        return get_flat_json()
+    monkeypatch.setattr(conv, "get_flat_json", record_thread)
+    conv.add_message(Message_Node("user", "User", "Second"), "0.0")
+    conv.add_message(Message_Node("user", "User", "Third"), "0.0.0")
+    conv.save()
+    conv.journal.compaction.join()
+    conv.close()
+
+    assert threads and threading.main_thread() not in threads
+    assert load_conversation(tmp_path, conv.conv_id).get_message("0.0.0.0").text == "Third"
+
+def test_idle_save_is_synced(tmp_path, monkeypatch):
+    fsyncs = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: fsyncs.append(fd) or fsync(fd))
+    journal = ConversationJournal("test", str(tmp_path), fsync_interval=0.1)
+    journal.append([{"op": "title", "title": "a"}])
+    journal.append([{"op": "title", "title": "b"}])
+
+    # Both appends were within the interval, one timer syncs them
+    assert fsyncs == []
+    time.sleep(0.3)
+    assert len(fsyncs) == 1
+    journal.close()
+
+def test_replay_summary(tmp_path, monkeypatch):
+    conv = make_conversation(tmp_path, monkeypatch)
+    conv.add_message(Message_Node("user", "User", "Second"), "0.0")
+    summary = conv.add_summary("0.0", "Greeted each other")
+    conv.set_tokens(summary, 5)
+    conv.save()
+    conv.close()
+
+    loaded = load_conversation(tmp_path, conv.conv_id)
+    assert loaded.get_context("0.0.0") == conv.get_context("0.0.0")
+    assert loaded.get_message("0.0").summary.tokens == 5
+
+    conv.journal.compact(conv.get_flat_json(), wait=True)
+    loaded = load_conversation(tmp_path, conv.conv_id)
+    assert loaded.get_json() == conv.get_json()
+
+def test_replay_tokens_model(tmp_path, monkeypatch):
+    conv = make_conversation(tmp_path, monkeypatch)
+    conv.set_tokens(conv.get_message("0"), 3, "model.gguf")
+    conv.save()
+    conv.close()
+
+    loaded = load_conversation(tmp_path, conv.conv_id)
+    assert loaded.get_message("0").tokens == 3
+    assert loaded.get_message("0").tokens_model == "model.gguf"
+
+def test_summary_during_save_is_kept(tmp_path, monkeypatch):
+    conv = make_conversation(tmp_path, monkeypatch)
+    conv.add_message(Message_Node("user", "User", "Second"), "0.0")
+    summarizer = threading.Thread(target=conv.add_summary, args=("0.0", "Greeted each other"))
+    append = conv.journal.append
+
+    # A background summary is added right after the records were written, before they are cleared
+    def append_then_summarize(records):
+        append(records)
+        summarizer.start()
+        time.sleep(0.1)
+    monkeypatch.setattr(conv.journal, "append", append_then_summarize)
+    conv.save()
+    summarizer.join()
+    monkeypatch.setattr(conv.journal, "append", append)
+    conv.save()
+    conv.close()
+
+    loaded = load_conversation(tmp_path, conv.conv_id)
+    assert loaded.get_message("0.0").summary.text == "Greeted each other"
+
+def make_branched_conversation(tmp_path, monkeypatch):
+    conv = make_conversation(tmp_path, monkeypatch)
+    for i in range(3):
+        address = conv.add_message(Message_Node("Archivist", "Assistant", f"Branch {i}"), "0")
+        conv.add_message(Message_Node("user", "User", f"Reply {i}"), address)
+    conv.save()
+    conv.journal.compact(conv.get_json(), wait=True)
+    conv.close()
+    return conv
+
+def test_lazy_load_active_path(tmp_path, monkeypatch):
+    conv = make_branched_conversation(tmp_path, monkeypatch)
+
+    lazy = Conversation()
+    lazy.load(os.path.join(tmp_path, conv.conv_id + ".json"), lazy=True)
+
+    assert [message.text for message in lazy.get_active_path()] == ["Hello", "Branch 2", "Reply 2"]
+    assert len(lazy.index) < len(conv.index)
+    assert lazy.message_count() == len(conv.index)
+    assert lazy.get_json() == conv.get_json()
+
+def test_lazy_load_branch_on_demand(tmp_path, monkeypatch):
+    conv = make_branched_conversation(tmp_path, monkeypatch)
+
+    lazy = Conversation()
+    lazy.load(os.path.join(tmp_path, conv.conv_id + ".json"), lazy=True)
+    path = lazy.get_path_json("0.1")["messages"]
+
+    assert [message["text"] for message in path] == ["Hello", "Branch 0", "Reply 0"]
+    assert path[1]["siblings"] == 4
+    assert lazy.get_message("0.1.0").text == "Reply 0"
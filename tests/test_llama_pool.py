@@ -0,0 +1,51 @@
+import time
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("psutil")
+from modules import llama_pool
+from modules.llama_pool import LlamaServerPool, InstanceConfig
+from modules.readiness import LlamaServerStartError
+from modules.slot_scheduler import SlotScheduler
+
+
+class FailingController:
+    def __init__(self, llama_server_path, port, parallel=1, log_file=""):
+        self.port = port
+        self.process = None
+        self.scheduler = SlotScheduler(parallel)
+        self.starts = 0
+
+    def run(self, vision, model_path, devices, *args, profile=None):
+        self.starts += 1
+
+    def wait_until_ready(self):
+        raise LlamaServerStartError(self.port, "exited with code 1")
+
+    def terminate(self):
+        pass
+
+    def get_health(self, verbose=True):
+        return 404
+
+    def get_slots(self):
+        return []
+
+def test_failed_restart_stays_in_health_checks(monkeypatch):
+    monkeypatch.setattr(llama_pool, "LlamaServerController", FailingController)
+    monkeypatch.setattr(llama_pool, "get_profile", lambda name, model_path: None)
+    pool = LlamaServerPool("llama-server", [InstanceConfig("model.gguf", 6001, "cuda0")], max_failures=1)
+    controller = pool.controllers[0]
+
+    pool.restart(controller)
+    status = pool.status[6001]
+    assert not status.draining
+    assert status.health == 404
+
+    # The next check finds it unhealthy again and restarts it in the background
+    pool.check()
+    deadline = time.monotonic() + 2
+    while (controller.starts < 2 or status.draining) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert controller.starts == 2
+    assert not status.draining
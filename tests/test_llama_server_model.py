@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("psutil")
+from modules.resources import ResourceRegistry
+import nodes.LLM.llama_server_model as llama_server_model
+
+
+class FakePool:
+    def __init__(self, llama_server_path, configs):
+        self.configs = configs
+        self.terminated = False
+
+    def start(self):
+        pass
+
+    def start_monitor(self):
+        pass
+
+    def terminate(self):
+        self.terminated = True
+
+def test_pool_restarts_on_changed_settings(monkeypatch):
+    monkeypatch.setattr(llama_server_model, "LlamaServerPool", FakePool)
+    monkeypatch.setattr(llama_server_model, "RESOURCES", ResourceRegistry())
+
+    first = llama_server_model.initalize_llama_server_pool("5001,5002", "a.gguf", "cuda0", 2)
+    assert llama_server_model.initalize_llama_server_pool("5001,5002", "a.gguf", "cuda0", 2) is first
+
+    second = llama_server_model.initalize_llama_server_pool("5001,5002", "b.gguf", "cuda0", 2)
+    assert second is not first and first.terminated
+    assert second.configs[0].model_path.endswith("b.gguf")
@@ -0,0 +1,31 @@
+from modules.metrics import MetricsRegistry
+
+
+def test_counter_renders_labels():
+    registry = MetricsRegistry()
+    requests_total = registry.counter("test_requests_total", "Requests.", ("route", "status"))
+    requests_total.labels("/stream", 200).inc()
+    requests_total.labels("/stream", 200).inc(2)
+
+    text = registry.render()
+    assert "# TYPE test_requests_total counter" in text
+    assert 'test_requests_total{route="/stream",status="200"} 3' in text
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("test_latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    latency.observe_many([0.05, 0.5, 5.0])
+
+    text = registry.render()
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3' in text
+    assert "test_latency_seconds_count 3" in text
+    assert "test_latency_seconds_sum 5.55" in text
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    errors = registry.counter("test_errors_total", "Errors.", ("reason",))
+    errors.labels('bad "quote"').inc()
+
+    assert 'reason="bad \\"quote\\""' in registry.render()
@@ -0,0 +1,46 @@
+from model import Model
+from modules.metrics import INTER_TOKEN_LATENCY
+
+SETTINGS = {"temperature": 0.7, "top_p": 1, "top_k": 40, "min_p": 0, "frequency_penalty": 0,
+            "presence_penalty": 0, "max_length": 0}
+
+
+class FakeResponse:
+    status_code = 200
+
+    def iter_content(self, chunk_size=None):
+        for token in ["a", "b", "c"]:
+            yield b'data: {"choices":[{"delta":{"content":"' + token.encode() + b'"}}]}\n\n'
+
+    def close(self):
+        pass
+
+class FakeClient:
+    def __init__(self):
+        self.bodies = []
+
+    def post(self, path, json=None, stream=False):
+        self.bodies.append(json)
+        return FakeResponse()
+
+class FakeController:
+    def __init__(self):
+        self.client = FakeClient()
+
+def test_token_gaps_recorded_on_disconnect():
+    before = sum(INTER_TOKEN_LATENCY.labels().counts)
+    stream = Model().generate_stream([], FakeController(), SETTINGS)
+    next(stream)
+    next(stream)
+    # Client disconnects after the second token
+    stream.close()
+
+    assert sum(INTER_TOKEN_LATENCY.labels().counts) == before + 1
+
+def test_max_length_caps_answer():
+    controller = FakeController()
+    list(Model().generate_stream([], controller, SETTINGS))
+    list(Model().generate_stream([], controller, dict(SETTINGS, max_length=512)))
+
+    assert "max_tokens" not in controller.client.bodies[0]
+    assert controller.client.bodies[1]["max_tokens"] == 512
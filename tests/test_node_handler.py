@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+import time
+
+from nodes.node_handler import NodeCache, NODE_REGISTRY, load_node_manifest, scan_node_file
+import nodes.string
+from nodes import node_handler
+from modules.resources import ResourceRegistry
+
+
+def test_node_cache_lru():
+    cache = NodeCache(max_entries=2)
+    first = cache.make_key("string.concat_string", ["a", "b"])
+    second = cache.make_key("string.concat_string", ["a", "c"])
+    third = cache.make_key("string.string_textbox", ["a"])
+
+    assert first == cache.make_key("string.concat_string", ["a", "b"])
+    assert cache.make_key("agent.agent", [object()]) is None
+
+    cache.put(first, "ab")
+    cache.put(second, "ac")
+    assert cache.get(first) == (True, "ab")
+    cache.put(third, "a")
+    assert cache.get(second) == (False, None)
+
+    cache.invalidate("string.concat_string")
+    assert cache.get(first) == (False, None)
+    assert cache.get(third) == (True, "a")
+
+def test_resource_created_once():
+    resources = ResourceRegistry()
+    created = []
+
+    def factory():
+        time.sleep(0.05)
+        created.append(object())
+        return created[-1]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(resources.get_or_create("server", factory))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert all(result is created[0] for result in results)
+
+def test_scan_matches_decorator():
+    static = scan_node_file(nodes.string.__file__, "string")
+
+    for node_type, metadata in static.items():
+        runtime = {key: value for key, value in NODE_REGISTRY[node_type].items() if key != "callable"}
+        assert metadata == runtime
+
+def test_manifest_reads_changed_files(tmp_path, monkeypatch):
+    monkeypatch.setattr("nodes.node_handler.NODE_REGISTRY", {})
+    manifest_path = str(tmp_path / "manifest.json")
+    os.makedirs(tmp_path / "nodes")
+    node_file = tmp_path / "nodes" / "sample.py"
+    node_file.write_text("@node(inputs=['text'], outputs=['text'], pure=True)\n"
+                         "def shout(text: str) -> tuple[str]:\n    return text.upper()\n")
+
+    assert load_node_manifest(str(tmp_path / "nodes"), manifest_path) == 1
+    assert node_handler.NODE_REGISTRY["sample.shout"]["outputs"] == {"text": "str"}
+
+    # Unchanged files are taken from the manifest
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+    manifest["files"]["sample.py"]["nodes"]["sample.shout"]["pure"] = "from manifest"
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file)
+    load_node_manifest(str(tmp_path / "nodes"), manifest_path)
+    assert node_handler.NODE_REGISTRY["sample.shout"]["pure"] == "from manifest"
+
+    node_file.write_text("@node(inputs=['text'], settings=['times'], outputs=['text'])\n"
+                         "def shout(text: str, times: int) -> tuple[str]:\n    return text.upper() * times\n")
+    load_node_manifest(str(tmp_path / "nodes"), manifest_path)
+    assert node_handler.NODE_REGISTRY["sample.shout"]["settings"] == {"times": "int"}
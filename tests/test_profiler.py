@@ -0,0 +1,32 @@
+import time
+
+from modules.profiler import WorkflowProfiler
+
+
+def slow_stream():
+    for i in range(3):
+        time.sleep(0.01)
+        yield str(i)
+
+def test_measure_and_stream():
+    profiler = WorkflowProfiler(trace_allocations=True)
+    assert profiler.measure("1", "string.concat_string", lambda a, b: a + b, "a", "b") == "ab"
+    assert list(profiler.wrap_stream("2", "agent.agent", slow_stream())) == ["0", "1", "2"]
+    profiler.close()
+
+    summary = profiler.summary()
+    assert [call["name"] for call in summary] == ["agent.agent (stream)", "string.concat_string"]
+    assert summary[0]["items"] == 3
+    assert summary[0]["wall_ms"] >= 30
+    assert "alloc" in summary[1]
+
+def test_chrome_trace():
+    profiler = WorkflowProfiler()
+    profiler.measure("1", "string.string_textbox", lambda: "Hello")
+    for _ in profiler.wrap_stream("2", "agent.agent", slow_stream()):
+        pass
+
+    events = profiler.to_chrome_trace()["traceEvents"]
+    assert [event["cat"] for event in events] == ["node", "stream"]
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+    assert events[1]["ts"] >= events[0]["ts"]
@@ -0,0 +1,35 @@
+import time
+import pytest
+
+pytest.importorskip("requests")
+from modules.readiness import ReadinessWatcher
+
+
+class LogController:
+    def __init__(self, output_file):
+        self.output_file = str(output_file)
+        self.launch_time = time.monotonic()
+
+
+def test_progress_from_log(tmp_path):
+    log = tmp_path / "llama_server_log.txt"
+    log.write_text("llama_model_loader: loaded meta data with 40 key-value pairs\nload_tensors: loading model tensors\n")
+    reports = []
+    watcher = ReadinessWatcher(LogController(log), on_progress=reports.append)
+
+    assert not watcher._read_log()
+    assert watcher.progress == {"stage": "tensors", "load_percent": 0, "warmup_done": False}
+
+    # The dots line grows while the model loads
+    with open(log, "a") as file:
+        file.write("." * 40)
+    watcher._read_log()
+    assert watcher.progress["load_percent"] == 40
+
+    with open(log, "a") as file:
+        file.write("." * 60 + "\nwarming up the model with an empty run\nmain: model loaded\n")
+    assert watcher._read_log()
+    assert watcher.progress == {"stage": "model_loaded", "load_percent": 100, "warmup_done": True}
+
+    assert [(report["stage"], report["load_percent"]) for report in reports] == [
+        ("metadata", 0), ("tensors", 0), ("tensors", 40), ("warmup", 100), ("model_loaded", 100)]
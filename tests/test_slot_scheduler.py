@@ -0,0 +1,90 @@
+import threading
+import pytest
+
+from modules.slot_scheduler import SlotScheduler, SlotUnavailableError
+
+
+def test_acquire_unique_slots():
+    scheduler = SlotScheduler(3)
+
+    slots = {scheduler.acquire(), scheduler.acquire(), scheduler.acquire()}
+
+    assert slots == {0, 1, 2}
+    assert scheduler.active == 3
+
+def test_acquire_timeout():
+    scheduler = SlotScheduler(1)
+    scheduler.acquire()
+
+    with pytest.raises(SlotUnavailableError):
+        scheduler.acquire(timeout=0.05)
+    assert scheduler.waiting == 0
+
+def test_queue_full():
+    scheduler = SlotScheduler(1, max_queue=0)
+    scheduler.acquire()
+
+    with pytest.raises(SlotUnavailableError):
+        scheduler.acquire(timeout=1)
+
+def test_release_wakes_waiter():
+    scheduler = SlotScheduler(1)
+    slot = scheduler.acquire()
+    result = []
+
+    waiter = threading.Thread(target=lambda: result.append(scheduler.acquire(timeout=5)))
+    waiter.start()
+    scheduler.release(slot)
+    waiter.join()
+
+    assert result == [slot]
+
+def test_resize():
+    scheduler = SlotScheduler(1)
+    with scheduler.slot() as slot:
+        scheduler.resize(4)
+        assert slot == 0
+        assert sorted(scheduler.free_slots) == [1, 2, 3]
+    assert sorted(scheduler.free_slots) == [0, 1, 2, 3]
+
+def test_conversation_affinity():
+    scheduler = SlotScheduler(2)
+    slot_a = scheduler.acquire(conv_id="a", address="0")
+    slot_b = scheduler.acquire(conv_id="b", address="0")
+    scheduler.release(slot_b)
+    scheduler.release(slot_a)
+
+    # Next turn of "a" lands on the slot holding its branch even though it was freed last
+    assert scheduler.acquire(conv_id="a", address="000") == slot_a
+    assert scheduler.cache_stats["affinity_hits"] == 1
+
+def test_branch_switch_uses_other_slot():
+    scheduler = SlotScheduler(2)
+    slot = scheduler.acquire(conv_id="a", address="0.0.1")
+    scheduler.release(slot)
+
+    assert scheduler.acquire(conv_id="a", address="0.0.10") != slot
+
+def test_lru_eviction():
+    scheduler = SlotScheduler(2)
+    for conv_id in ["a", "b", "c"]:
+        scheduler.release(scheduler.acquire(conv_id=conv_id, address="0"))
+
+    assert sorted(owner[0] for owner in scheduler.owners.values()) == ["b", "c"]
+    assert scheduler.cache_stats["evictions"] == 1
+
+def test_record_timings():
+    scheduler = SlotScheduler(1)
+
+    assert scheduler.record_timings(0, {"prompt_n": 10, "cache_n": 90}) == 90
+    assert scheduler.cache_stats["prompt_tokens"] == 100
+    assert scheduler.cache_stats["cached_tokens"] == 90
+
+def test_record_timings_per_slot():
+    scheduler = SlotScheduler(2)
+    scheduler.record_timings(0, {"prompt_n": 10, "cache_n": 90})
+    scheduler.record_timings(1, {"prompt_n": 50, "cache_n": 0})
+    scheduler.record_timings(0, {"prompt_n": 5, "cache_n": 100})
+
+    assert scheduler.slot_stats[0] == {"requests": 2, "prompt_tokens": 205, "cached_tokens": 190}
+    assert scheduler.slot_stats[1] == {"requests": 1, "prompt_tokens": 50, "cached_tokens": 0}
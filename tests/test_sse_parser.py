@@ -0,0 +1,64 @@
+import json
+
+from modules.sse_parser import SSEParser, DeltaEvent, FinishEvent, DoneEvent, iter_sse_events
+
+
+def frame(data: dict) -> bytes:
+    return b"data: " + json.dumps(data, separators=(",", ":")).encode("utf-8") + b"\n\n"
+
+def token(content: str) -> bytes:
+    return frame({"choices": [{"finish_reason": None, "index": 0, "delta": {"content": content}}]})
+
+def finish(reason: str) -> bytes:
+    return frame({"choices": [{"finish_reason": reason, "index": 0, "delta": {}}],
+                  "timings": {"predicted_n": 2}})
+
+
+def test_parse_tokens_and_done():
+    stream = token("Hello") + token(" world") + finish("stop") + b"data: [DONE]\n\n"
+
+    events = list(iter_sse_events([stream]))
+
+    assert events == [DeltaEvent("Hello"), DeltaEvent(" world"),
+                      FinishEvent("stop", {"predicted_n": 2}), DoneEvent()]
+
+def test_parse_split_chunks():
+    stream = token("héllo") + token("\n\"quoted\"") + finish("stop") + b"data: [DONE]\n\n"
+    chunks = [stream[i:i + 3] for i in range(0, len(stream), 3)]
+
+    assert list(iter_sse_events(chunks)) == list(iter_sse_events([stream]))
+    assert list(iter_sse_events(chunks))[:2] == [DeltaEvent("héllo"), DeltaEvent("\n\"quoted\"")]
+
+def test_skip_keep_alive_and_comments():
+    stream = b": ping\n\n\r\n" + token("a") + b":\n" + b"event: message\n" + token("b")
+
+    assert list(iter_sse_events([stream])) == [DeltaEvent("a"), DeltaEvent("b")]
+
+def test_crlf_frames():
+    stream = token("a").replace(b"\n", b"\r\n") + b"data: [DONE]\r\n\r\n"
+
+    assert list(iter_sse_events([stream])) == [DeltaEvent("a"), DoneEvent()]
+
+def test_other_finish_reasons():
+    for reason in ["length", "tool_calls"]:
+        events = list(iter_sse_events([finish(reason)]))
+        assert events == [FinishEvent(reason, {"predicted_n": 2})]
+
+def test_tool_call_delta():
+    tool_calls = [{"index": 0, "function": {"name": "search", "arguments": ""}}]
+    stream = frame({"choices": [{"finish_reason": None, "index": 0, "delta": {"tool_calls": tool_calls}}]})
+
+    assert list(iter_sse_events([stream])) == [DeltaEvent("", tool_calls)]
+
+def test_incomplete_frame_is_buffered():
+    parser = SSEParser()
+    stream = token("abc")
+
+    assert parser.feed(stream[:-3]) == []
+    assert parser.feed(stream[-3:]) == [DeltaEvent("abc")]
+    assert len(parser.buffer) == 0
+
+def test_malformed_frame_is_skipped():
+    stream = b"data: {not json}\n\n" + token("ok")
+
+    assert list(iter_sse_events([stream])) == [DeltaEvent("ok")]
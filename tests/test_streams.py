@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from modules.streams import buffered, tap, tee, StreamBufferError
+
+
+def test_buffered_reads_ahead_at_most_size():
+    produced = []
+
+    def producer():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    stream = buffered(producer(), size=4)
+    assert next(stream) == 0
+    time.sleep(0.2)
+    # One item taken, the buffer is full, and one more waits to be put in
+    assert len(produced) <= 6
+    assert list(stream) == list(range(1, 100))
+
+def test_buffered_raises_stream_error():
+    def producer():
+        yield 1
+        raise RuntimeError("llama-server went away")
+
+    stream = buffered(producer())
+    assert next(stream) == 1
+    with pytest.raises(RuntimeError):
+        next(stream)
+
+def test_tap_and_tee():
+    seen = []
+    first, second = tee(tap(iter(range(10)), seen.append), 2, max_buffer=8)
+
+    assert [next(first) for _ in range(4)] == [0, 1, 2, 3]
+    assert list(second) == list(range(10))
+    assert list(first) == list(range(4, 10))
+    assert seen == list(range(10))
+
+    first, second = tee(iter(range(10)), 2, max_buffer=4)
+    with pytest.raises(StreamBufferError):
+        list(first)
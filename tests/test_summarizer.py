@@ -0,0 +1,52 @@
+from modules.message_manager import Message_Node, Conversation
+from modules.summarizer import ContextSummarizer
+
+
+class FakeModel:
+    def __init__(self):
+        self.prompts = []
+
+    def generate(self, conversation, controller, settings, id_slot=None):
+        self.prompts.append(conversation)
+        return "Summary " + str(len(self.prompts))
+
+class FakeCounter:
+    def count(self, controller, text):
+        return len(text.split())
+
+    def count_branch(self, controller, conversation, address):
+        summary, messages = conversation.get_unsummarized(address)
+        for message in ([summary] if summary else []) + messages:
+            if message.tokens is None:
+                conversation.set_tokens(message, self.count(controller, message.text))
+
+def make_conversation(length: int) -> tuple[Conversation, str]:
+    conv = Conversation()
+    address = ""
+    for i in range(length):
+        address = conv.add_message(Message_Node("user", "User", "one two three four"), address)
+    return conv, address
+
+def test_summarize_below_threshold():
+    conv, address = make_conversation(4)
+    model = FakeModel()
+    summarizer = ContextSummarizer(model, FakeCounter(), token_threshold=1000, keep_messages=2)
+
+    assert summarizer.summarize(None, conv, address, {}, wait=True) is None
+    assert model.prompts == []
+
+def test_summarize_keeps_newest_messages():
+    conv, address = make_conversation(6)
+    model = FakeModel()
+    summarizer = ContextSummarizer(model, FakeCounter(), token_threshold=20, keep_messages=2)
+
+    summarizer.summarize(None, conv, address, {}, wait=True)
+    assert conv.get_message("0.0.0.0").summary.text == "Summary 1"
+    assert len(conv.get_context(address)) == 3
+
+    # The next summary builds on the previous one
+    address = conv.add_message(Message_Node("user", "User", "one two three four"), address)
+    address = conv.add_message(Message_Node("user", "User", "one two three four"), address)
+    summarizer.summarize(None, conv, address, {}, wait=True)
+    assert "Summary 1" in model.prompts[1][1]["content"]
+    assert len(conv.get_context(address)) == 3
@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("requests")
+from modules.message_manager import Message_Node, Conversation
+from modules.token_counter import TokenCounter
+
+
+class FakeResponse:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"tokens": [0] * self.tokens}
+
+class FakeClient:
+    connect_timeout = 1
+
+    def __init__(self, tokens_per_word):
+        self.tokens_per_word = tokens_per_word
+        self.texts = []
+
+    def post(self, path, json, timeout):
+        self.texts.append(json["content"])
+        return FakeResponse(len(json["content"].split()) * self.tokens_per_word)
+
+class FakeController:
+    def __init__(self, model_path, tokens_per_word):
+        self.model_path = model_path
+        self.client = FakeClient(tokens_per_word)
+
+def make_conversation() -> tuple[Conversation, str]:
+    conv = Conversation()
+    address = conv.add_message(Message_Node("user", "User", "my name is Bob"), "")
+    return conv, conv.add_message(Message_Node("Archivist", "Assistant", "hi Bob"), address)
+
+def test_branch_is_counted_once_per_model():
+    conv, address = make_conversation()
+    counter = TokenCounter()
+    small = FakeController("/models/small.gguf", 1)
+    counter.count_branch(small, conv, address)
+    counter.count_branch(small, conv, address)
+
+    assert small.client.texts == ["my name is Bob", "hi Bob"]
+    assert conv.get_token_sums(address)[-1] == 6 + 2 * 4
+
+def test_model_switch_counts_branch_again():
+    conv, address = make_conversation()
+    counter = TokenCounter()
+    counter.count_branch(FakeController("/models/small.gguf", 1), conv, address)
+    conv.get_token_sums(address)
+    large = FakeController("/models/large.gguf", 2)
+    counter.count_branch(large, conv, address)
+
+    assert large.client.texts == ["my name is Bob", "hi Bob"]
+    assert conv.get_message(address).tokens_model == "large.gguf"
+    assert conv.get_token_sums(address)[-1] == 12 + 2 * 4
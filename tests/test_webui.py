@@ -0,0 +1,113 @@
+import importlib.util
+import json
+import os
+import sys
+import types
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("markdown")
+pytest.importorskip("requests")
+pytest.importorskip("psutil")
+import settings
+from modules.message_manager import Message_Node, Conversation
+from modules.resources import ResourceRegistry
+from modules.slot_scheduler import SlotScheduler
+import nodes.agent as agent_module
+import nodes.Conversation.conversation as conversation_module
+import nodes.Conversation.summary as summary_module
+from nodes.trigger_events.on_message import on_message
+
+# webui.py shadows the webui folder as a module, so the folder is put in place as the package
+package = types.ModuleType("webui")
+package.__path__ = [os.path.join(settings.MAIN_DIR, "webui")]
+sys.modules.setdefault("webui", package)
+spec = importlib.util.spec_from_file_location("webui_app", os.path.join(settings.MAIN_DIR, "webui.py"))
+webui_app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(webui_app)
+
+AGENT_INFO = {"agent_instruct": "", "agent_settings": {"max_length": 0}}
+
+
+class FakeModel:
+    def generate(self, conversation, controller, settings, id_slot=None):
+        return "Bob introduced himself"
+
+    def generate_stream(self, conversation, controller, settings, id_slot=None, timings=None):
+        yield "Yes", False
+        yield 1, True
+
+class FakeCounter:
+    def count(self, controller, text):
+        return len(text.split())
+
+    def count_branch(self, controller, conversation, address):
+        summary, messages = conversation.get_unsummarized(address)
+        for message in ([summary] if summary else []) + messages:
+            if message.tokens is None:
+                conversation.set_tokens(message, self.count(controller, message.text))
+
+class FakeController:
+    parallel = 1
+    profile = None
+    model_path = "model.gguf"
+
+    def __init__(self):
+        self.scheduler = SlotScheduler(1)
+
+class FakeWorkflow:
+    """
+    Runs the nodes of the Archivist workflow in order, without llama-server.
+    """
+    func_tree = None
+
+    def __init__(self):
+        self.controller = FakeController()
+
+    def call_funcs(self, func_tree, trigger_inputs, executor="thread", streaming=False):
+        data = trigger_inputs["trigger_events.on_message.on_message"]
+        message, address, msg_type = on_message(data["message"], data["address"], data["msg_type"])
+        conversation, history = conversation_module.memory("You are the Archivist")
+        conversation = summary_module.summarize_context(conversation, address, self.controller, AGENT_INFO, 1, 2)
+        return agent_module.agent(message, address, msg_type, self.controller, history, conversation, AGENT_INFO)
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr("settings.MEMORY_DIR", str(tmp_path))
+    resources = ResourceRegistry()
+    for module in (agent_module, summary_module):
+        monkeypatch.setattr(module, "model", FakeModel())
+        monkeypatch.setattr(module, "token_counter", FakeCounter())
+    for module in (conversation_module, summary_module):
+        monkeypatch.setattr(module, "RESOURCES", resources)
+    monkeypatch.setattr(webui_app, "get_compiled_workflow", lambda name, registry: FakeWorkflow())
+    yield webui_app.app.test_client(), resources
+    resources.close_all()
+
+def test_message_after_load_chat_is_saved_in_loaded_chat(client, tmp_path):
+    client, resources = client
+    saved = Conversation()
+    for parent, role, text in [("", "user", "my name is Bob"), ("0", "Archivist", "hi Bob"),
+                               ("0.0", "user", "what is my name?"), ("0.0.0", "Archivist", "Your name is Bob")]:
+        saved.add_message(Message_Node(role, role.capitalize(), text), parent)
+    saved.close()
+
+    client.get("/new_chat")
+    shown = client.get(f"/load_chat/{saved.conv_id}").get_json()
+    last_address = shown["messages"][-1]["address"]
+    response = client.post("/stream", json={"text": "are you sure?", "address": last_address})
+    chunks = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    summarizer = resources.get(("summarizer",))
+    for thread in summarizer.threads.values():
+        thread.join(5)
+    # Starting a new chat saves the loaded one
+    client.get("/new_chat")
+
+    loaded = Conversation()
+    loaded.load(os.path.join(tmp_path, saved.conv_id + ".json"))
+    assert chunks[0] == {"type": "user_address", "value": last_address + ".0"}
+    assert loaded.get_message(last_address + ".0").text == "are you sure?"
+    assert loaded.get_message(last_address + ".0.0").text == "Yes"
+    summary, messages = loaded.get_unsummarized(last_address + ".0")
+    assert summary.text == "Bob introduced himself"
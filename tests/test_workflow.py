@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+import pytest
+
+import settings
+
+# webui.py shadows the webui folder as a module, so load the workflow manager from its file
+spec = importlib.util.spec_from_file_location("workflow_manager", os.path.join(settings.MAIN_DIR, "webui", "workflow_manager.py"))
+workflow_manager = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(workflow_manager)
+Workflow = workflow_manager.Workflow
+WorkflowGraphError = workflow_manager.WorkflowGraphError
+Func = workflow_manager.Func
+
+
+def make_workflow(node_count: int, edges: list) -> Workflow:
+    """
+    Builds a Drawflow workflow of node_count nodes, edges are (need, dependant) node ids.
+    """
+    data = {}
+    for i in range(1, node_count + 1):
+        data[str(i)] = {"id": i, "name": "string.concat_string", "data": {}, "inputs": {}, "outputs": {"output_1": {"connections": []}}}
+    for need, dependant in edges:
+        port = f"input_{len(data[str(dependant)]['inputs']) + 1}"
+        data[str(dependant)]["inputs"][port] = {"connections": [{"node": str(need), "input": "output_1"}]}
+        if str(need) in data:
+            data[str(need)]["outputs"]["output_1"]["connections"].append({"node": str(dependant), "output": port})
+
+    workflow = Workflow()
+    workflow.load_workflow({"drawflow": {"Home": {"data": data}}})
+    workflow.convert_to_nodes()
+    return workflow
+
+def test_node_tree_levels_and_critical_path():
+    # 1 -> 2 -> 4 and 1 -> 3, 5 on its own
+    workflow = make_workflow(5, [(1, 2), (2, 4), (1, 3)])
+    workflow.get_node_tree()
+
+    assert [[node.id for node in level] for level in workflow.node_tree] == [["1", "5"], ["2", "3"], ["4"]]
+    assert workflow.critical_path == {"1": 3, "2": 2, "3": 1, "4": 1, "5": 1}
+
+def test_node_tree_missing_need():
+    workflow = make_workflow(2, [(1, 2), (9, 2)])
+
+    with pytest.raises(WorkflowGraphError) as error:
+        workflow.get_node_tree()
+    assert error.value.node_ids == ["2"]
+    assert "missing node 9" in str(error.value)
+
+def test_node_tree_cycle():
+    # 2 and 3 need each other, 4 waits on the cycle
+    workflow = make_workflow(4, [(1, 2), (2, 3), (3, 2), (3, 4)])
+
+    with pytest.raises(WorkflowGraphError) as error:
+        workflow.get_node_tree()
+    assert error.value.node_ids == ["2", "3"]
+    assert error.value.unreachable == ["4"]
+
+def make_func(func_id: str, callable, inputs: list = None, concurrent: bool = True) -> Func:
+    # One output, so the return value is stored for later levels
+    return Func(func_id, callable, "test." + func_id, inputs or [], [], [{"node": "next", "output": 1}], {}, {}, concurrent)
+
+def test_threaded_level_runs_concurrently():
+    started = threading.Barrier(2, timeout=2)
+
+    def wait_for_other():
+        started.wait()
+        return "done"
+    level = [make_func("a", wait_for_other), make_func("b", wait_for_other)]
+    joined = make_func("c", lambda a, b: a + b, [{"node": "a", "input": 1}, {"node": "b", "input": 1}])
+
+    assert Workflow().call_funcs([level, [joined]], {}, executor="thread") == {"status": "success"}
+
+def test_threaded_first_failure_propagates():
+    def fail_first():
+        raise ValueError("first")
+
+    def fail_later():
+        time.sleep(0.2)
+        raise RuntimeError("later")
+
+    with pytest.raises(ValueError, match="first"):
+        Workflow().call_funcs([[make_func("a", fail_first), make_func("b", fail_later)]], {}, executor="thread")
+
+def test_threaded_failure_cancels_queued_siblings(monkeypatch):
+    # One worker, so the siblings of the failing node wait in the queue
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(workflow_manager, "node_pool", pool)
+    ran = []
+
+    def fail():
+        raise ValueError("failed")
+
+    def slow(idx):
+        time.sleep(0.05)
+        ran.append(idx)
+    level = [make_func("fail", fail)] + [make_func(str(idx), lambda idx=idx: slow(idx)) for idx in range(20)]
+
+    with pytest.raises(ValueError):
+        Workflow().call_funcs([level], {}, executor="thread")
+    pool.shutdown(wait=True)
+    # At most the sibling the worker took before the cancel ran
+    assert len(ran) <= 1
+
+def test_threaded_level_starts_longest_chain_first(monkeypatch):
+    # One worker, so the functions run in the order they were submitted
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(workflow_manager, "node_pool", pool)
+    workflow = Workflow()
+    workflow.critical_path = {"short": 1, "long": 3, "middle": 2}
+    order = []
+    level = [make_func(func_id, lambda func_id=func_id: order.append(func_id)) for func_id in ("short", "long", "middle")]
+
+    workflow.call_funcs([level], {}, executor="thread")
+    pool.shutdown(wait=True)
+    assert order == ["long", "middle", "short"]
+
+def test_threaded_non_concurrent_runs_after_level():
+    order = []
+
+    def record(name):
+        time.sleep(0.05)
+        order.append((name, threading.current_thread() is threading.main_thread()))
+    level = [make_func("alone", lambda: record("alone"), concurrent=False),
+             make_func("a", lambda: record("a")), make_func("b", lambda: record("b"))]
+
+    Workflow().call_funcs([level], {}, executor="thread")
+    assert sorted(order[:2]) == [("a", False), ("b", False)]
+    assert order[2] == ("alone", True)
+
+def test_async_runs_coroutines_together():
+    results = []
+
+    async def sleep_a():
+        await asyncio.sleep(0.2)
+        return "a"
+
+    async def sleep_b():
+        await asyncio.sleep(0.2)
+        return "b"
+    # Coroutine nodes are awaited together, the plain one runs in a thread
+    level = [make_func("a", sleep_a), make_func("b", sleep_b), make_func("c", lambda: "c")]
+    joined = make_func("d", lambda a, b, c: results.append(a + b + c),
+                       [{"node": "a", "input": 1}, {"node": "b", "input": 1}, {"node": "c", "input": 1}])
+
+    start = time.perf_counter()
+    assert asyncio.run(Workflow().call_funcs_async([level, [joined]], {})) == {"status": "success"}
+    assert time.perf_counter() - start < 0.35
+    assert results == ["abc"]
+
+def test_async_failure_cancels_level():
+    cancelled = []
+
+    async def fail():
+        raise ValueError("failed")
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    with pytest.raises(ValueError):
+        asyncio.run(Workflow().call_funcs_async([[make_func("a", fail), make_func("b", slow)]], {}))
+    assert cancelled == [True]
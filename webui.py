@@ -1,4 +1,4 @@
-from flask import Flask, Response, request, render_template
+from flask import Flask, Response, request, render_template, g
 import time
 import json
 import os
@@ -6,11 +6,15 @@ import threading
 import markdown
 
 import settings
-from nodes.node_handler import NODE_REGISTRY, import_nodes
-from webui.workflow_manager import Workflow, running_workflow
-from modules.message_manager import Conversation, Message_Node
+from nodes.node_handler import NODE_REGISTRY, load_node_manifest
+from webui.workflow_manager import Workflow, running_workflow, get_compiled_workflow
+from modules.message_manager import Conversation, Message_Node, MessageAddressError
+from modules.catalog import get_catalog
+from nodes.Conversation.conversation import get_conversation, new_conversation
 from webui.agent import Agent # Placeholder
 from llama_server_controller import LlamaServerController
+from modules.hot_swap import HotSwapController
+from modules.metrics import REGISTRY, STREAM_DURATION, WORKFLOW_COMPILE_SECONDS, HTTP_REQUEST_DURATION, HTTP_REQUESTS
 from model import Model
 
 from webui.agent_tab import agent_bp
@@ -18,34 +22,35 @@ from webui.agent_tab import agent_bp
 app = Flask(__name__)
 app.register_blueprint(agent_bp, url_prefix="/agent")
 
-current_conv = Conversation()
 controller = None
 
-def init_controller():
+def init_controller(model_name: str = "Qwen3-30B-A3B-Instruct-2507-UD-Q4_K_XL.gguf", devices: str = "Vulkan0,Vulkan1"):
+    """
+    Starts llama-server, or hot-swaps it to model_name if it is already running.
+
+    The previous model keeps serving until the new one is ready.
+    """
     global controller
     PORT_NUM = 5001
-    llama_server_path = os.path.join(settings.LLAMA_CPP_DIR, "llama-server")
-    controller = LlamaServerController(llama_server_path, PORT_NUM)
+    model_path = os.path.join(settings.LLMS_DIR, model_name)
 
-    # Settings
-    model_path = os.path.join(settings.LLMS_DIR, "Qwen3-30B-A3B-Instruct-2507-UD-Q4_K_XL.gguf")
-    devices = "Vulkan0,Vulkan1"
+    if controller is None:
+        llama_server_path = os.path.join(settings.LLAMA_CPP_DIR, "llama-server")
+        controller = HotSwapController(llama_server_path, PORT_NUM)
 
-    controller.run(False, model_path, devices)
+    controller.switch_model(model_path, devices)
 
 def health_check():
     global controller
     try:
         if controller is not None:
-            while controller.get_health() != 200:
-                print("Waiting for controller to be ready...")
-                time.sleep(2)
+            controller.ready.wait()
     except KeyboardInterrupt:
         print("\nInterrupted by user. Exiting.")
         os._exit(0)
 
 def init_model():
-    global controller, model, Archivist_settings, conversation_history, Archivist_instruct
+    global controller, model, Archivist_settings, Archivist_instruct
 
     # Initialize model and agent
     model = Model()
@@ -54,9 +59,30 @@ def init_model():
     Archivist_settings = Archivist.get_role_settings()
     Archivist_instruct = Archivist.get_role_instruct()
 
-    # Initial conversation history
-    conversation_history = []
-    conversation_history.append({"role": "system", "content": Archivist_instruct})
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Streaming routes are timed until their response object is returned, see timed_stream()
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    HTTP_REQUEST_DURATION.labels(route, request.method).observe(time.perf_counter() - g.request_start)
+    HTTP_REQUESTS.labels(route, request.method, response.status_code).inc()
+    return response
+
+def timed_stream(stream, start: float):
+    """
+    Passes a response stream through and records how long it took until the last chunk.
+    """
+    try:
+        yield from stream
+    finally:
+        STREAM_DURATION.observe(time.perf_counter() - start)
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/")
 def home():
@@ -99,18 +125,20 @@ def home():
 @app.route("/stream", methods=["POST"])
 def stream():
     data = request.json
+    start = time.perf_counter()
 
-    workflow = Workflow()
-    workflow.load_workflow_file("Archivist")
-    workflow.convert_to_nodes()
-    workflow.get_node_tree()
-    workflow.map_node_to_func(NODE_REGISTRY)
+    # Only compiled again after the workflow is saved
+    with WORKFLOW_COMPILE_SECONDS.time():
+        workflow = get_compiled_workflow("Archivist", NODE_REGISTRY)
 
-    on_message_data = {"message": data["text"], "address": "", "msg_type": "stream"}
+    # Address of the last message shown, the new message is added after it
+    on_message_data = {"message": data["text"], "address": data.get("address", ""), "msg_type": "stream"}
 
     trigger_inputs = {"trigger_events.on_message.on_message": on_message_data}
-    response_stream = workflow.call_funcs(workflow.func_tree, trigger_inputs)
-    return Response(response_stream, mimetype="application/json")
+    # Independent nodes of a level (e.g. loading the agent and starting llama-server) run at the same time
+    # The response stream goes through the stream nodes after the agent and is read as the client reads it
+    response_stream = workflow.call_funcs(workflow.func_tree, trigger_inputs, executor="thread", streaming=True)
+    return Response(timed_stream(response_stream, start), mimetype="application/json")
 
 
 # @app.route("/stream", methods=["POST"])
@@ -157,35 +185,61 @@ def stream():
 
 @app.route("/get_chat_list", methods=["GET"])
 def get_chat_list():
-    conv_list = os.listdir(settings.MEMORY_DIR)
-    data = []
-    for conv_id in conv_list:
-        data.append({"id": conv_id[:-5]})
+    # Most recently updated first, ?limit=50&offset=0 for paging
+    limit = request.args.get("limit", 50, type=int)
+    offset = request.args.get("offset", 0, type=int)
+    data = get_catalog().list(limit, offset)
 
     return Response(json.dumps(data), mimetype="application/json")
 
 @app.route("/load_chat/<chat_id>", methods=["GET"])
 def load_chat(chat_id):
-    global current_conv, conversation_history
+    # Loaded into the conversation the workflow nodes use, so the agent continues this chat
+    current_conv = get_conversation()
     if (not current_conv.is_empty()):
         current_conv.save()
 
+    # Only the shown branch is created, the others when switched to
     memory = os.path.join(settings.MEMORY_DIR, chat_id + ".json")
-    current_conv.load(memory)
-    conversation_history[:1]
+    current_conv.load(memory, lazy=True)
+
+    return Response(json.dumps(current_conv.get_path_json()), mimetype="application/json")
 
-    with open(memory, "r") as file:
-        json_data = json.load(file)
+@app.route("/load_branch/<chat_id>", methods=["GET"])
+def load_branch(chat_id):
+    """
+    Gets the branch going through ?address=, loading it if needed.
+    """
+    current_conv = get_conversation()
+    if current_conv.conv_id != chat_id:
+        return Response(json.dumps({"error": "Conversation is not loaded"}), status=409, mimetype="application/json")
+
+    address = request.args.get("address", "")
+    try:
+        data = current_conv.get_path_json(address)
+    except MessageAddressError as e:
+        return Response(json.dumps({"error": str(e)}), status=404, mimetype="application/json")
+
+    return Response(json.dumps(data), mimetype="application/json")
 
-    return Response(json.dumps(json_data), mimetype="application/json")
+@app.route("/export_chat/<chat_id>", methods=["GET"])
+def export_chat(chat_id):
+    """
+    Streams the whole conversation tree as json, in the flat format of the saved snapshots.
+    """
+    conv = get_conversation()
+    if conv.conv_id != chat_id:
+        conv = Conversation()
+        try:
+            conv.load(os.path.join(settings.MEMORY_DIR, chat_id + ".json"), lazy=True)
+        except FileNotFoundError:
+            return Response(json.dumps({"error": "Conversation not found"}), status=404, mimetype="application/json")
+
+    return Response(conv.iter_json(flat=True), mimetype="application/json")
 
 @app.route("/new_chat", methods=["GET"])
 def new_chat():
-    global current_conv, conversation_history
-    current_conv.save()
-    current_conv = Conversation()
-    conversation_history = []
-    conversation_history.append({"role": "system", "content": Archivist_instruct})
+    current_conv = new_conversation()
 
     return Response(json.dumps({"id": current_conv.conv_id}), mimetype="application/json")
 
@@ -197,6 +251,7 @@ if __name__ == "__main__":
 
     # health_check()
 
-    import_nodes()
+    # Node modules are imported when the workflow is compiled
+    load_node_manifest()
 
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -1,11 +1,11 @@
 from flask import Blueprint, request, Response, jsonify
 import json
 import os
-import copy
 
 import settings
-from nodes.node_handler import NODE_REGISTRY, import_nodes
-from webui.workflow_manager import Workflow, running_workflow
+from nodes.node_handler import NODE_REGISTRY, load_node_manifest
+from webui.workflow_manager import Workflow, running_workflow, invalidate_workflow
+from modules.profiler import WorkflowProfiler
 from webui.agent import Agent
 
 agent_bp = Blueprint("agent", __name__)
@@ -41,6 +41,7 @@ def save_workflow():
 
     with open(os.path.join(settings.AGENT_DIR, name, "workflow.json"), "w") as file:
         json.dump(workflow, file, indent=4)
+    invalidate_workflow(name)
 
     return Response(json.dumps({"status": 200}))
 
@@ -74,16 +75,37 @@ def new_workflow():
 
 @agent_bp.route("/run_agent_workflow", methods=["POST"])
 def run_workflow():
+    """
+    Runs a workflow from the editor once and reports how long every node took.
+
+    The body is the Drawflow export, with an optional "trigger_inputs" key for the trigger nodes.
+    ?trace=1 adds the run as Chrome trace-event json, ?allocations=1 also measures allocations.
+    """
     workflow_data = request.json
+    trigger_inputs = workflow_data.get("trigger_inputs", {})
 
     workflow = Workflow()
     workflow.load_workflow(workflow_data)
     workflow.convert_to_nodes()
     workflow.get_node_tree()
     workflow.map_node_to_func(NODE_REGISTRY)
-    workflow.call_funcs(NODE_REGISTRY)
 
-    json_data = [[node.to_json() for node in level] for level in workflow.node_tree]
+    profiler = WorkflowProfiler(trace_allocations=request.args.get("allocations", 0, type=int) == 1)
+    try:
+        result = workflow.call_funcs(workflow.func_tree, trigger_inputs, executor="thread", streaming=True, profiler=profiler)
+        # Read the response stream, so the time spent generating it is measured too
+        if not isinstance(result, dict):
+            for _ in result:
+                pass
+    finally:
+        profiler.close()
+
+    json_data = {
+        "node_tree": [[node.to_json() for node in level] for level in workflow.node_tree],
+        "profile": profiler.summary()
+    }
+    if request.args.get("trace", 0, type=int) == 1:
+        json_data["trace"] = profiler.to_chrome_trace()
 
     return Response(json.dumps(json_data), mimetype="application/json")
 
@@ -112,21 +134,21 @@ def add_workflow():
 
 IMPORT_NODES = False
 
-# Import custom python nodes
+# Register custom python nodes, their modules are imported when a workflow uses them
 def load_nodes():
     global IMPORT_NODES
     if (not IMPORT_NODES):
-        import_nodes()
+        load_node_manifest()
         IMPORT_NODES = True
 
 @agent_bp.route("/get_node_list", methods=["GET"])
 def get_node_list():
     load_nodes()
 
-    # Remove data not needed in frontend side
-    nodes = copy.deepcopy(NODE_REGISTRY)
-    for index, (node_name, node_data) in enumerate(nodes.items()):
-        del node_data["callable"]
+    # Remove data not needed in frontend side, nodes not imported yet have no callable
+    nodes = {}
+    for node_name, node_data in list(NODE_REGISTRY.items()):
+        nodes[node_name] = {key: value for key, value in node_data.items() if key != "callable"}
 
     return Response(json.dumps(nodes), mimetype="application/json")
 
@@ -1,12 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from dataclasses import dataclass, field
 from typing import Optional, List, Callable, Any, Generator
+import asyncio
+import inspect
 import json
 import os
+import threading
+import types
 
 import settings
+from modules.streams import tee
+from modules.profiler import WorkflowProfiler
+from nodes.node_handler import NODE_CACHE, get_node
 
 running_workflow = []
 
+# {agent name: (workflow.json path, mtime, size, compiled Workflow)}, see get_compiled_workflow()
+compiled_workflows = {}
+compiled_workflows_lock = threading.Lock()
+
+class StreamCopies:
+    """
+    Copies of a stream output connected to several inputs, every input takes its own copy.
+    """
+    def __init__(self, stream, n: int):
+        self.copies = tee(stream, n, settings.WORKFLOW_STREAM_BUFFER)
+
+    def take(self):
+        return self.copies.pop(0)
+
+# Shared by every workflow run with executor="thread", see get_node_pool()
+node_pool = None
+node_pool_lock = threading.Lock()
+
 @dataclass
 class Node:
     id: int
@@ -37,14 +63,26 @@ class Func:
     outputs: list
     trigger_inputs: dict
     send_outputs: dict
-
+    concurrent: bool = True
+    pure: bool = False
 
     def __str__(self):
         return (f"id - {self.id}, callable - {self.callable}, inputs - {self.inputs}, settings - {self.settings}, outputs - {self.outputs}, trigger inputs - {self.trigger_inputs}")
 
+class WorkflowGraphError(ValueError):
+    def __init__(self, reason: str, node_ids: list, unreachable: list = None):
+        self.reason = reason
+        self.node_ids = node_ids
+        self.unreachable = unreachable or []
+        msg = f"WorkflowGraphError: {reason} (nodes {', '.join(node_ids)})"
+        if self.unreachable:
+            msg += f", unreachable nodes after them: {', '.join(sorted(self.unreachable))}"
+        super().__init__(msg)
+
 class Workflow:
     def __init__(self):
         self.node_tree = []
+        self.critical_path = {}
 
     def load_workflow(self, json_data):
         self.workflow_JSON = json_data
@@ -97,120 +135,472 @@ class Workflow:
         Calculate the depth of nodes from start (depth=0) nodes to end (depth=nth) nodes.
         \nNodes with no inputs (i.e. no nodes feeding into it) are closer to start.
         \nNodes that require other nodes to be processed first are higher in depth.
-        """
-        old_seen = set()
-        new_seen = set()
-        for i in range(len(self.nodes)):
-            self.node_tree.append([])
-            for index, node in enumerate(self.nodes):
-                if (str(node.id) in new_seen):
-                    continue
-
-                set_needs = set([node["node"] for node in node.needs])
-
-                if (not set_needs.issubset(old_seen) and set_needs != old_seen):
-                    continue
+        \nA node is one level deeper than the deepest node it needs. Runs in O(nodes + connections).
 
-                self.node_tree[i].append(node)
-                new_seen.add(str(node.id))
-            old_seen = new_seen
+        Also sets critical_path, {node id: number of nodes on the longest chain from the node to an end node},
+        which call_level_threaded() uses to start the longest chains of a level first.
 
-        self.node_tree = [level for level in self.node_tree if level != []]
+        Raises:
+            WorkflowGraphError: If a node needs a node that is not in the workflow, or nodes need each other in a cycle.
+        """
+        nodes_by_id = {str(node.id): node for node in self.nodes}
+
+        # Number of connections each node still waits for, and the nodes waiting on each node
+        waiting = {}
+        dependants = {node_id: [] for node_id in nodes_by_id}
+        for node_id, node in nodes_by_id.items():
+            for need in node.needs:
+                need_id = str(need["node"])
+                if need_id not in nodes_by_id:
+                    raise WorkflowGraphError(f"needs missing node {need_id}", [node_id])
+                dependants[need_id].append(node_id)
+            waiting[node_id] = len(node.needs)
+
+        # Kahn's algorithm, one level at a time
+        self.node_tree = []
+        level = [node_id for node_id, count in waiting.items() if count == 0]
+        while level:
+            self.node_tree.append([nodes_by_id[node_id] for node_id in level])
+            next_level = []
+            for node_id in level:
+                for dependant_id in dependants[node_id]:
+                    waiting[dependant_id] -= 1
+                    if waiting[dependant_id] == 0:
+                        next_level.append(dependant_id)
+            level = next_level
+
+        scheduled = sum(len(level) for level in self.node_tree)
+        if scheduled != len(nodes_by_id):
+            blocked = {node_id for node_id, count in waiting.items() if count > 0}
+
+            # Remove the blocked nodes no other blocked node needs, until only the cycles are left
+            blocked_dependants = {node_id: sum(1 for dependant_id in dependants[node_id] if dependant_id in blocked) for node_id in blocked}
+            ends = [node_id for node_id, count in blocked_dependants.items() if count == 0]
+            unreachable = []
+            while ends:
+                node_id = ends.pop()
+                unreachable.append(node_id)
+                for need in nodes_by_id[node_id].needs:
+                    need_id = str(need["node"])
+                    if need_id in blocked_dependants:
+                        blocked_dependants[need_id] -= 1
+                        if blocked_dependants[need_id] == 0:
+                            ends.append(need_id)
+
+            cycle = [node_id for node_id in nodes_by_id if node_id in blocked and blocked_dependants[node_id] > 0]
+            raise WorkflowGraphError("nodes need each other in a cycle", cycle, unreachable)
+
+        # Longest chain to an end node, from the deepest level up
+        self.critical_path = {}
+        for level in reversed(self.node_tree):
+            for node in level:
+                node_id = str(node.id)
+                self.critical_path[node_id] = 1 + max((self.critical_path[dependant_id] for dependant_id in dependants[node_id]), default=0)
 
     def map_node_to_func(self, NODE_REGISTRY: dict):
         self.func_tree = []
         for i in range(len(self.node_tree)):
             self.func_tree.append([])
             for node in self.node_tree[i]:
-                if node.type not in NODE_REGISTRY:
-                    raise ValueError(f"Node type: {node.type} not in node registry")
+                # Imports the module of the node if it was only read from the manifest
+                node_data = get_node(node.type, NODE_REGISTRY)
 
                 #Check if all input in node has been filled
-                if len(node.needs) != len(NODE_REGISTRY[node.type]["inputs"]):
+                if len(node.needs) != len(node_data["inputs"]):
                     raise ValueError("Not all input has been filled.")
                 
 
                 # Dict of which function requires values as arguments from this function's return(s)
                 # Convert into {"node": id, input: port} format
-                for index in range(len(node.dependants)):
-                    node.dependants[index]["output"] = int(node.dependants[index]["output"].split("_")[1])
+                # New dicts, the nodes keep the port strings so they can be compiled again
+                dependants = [dict(dependant, output=int(dependant["output"].split("_")[1])) for dependant in node.dependants]
 
-                # TODO: Should probably be changed to deep copy of the nodes values
-                
                 # Dict of which which function this node needs as arguments
-                # Convert into {"N"}
-                for index in range(len(node.needs)):
-                    node.needs[index]["input"] = int(node.needs[index]["input"].split("_")[1])
+                # Convert into {"node": id, "input": port} format
+                needs = [dict(need, input=int(need["input"].split("_")[1])) for need in node.needs]
 
-                node_data = NODE_REGISTRY[node.type]
                 function_trigger_inputs = node_data["trigger_inputs"]
                 function_send_outputs = node_data["send_outputs"]
                 
-                function = Func(node.id, NODE_REGISTRY[node.type]["callable"], node.type, node.needs, node.settings, node.dependants, function_trigger_inputs, function_send_outputs)
+                function = Func(node.id, node_data["callable"], node.type, needs, node.settings, dependants,
+                                function_trigger_inputs, function_send_outputs, node_data.get("concurrent", True),
+                                node_data.get("pure", False))
                 self.func_tree[i].append(function)
 
-    def call_funcs(self, func_tree, trigger_inputs):
+    def get_args(self, func: Func, variables: dict, trigger_inputs: dict) -> list:
+        """
+        Collects the arguments of a function: trigger inputs, then outputs of earlier nodes, then settings.
+
+        Raises:
+            TypeError: If a trigger input has the wrong type.
+        """
+        args = []
+
+        # Check for any trigger events variables
+        for index, (arg_name, arg_type) in enumerate(func.trigger_inputs.items()):
+            recieved_arg_type = type(trigger_inputs[func.type][arg_name]).__name__
+            if recieved_arg_type != arg_type:
+                raise TypeError(f"Invalid type for function argument. Function: {func.type} with arg: {arg_name}, type: {arg_type}, instead got type: {recieved_arg_type}")
+
+            args.append(trigger_inputs[func.type][arg_name])
+
+        for input in func.inputs:
+            value = variables[input["node"]][input["input"]-1]
+            if isinstance(value, StreamCopies):
+                value = value.take()
+            args.append(value)
+
+        for index, setting in enumerate(func.settings):
+            args.append(setting[str(index+1)])
+
+        return args
+
+    def call_func(self, func: Func, variables: dict, trigger_inputs: dict, profiler: WorkflowProfiler = None):
+        """
+        Calls the function of a node with its arguments.
+
+        Pure nodes are answered from NODE_CACHE when they ran with the same arguments before.
+
+        Returns:
+            The return value of the function, None for nodes without outputs.
+        """
+        args = self.get_args(func, variables, trigger_inputs)
+        cache_key = NODE_CACHE.make_key(func.type, args) if func.pure else None
+        if cache_key is not None:
+            found, result = NODE_CACHE.get(cache_key)
+            if found:
+                if profiler is not None:
+                    profiler.measure(func.id, func.type, lambda: result, cached=True)
+                return result
+
+        if profiler is not None:
+            result = profiler.measure(func.id, func.type, self.run_callable, func, args)
+        else:
+            result = self.run_callable(func, args)
+
+        if len(func.outputs) + len(func.send_outputs) == 0:
+            return None
+        if cache_key is not None and not isinstance(result, types.GeneratorType):
+            NODE_CACHE.put(cache_key, result)
+        if profiler is not None:
+            result = self.profile_streams(func, result, profiler)
+        return result
+
+    def run_callable(self, func: Func, args: list):
+        result = func.callable(*args)
+        # Coroutine nodes outside of call_funcs_async()
+        if inspect.isawaitable(result):
+            result = asyncio.run(result)
+        return result
+
+    def profile_streams(self, func: Func, result, profiler: WorkflowProfiler):
         """
-        
+        Wraps the generators a node returned, so the time spent in them is recorded too.
+        """
+        if isinstance(result, types.GeneratorType):
+            return profiler.wrap_stream(func.id, func.type, result)
+        if type(result) == tuple:
+            return tuple(profiler.wrap_stream(func.id, func.type, value) if isinstance(value, types.GeneratorType) else value
+                         for value in result)
+        return result
+
+    def store_result(self, func: Func, result, variables: dict, consumers: dict = None):
+        """
+        Stores the return values of a node for later nodes.
+
+        Args:
+            consumers (Optional[dict]): {(node id, output port): number of connected inputs} in streaming mode,
+                        see call_funcs(). Generators are then stored like any value and passed to later nodes.
+
+        Returns:
+            Optional[Generator]: A generator returned by the node to send out of the workflow (e.g. the
+                    response stream for /stream), None if there is none.
+        """
+        if consumers is not None:
+            return self.store_stream_result(func, result, variables, consumers)
+
+        # The generator of a send output ends the workflow run
+        if isinstance(result, types.GeneratorType):
+            return result
+        if type(result) == tuple and func.send_outputs:
+            for value in result[-len(func.send_outputs):]:
+                if isinstance(value, types.GeneratorType):
+                    return value
+
+        # Store return values to retrieve them for later nodes
+        # unpack return values from functions
+        if result is None and len(func.outputs) == 0:
+            variables[func.id] = []
+        elif type(result) == tuple or type(result) == list:
+            variables[func.id] = list(result)
+        else:
+            variables[func.id] = [result]
+        return None
+
+    def store_stream_result(self, func: Func, result, variables: dict, consumers: dict):
+        if result is None and len(func.outputs) + len(func.send_outputs) == 0:
+            values = []
+        elif type(result) == tuple or type(result) == list:
+            values = list(result)
+        else:
+            values = [result]
+
+        stream = None
+        if func.send_outputs:
+            for value in values[-len(func.send_outputs):]:
+                if isinstance(value, types.GeneratorType):
+                    stream = value
+
+        for idx, value in enumerate(values):
+            if not isinstance(value, types.GeneratorType):
+                continue
+            count = consumers.get((func.id, idx + 1), 0)
+            # Unconnected streams are sent out, as in the non streaming mode
+            if count == 0 and stream is None:
+                stream = value
+            elif count > 1:
+                values[idx] = StreamCopies(value, count)
+
+        variables[func.id] = values
+        return stream
+
+    def call_funcs(self, func_tree, trigger_inputs, executor: str = "serial", streaming: bool = False,
+                   profiler: WorkflowProfiler = None):
+        """
+        Runs the compiled nodes level by level.
+
         trigger_inputs: {"function name":{"arg1_name": arg1, "arg2_name": arg2, ...}}
+
+        Args:
+            func_tree (list[list[Func]]): The levels from map_node_to_func().
+            trigger_inputs (dict): Values of the trigger nodes, see above.
+            executor (str): "serial" runs one node after another. "thread" runs the nodes of a level at the
+                        same time on a shared thread pool of settings.WORKFLOW_MAX_WORKERS threads. Nodes
+                        declared with @node(concurrent=False) run alone after the rest of their level.
+            streaming (bool): Whether generators flow between nodes. Nodes get the generators of earlier
+                        nodes as inputs and can return new ones that read them, so a response can be
+                        filtered or saved while it streams. The stream of a send output (or an unconnected
+                        stream output) is returned after every node ran. A stream connected to several
+                        inputs is split with modules.streams.tee(). Default returns the first generator
+                        a node returns, without running the later nodes.
+            profiler (Optional[WorkflowProfiler]): Records the time of every node call and of the streams they return.
+
+        Returns:
+            The generator sent out by a node, or {"status": "success"}.
+
+        Raises:
+            Exception: The first exception raised by a node. Nodes of its level that did not start yet are cancelled.
         """
+        if executor not in ("serial", "thread"):
+            raise ValueError(f"Unknown workflow executor: {executor}")
+
+        consumers = self.count_consumers(func_tree) if streaming else None
+        sent = None
+
         variables = {}
         for i in range(len(func_tree)):
-            print(variables)
-            for func in func_tree[i]:
-                func_trigger_inputs = [arg_name for index, (arg_name, arg) in enumerate(func.trigger_inputs.items())]
-
-                if len(func.inputs + func.settings + func_trigger_inputs) == 0:
-                    if len(func.outputs) == 0:
-                        func.callable()
-                    else:
-                        result = func.callable()
-                else:
-
-                    args = []
-
-                    # Check for any trigger events variables
-                    for index, (arg_name, arg_type) in enumerate(func.trigger_inputs.items()):
-                        recieved_arg_type = type(trigger_inputs[func.type][arg_name]).__name__
-                        if recieved_arg_type != arg_type:
-                            raise TypeError(f"Invalid type for function argument. Function: {func.type} with arg: {arg_name}, type: {arg_type}, instead got type: {recieved_arg_type}")
-                        
-                        args.append(trigger_inputs[func.type][arg_name])
-
-                    for input in func.inputs:
-                        args.append(variables[input["node"]][input["input"]-1])
-
-                    for index, setting in enumerate(func.settings):
-                        args.append(setting[str(index+1)])
-
-                    if len(func.outputs) + len(func.send_outputs) == 0:
-                        func.callable(*args)
-                    else:
-                        result = func.callable(*args)
-
-                # Assuming that generator from send_message is the last node to be processed
-                # probably should fix it but idk how
-                total_index = len(func.outputs) + len(func.send_outputs)
-                if type(result) == tuple:
-                    result = list(result)
-                    for i in range(len(result)):
-                        if type(result[i]) == Generator and ((i+1) >= total_index):
-                            return result[i]
-                else:
-                    if hasattr(type(result), "__name__"):
-                        if type(result).__name__ == "generator" and ((i+1) >= total_index):
-                            return result
-                
-                # Store return values to retrieve them for later nodes
-                # unpack return values from functions
-                variables[func.id] = []
-                if type(result) == tuple or type(result) == list:
-                    result = list(result)
-                    variables[func.id] = result
-                else:
-                    variables[func.id].append(result)
+            if executor == "serial":
+                for func in func_tree[i]:
+                    stream = self.store_result(func, self.call_func(func, variables, trigger_inputs, profiler), variables, consumers)
+                    if stream is not None and not streaming:
+                        return stream
+                    sent = sent or stream
+                continue
+
+            results = self.call_level_threaded(func_tree[i], variables, trigger_inputs, profiler)
+            streams = [self.store_result(func, results[func.id], variables, consumers) for func in func_tree[i]]
+            for stream in streams:
+                if stream is not None and not streaming:
+                    return stream
+                sent = sent or stream
+
+        if sent is not None:
+            return sent
+        return {"status": "success"}
+
+    def count_consumers(self, func_tree) -> dict:
+        """
+        Returns:
+            dict: {(node id, output port): number of inputs connected to the port}
+        """
+        consumers = {}
+        for level in func_tree:
+            for func in level:
+                for input in func.inputs:
+                    key = (input["node"], input["input"])
+                    consumers[key] = consumers.get(key, 0) + 1
+        return consumers
+
+    def call_level_threaded(self, level: list[Func], variables: dict, trigger_inputs: dict, profiler: WorkflowProfiler = None) -> dict:
+        """
+        Calls the functions of one level on the node pool, then the ones that cannot run concurrently.
+
+        Functions with the longest chain after them (see critical_path) are submitted first, so they
+        get a worker before shorter chains when the level has more functions than the pool has threads.
+
+        Returns:
+            dict: {func id: return value}
+        """
+        results = {}
+        concurrent_funcs = [func for func in level if func.concurrent]
+        concurrent_funcs.sort(key=lambda func: self.critical_path.get(str(func.id), 0), reverse=True)
+        # Nothing to overlap
+        if len(concurrent_funcs) == 1:
+            concurrent_funcs = []
+
+        if concurrent_funcs:
+            pool = get_node_pool()
+            futures = {pool.submit(self.call_func, func, variables, trigger_inputs, profiler): func for func in concurrent_funcs}
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+
+            for future in futures:
+                if future in done and future.exception() is not None:
+                    # Running nodes can not be stopped, only the ones still queued
+                    for pending in not_done:
+                        pending.cancel()
+                    raise future.exception()
+
+            for future, func in futures.items():
+                results[func.id] = future.result()
+
+        for func in level:
+            if func.id not in results:
+                results[func.id] = self.call_func(func, variables, trigger_inputs, profiler)
+        return results
+
+    async def call_funcs_async(self, func_tree, trigger_inputs, streaming: bool = False, profiler: WorkflowProfiler = None):
+        """
+        Runs the compiled nodes level by level on the running event loop, see call_funcs().
 
+        Coroutine nodes of a level are awaited together, other nodes run in threads with asyncio.to_thread.
+        Nodes declared with @node(concurrent=False) run alone after the rest of their level.
+
+        Raises:
+            Exception: The first exception raised by a node. The other nodes of its level are cancelled.
+        """
+        consumers = self.count_consumers(func_tree) if streaming else None
+        sent = None
+
+        variables = {}
+        for i in range(len(func_tree)):
+            level = func_tree[i]
+            results = {}
+
+            tasks = {asyncio.ensure_future(self.call_func_async(func, variables, trigger_inputs, profiler)): func
+                     for func in level if func.concurrent}
+            if tasks:
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in tasks:
+                    if task in done and task.exception() is not None:
+                        for pending_task in pending:
+                            pending_task.cancel()
+                        raise task.exception()
+                for task, func in tasks.items():
+                    results[func.id] = task.result()
+
+            for func in level:
+                if not func.concurrent:
+                    results[func.id] = await self.call_func_async(func, variables, trigger_inputs, profiler)
+
+            streams = [self.store_result(func, results[func.id], variables, consumers) for func in level]
+            for stream in streams:
+                if stream is not None and not streaming:
+                    return stream
+                sent = sent or stream
+
+        if sent is not None:
+            return sent
         return {"status": "success"}
 
+    async def call_func_async(self, func: Func, variables: dict, trigger_inputs: dict, profiler: WorkflowProfiler = None):
+        args = self.get_args(func, variables, trigger_inputs)
+        cache_key = NODE_CACHE.make_key(func.type, args) if func.pure else None
+        if cache_key is not None:
+            found, result = NODE_CACHE.get(cache_key)
+            if found:
+                if profiler is not None:
+                    profiler.measure(func.id, func.type, lambda: result, cached=True)
+                return result
+
+        if inspect.iscoroutinefunction(func.callable):
+            if profiler is not None:
+                result = await profiler.measure_async(func.id, func.type, func.callable, *args)
+            else:
+                result = await func.callable(*args)
+        elif profiler is not None:
+            if func.concurrent:
+                result = await asyncio.to_thread(profiler.measure, func.id, func.type, func.callable, *args)
+            else:
+                result = profiler.measure(func.id, func.type, func.callable, *args)
+        elif func.concurrent:
+            result = await asyncio.to_thread(func.callable, *args)
+        else:
+            result = func.callable(*args)
+
+        if len(func.outputs) + len(func.send_outputs) == 0:
+            return None
+        if cache_key is not None and not isinstance(result, types.GeneratorType):
+            NODE_CACHE.put(cache_key, result)
+        if profiler is not None:
+            result = self.profile_streams(func, result, profiler)
+        return result
+
     def run_node_tree(self):
-        pass
\ No newline at end of file
+        pass
+
+
+def get_node_pool() -> ThreadPoolExecutor:
+    """
+    Gets the thread pool that runs the nodes of a level at the same time, created on first use.
+    """
+    global node_pool
+    with node_pool_lock:
+        if node_pool is None:
+            node_pool = ThreadPoolExecutor(max_workers=settings.WORKFLOW_MAX_WORKERS, thread_name_prefix="workflow-node")
+    return node_pool
+
+def get_workflow_path(name: str) -> str:
+    return os.path.join(settings.AGENT_DIR, name, "workflow.json")
+
+def get_compiled_workflow(name: str, NODE_REGISTRY: dict) -> Workflow:
+    """
+    Gets the compiled workflow of an agent, compiling it only when its workflow.json changed.
+
+    Requests share the returned workflow, call_funcs() does not change it.
+
+    Args:
+        name (str): Name of the agent, its folder in the agent directory.
+        NODE_REGISTRY (dict): The registered nodes, see nodes.node_handler.
+
+    Returns:
+        Workflow: The workflow with its func_tree ready for call_funcs().
+
+    Raises:
+        FileNotFoundError: If the agent has no workflow.json.
+        ValueError: If a node of the workflow is not registered or has unconnected inputs.
+        WorkflowGraphError: If the nodes of the workflow cannot be ordered, see Workflow.get_node_tree().
+    """
+    path = get_workflow_path(name)
+    stat = os.stat(path)
+
+    with compiled_workflows_lock:
+        cached = compiled_workflows.get(name)
+        if cached is not None and cached[:3] == (path, stat.st_mtime_ns, stat.st_size):
+            return cached[3]
+
+    workflow = Workflow()
+    workflow.load_workflow_file(name)
+    workflow.convert_to_nodes()
+    workflow.get_node_tree()
+    workflow.map_node_to_func(NODE_REGISTRY)
+
+    with compiled_workflows_lock:
+        compiled_workflows[name] = (path, stat.st_mtime_ns, stat.st_size, workflow)
+    return workflow
+
+def invalidate_workflow(name: str):
+    """
+    Drops the compiled workflow of an agent, after its workflow.json was written.
+    """
+    with compiled_workflows_lock:
+        compiled_workflows.pop(name, None)
\ No newline at end of file